@@ -1,6 +1,17 @@
 from django.contrib import admin
-from .models import CustomUser, ChatRoom, Message
+from .models import CustomUser, ChatRoom, Job, Message
+
+
+class MessageAdmin(admin.ModelAdmin):
+    list_select_related = ('sender',)  # Message.__str__ uses sender.username
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'attempts', 'run_at', 'last_error')
+    list_filter = ('status', 'kind')
+
 
 admin.site.register(CustomUser)
 admin.site.register(ChatRoom)
-admin.site.register(Message)
+admin.site.register(Message, MessageAdmin)
+admin.site.register(Job, JobAdmin)
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .persistence import get_allocator, is_batched
+        from .search import select_search_backend
+
+        if is_batched():
+            # Fail at startup, not on the first message
+            get_allocator()
+        select_search_backend()
@@ -0,0 +1,210 @@
+# chat/archive.py
+"""
+Hot/cold storage for message history.
+
+``chat_message`` keeps each room's recent messages. Messages older than the
+room's horizon (``ChatRoom.archive_after_days``, else
+``CHAT_ARCHIVE_AFTER_DAYS``) are moved, oldest first, into
+``ArchivedSegment`` rows. Each row holds up to ``CHAT_ARCHIVE_SEGMENT_SIZE``
+consecutive messages of one room as a single zlib-compressed msgpack blob.
+Moving them keeps the hot table and its indexes small.
+
+* Archival cuts each room at one message id: everything below the first
+  message inside the horizon moves. Hot and archived history therefore never
+  interleave. ``get_history_page()`` reads the hot table first and continues
+  into the segments only once a page reaches below ``ChatRoom.archived_up_to``.
+  Rooms that have never been archived cost no extra query.
+* Media references move with the message to an ``ArchivedAttachment`` row,
+  so attachment URLs keep working and the files stay referenced.
+* Archived messages are no longer found by message search.
+* Tombstones (soft-deleted messages) older than
+  ``CHAT_ARCHIVE_TOMBSTONE_GRACE_DAYS`` are deleted outright rather than archived.
+
+Run it with ``manage.py chat_archive``, or let the job worker schedule it
+every ``CHAT_ARCHIVE_INTERVAL`` seconds (see chat/jobs.py).
+"""
+import time
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import msgpack
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min, Q, Sum
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from .models import ArchivedAttachment, ArchivedSegment, ChatRoom, CustomUser, Message, SearchPosting
+
+# Column order of an archived row
+FIELDS = ("id", "sender_id", "content", "media", "media_thumbnail", "media_compressed", "timestamp", "is_read", "is_deleted")
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+class ArchiveConflict(Exception):
+    """Rows picked for a segment changed before they could be moved."""
+
+
+# -------------------------
+# Encoding
+# -------------------------
+def encode_rows(rows):
+    packed = [
+        [msg_id, sender_id, content, media or "", thumb or "", compressed or "",
+         (ts - _EPOCH) // _MICROSECOND, is_read, is_deleted]
+        for msg_id, sender_id, content, media, thumb, compressed, ts, is_read, is_deleted in rows
+    ]
+    return zlib.compress(msgpack.packb(packed), 6)
+
+
+def decode_rows(data):
+    rows = msgpack.unpackb(zlib.decompress(bytes(data)), raw=False)
+    for row in rows:
+        row[6] = _EPOCH + row[6] * _MICROSECOND
+    return rows
+
+
+# -------------------------
+# Archiving
+# -------------------------
+def room_horizon(room, now=None):
+    """Messages of ``room`` older than this move to the archive; ``None`` if the room is never archived."""
+    days = room.archive_after_days if room.archive_after_days is not None else settings.CHAT_ARCHIVE_AFTER_DAYS
+    if not days:
+        return None
+    return (now or timezone.now()) - timedelta(days=days)
+
+
+def archive_rows(room_id, rows):
+    """Move ``rows`` (tuples in ``FIELDS`` order, ascending id) into one segment."""
+    ids = [row[0] for row in rows]
+    attachments = [
+        ArchivedAttachment(message_id=row[0], room_id=room_id, media=row[3], media_thumbnail=row[4], media_compressed=row[5])
+        for row in rows if row[3] or row[4] or row[5]
+    ]
+    with transaction.atomic():
+        ArchivedSegment.objects.create(
+            room_id=room_id, first_id=ids[0], last_id=ids[-1], message_count=len(ids), data=encode_rows(rows),
+        )
+        ArchivedAttachment.objects.bulk_create(attachments)
+        # Raw deletes: no post_delete signal, so the media references carry over
+        # to the attachment rows instead of being released
+        SearchPosting.objects.filter(message_id__in=ids)._raw_delete(Message.objects.db)
+        moved = Message.objects.filter(id__in=ids)._raw_delete(Message.objects.db)
+        if moved != len(ids):
+            # Another archiver (or a delete) got there first
+            raise ArchiveConflict(room_id)
+        ChatRoom.objects.filter(Q(archived_up_to__isnull=True) | Q(archived_up_to__lt=ids[-1]), id=room_id).update(
+            archived_up_to=ids[-1],
+        )
+
+
+def archive_room(room, deadline=None, now=None):
+    """
+    Archive ``room``'s messages older than its horizon. Stops early once
+    ``time.monotonic()`` passes ``deadline``. Returns the messages moved.
+    """
+    horizon = room_horizon(room, now)
+    if horizon is None:
+        return 0
+    # Cut at an id, not a time, so the hot table keeps a contiguous id suffix
+    boundary = Message.objects.filter(room=room, timestamp__gte=horizon).aggregate(first=Min("id"))["first"]
+    remaining = Message.objects.filter(room=room)
+    if boundary is not None:
+        remaining = remaining.filter(id__lt=boundary)
+
+    moved = 0
+    while deadline is None or time.monotonic() < deadline:
+        rows = list(remaining.order_by("id").values_list(*FIELDS)[:settings.CHAT_ARCHIVE_SEGMENT_SIZE])
+        if not rows:
+            break
+        archive_rows(room.id, rows)
+        moved += len(rows)
+    return moved
+
+
+def purge_tombstones(room=None, grace_days=None, now=None):
+    """Delete soft-deleted messages older than the grace period. Returns the rows removed."""
+    grace_days = settings.CHAT_ARCHIVE_TOMBSTONE_GRACE_DAYS if grace_days is None else grace_days
+    cutoff = (now or timezone.now()) - timedelta(days=grace_days)
+    tombstones = Message.objects.filter(is_deleted=True, timestamp__lt=cutoff)
+    if room is not None:
+        tombstones = tombstones.filter(room=room)
+    purged = 0
+    while True:
+        ids = list(tombstones.values_list("id", flat=True)[:settings.CHAT_ARCHIVE_SEGMENT_SIZE])
+        if not ids:
+            return purged
+        # Regular delete: a tombstone still carrying media releases it
+        purged += Message.objects.filter(id__in=ids).delete()[1].get(Message._meta.label, 0)
+
+
+def archive_messages(rooms=None, deadline=None):
+    """
+    Purge old tombstones, then archive every room (or ``rooms``) past its
+    horizon. Returns ``(purged, archived, finished)``. ``finished`` is ``False``
+    if ``deadline`` cut the run short.
+    """
+    now = timezone.now()
+    if rooms is None:
+        purged = purge_tombstones(now=now)
+        rooms = list(ChatRoom.objects.only("id", "archive_after_days"))
+    else:
+        purged = sum(purge_tombstones(room, now=now) for room in rooms)
+    archived = 0
+    for room in rooms:
+        if deadline is not None and time.monotonic() >= deadline:
+            return purged, archived, False
+        archived += archive_room(room, deadline=deadline, now=now)
+    return purged, archived, deadline is None or time.monotonic() < deadline
+
+
+def archive_stats():
+    """Row counts and sizes of the hot table and the archive."""
+    segments = ArchivedSegment.objects.aggregate(messages=Sum("message_count"), stored=Sum(Length("data")))
+    return {
+        "hot_messages": Message.objects.count(),
+        "tombstones": Message.objects.filter(is_deleted=True).count(),
+        "segments": ArchivedSegment.objects.count(),
+        "archived_messages": segments["messages"] or 0,
+        "archived_bytes": segments["stored"] or 0,
+    }
+
+
+# -------------------------
+# Reading
+# -------------------------
+def read_archive(room_id, before=None, count=50):
+    """
+    Up to ``count`` archived messages of room ``room_id`` with an id below
+    ``before``, newest first, as unsaved ``Message`` instances with their
+    sender loaded. Only the segments needed are fetched and decoded.
+    """
+    segments = ArchivedSegment.objects.filter(room_id=room_id).order_by("-last_id")
+    if before is not None:
+        segments = segments.filter(first_id__lt=before)
+
+    rows = []
+    # Segments are a few hundred rows each; one or two cover a page
+    for segment in segments.only("data").iterator(chunk_size=2):
+        for row in reversed(decode_rows(segment.data)):
+            if before is None or row[0] < before:
+                rows.append(row)
+        if len(rows) >= count:
+            break
+
+    rows = rows[:count]
+    senders = CustomUser.objects.in_bulk({row[1] for row in rows})
+    page = []
+    for msg_id, sender_id, content, media, thumb, compressed, ts, is_read, is_deleted in rows:
+        if sender_id not in senders:
+            # The sender's account is gone; their live messages went with it
+            continue
+        msg = Message(
+            id=msg_id, room_id=room_id, sender=senders[sender_id], content=content,
+            media=media or None, media_thumbnail=thumb or None, media_compressed=compressed or None,
+            timestamp=ts, is_read=is_read, is_deleted=is_deleted,
+        )
+        page.append(msg)
+    return page
@@ -0,0 +1,84 @@
+# chat/codecs.py
+"""
+Wire codecs for the chat WebSocket, picked per connection by subprotocol.
+
+* ``chat.json.v1``    – JSON text frames (also used when no subprotocol is offered).
+                        Binary frames are raw upload chunks.
+* ``chat.msgpack.v1`` – msgpack binary frames; upload chunks travel as
+                        ``{"action": "upload_chunk", "upload_id", "data": <bin>}``.
+
+Every inbound frame decodes to a dict and every outbound payload is a dict,
+so the consumers never deal with the encoding themselves.
+"""
+import json
+
+import msgpack
+
+
+class JSONCodec:
+    subprotocol = "chat.json.v1"
+    binary = False
+
+    def encode(self, payload):
+        return json.dumps(payload)
+
+    def decode(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            return {"action": "upload_chunk", "data": bytes_data}
+        return json.loads(text_data)
+
+
+class MsgpackCodec:
+    subprotocol = "chat.msgpack.v1"
+    binary = True
+
+    def encode(self, payload):
+        return msgpack.packb(payload, use_bin_type=True)
+
+    def decode(self, text_data=None, bytes_data=None):
+        if bytes_data is None:
+            # Tolerate a stray text frame from a client that forgot to switch
+            return json.loads(text_data)
+        return msgpack.unpackb(bytes_data, raw=False)
+
+
+CODECS = {codec.subprotocol: codec for codec in (JSONCodec(), MsgpackCodec())}
+DEFAULT_CODEC = CODECS[JSONCodec.subprotocol]
+
+
+def negotiate(offered):
+    """Return the first offered codec we support, or ``None`` if none match."""
+    for subprotocol in offered:
+        if subprotocol in CODECS:
+            return CODECS[subprotocol]
+    return None
+
+
+def encode_all(payload):
+    """Encode ``payload`` once per codec, keyed by subprotocol, for channel-layer broadcasts."""
+    return {name: codec.encode(payload) for name, codec in CODECS.items()}
+
+
+class CodecMixin:
+    codec = DEFAULT_CODEC
+
+    async def accept_with_codec(self):
+        codec = negotiate(self.scope.get("subprotocols", []))
+        if codec is None:
+            await self.accept()
+        else:
+            self.codec = codec
+            await self.accept(subprotocol=codec.subprotocol)
+
+    async def send_frame(self, payload):
+        await self.send_encoded(self.codec.encode(payload))
+
+    async def send_encoded(self, frame):
+        if self.codec.binary:
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
+
+    async def forward_frames(self, event):
+        # Encoded once by the sender for every codec; pick ours and forward as-is
+        await self.send_encoded(event["frames"][self.codec.subprotocol])
@@ -170,17 +170,27 @@ class GroupChatConsumer(AsyncWebsocketConsumer):
         return f"{time_str}, {day_str}"
 '''
 
-import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from django.contrib.auth import get_user_model
 from channels.db import database_sync_to_async
+from .codecs import CodecMixin
+from .frames import message_frame
 from .models import Message, ChatRoom
+from .persistence import BufferFull, persist_message
+from .presence import EPHEMERAL_ACTIONS, PresenceMixin
+from .ratelimit import RateLimitMixin
+from .receipts import ReadReceiptMixin
+from .rooms import get_private_room, is_room_member, room_group_name
+from .uploads import ChunkedUploadMixin
 from datetime import timedelta
 from django.utils import timezone
 
 User = get_user_model()
 
-class PrivateChatConsumer(AsyncWebsocketConsumer):
+
+class PrivateChatConsumer(CodecMixin, PresenceMixin, RateLimitMixin, ChunkedUploadMixin, ReadReceiptMixin, AsyncWebsocketConsumer):
+    room_group_name = None
+
     async def connect(self):
         self.user = self.scope["user"]
         if not self.user.is_authenticated:
@@ -189,34 +199,62 @@ class PrivateChatConsumer(AsyncWebsocketConsumer):
 
         self.other_user = self.scope["url_route"]["kwargs"]["username"]
 
-        # Consistent private room name
-        self.room_name = f"chat_{min(self.user.username, self.other_user)}_{max(self.user.username, self.other_user)}"
-        self.room_group_name = self.room_name
+        # Resolve the peer and the room once; receive() reuses them for every message
+        self.peer = await self.get_user(self.other_user)
+        if self.peer is None:
+            await self.close()
+            return
+        self.room = await self.get_room(self.user, self.peer)
+        self.room_group_name = room_group_name(self.room)
 
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        await self.accept()
+        await self.accept_with_codec()
+        await self.join_presence()
 
     async def disconnect(self, close_code):
+        await self.discard_upload()
+        self.stop_backlog()
+        if self.room_group_name is None:
+            return
+        await self.leave_presence()
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
-        message = data.get("message", "").strip()
-        media_url = data.get("media_url", "")
-
-        sender = self.user
-        receiver = await self.get_user(self.other_user)
-
-        msg_obj = None
-        if message or media_url:
-            msg_obj = await self.save_message(sender, receiver, message, media_url)
+    async def receive(self, text_data=None, bytes_data=None):
+        data = self.codec.decode(text_data, bytes_data)
+        action = data.get("action", "")
+        if action in EPHEMERAL_ACTIONS:
+            return await self.handle_ephemeral(action)
+        if action == "upload_chunk":
+            return await self.receive_upload_chunk(data.get("data", b""))
+        if action.startswith("upload_"):
+            if action == "upload_start" and not await self.admit_upload(data.get("upload_id")):
+                return
+            return await self.handle_upload_action(data)
+        if action == "read":
+            return await self.mark_read(data)
 
+        message = data.get("message", "").strip()
+        if not message:
+            return
+        await self.submit_message(message)
+
+    async def post_message(self, message):
+        try:
+            msg_obj = await self.save_message(message)
+        except BufferFull:
+            # Messages are not being stored right now; tell the sender instead of broadcasting
+            return await self.send_frame({
+                "action": "error", "code": "not_stored", "error": "Message not sent, please try again.",
+            })
+        await self.broadcast_message(msg_obj)
+
+    async def broadcast_message(self, msg_obj):
         timestamp = self.format_timestamp(msg_obj.timestamp)
 
         # Broadcast to both users
@@ -224,52 +262,25 @@ class PrivateChatConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             {
                 "type": "chat_message",
-                "message": msg_obj.content if msg_obj else "",
-                "media_url": msg_obj.media.url if msg_obj and msg_obj.media else "",
-                "sender": sender.username,
-                "timestamp": timestamp,
-                "message_id": msg_obj.id if msg_obj else None,
+                "frames": message_frame(msg_obj, timestamp),
             }
         )
 
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps({
-            "message": event["message"],
-            "media_url": event["media_url"],
-            "sender": event["sender"],
-            "timestamp": event["timestamp"],
-            "message_id": event["message_id"],
-        }))
+        await self.forward_frames(event)
 
     @database_sync_to_async
     def get_user(self, username):
-        return User.objects.get(username=username)
+        return User.objects.filter(username=username).first()
 
     @database_sync_to_async
-    def save_message(self, sender, receiver, message, media_url=""):
-        room_name = f"chat_{min(sender.username, receiver.username)}_{max(sender.username, receiver.username)}"
-        room, created = ChatRoom.objects.get_or_create(
-            name=room_name,
-            room_type="private",
-            defaults={"room_type": "private"}
-        )
-        if created:
-            room.members.set([sender, receiver])
-            room.save()
-
-        message_obj = Message(sender=sender, room=room, content=message)
+    def get_room(self, sender, receiver):
+        room, created = get_private_room(sender, receiver)
+        return room
 
-        # If uploading media through WebSocket, save it
-        if media_url:
-            from django.core.files.base import ContentFile
-            import base64
-            format, imgstr = media_url.split(';base64,')
-            ext = format.split('/')[-1]
-            file_data = ContentFile(base64.b64decode(imgstr), name=f"upload_{timezone.now().strftime('%Y%m%d%H%M%S')}.{ext}")
-            message_obj.media = file_data
-
-        message_obj.save()
-        return message_obj
+    async def save_message(self, message, media=None):
+        message_obj = Message(sender=self.user, room=self.room, content=message, media=media)
+        return await persist_message(message_obj)
 
     def format_timestamp(self, timestamp):
         now = timezone.localtime(timezone.now())
@@ -287,13 +298,17 @@ class PrivateChatConsumer(AsyncWebsocketConsumer):
         """
         Sends a delete message event to all connected clients in the room.
         """
-        await self.send(text_data=json.dumps({
-            "action": "delete_message",
-            "message_id": event["message_id"]
-        }))
+        await self.forward_frames(event)
 
+    async def room_deleted(self, event):
+        # The cached room is gone; nothing more can be saved on this socket
+        self.room = None
+        await self.close()
+
+
+class GroupChatConsumer(CodecMixin, PresenceMixin, RateLimitMixin, ChunkedUploadMixin, ReadReceiptMixin, AsyncWebsocketConsumer):
+    room_group_name = None
 
-class GroupChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.user = self.scope["user"]
         if not self.user.is_authenticated:
@@ -301,65 +316,86 @@ class GroupChatConsumer(AsyncWebsocketConsumer):
             return
 
         self.room_id = self.scope["url_route"]["kwargs"]["room_id"]
-        self.room_group_name = f"group_chat_{self.room_id}"
+
+        # Resolve the room and membership once; receive() reuses them for every message
+        self.room, self.is_member = await self.get_room(self.room_id, self.user)
+        if self.room is None or not self.is_member:
+            await self.close()
+            return
+
+        self.room_group_name = room_group_name(self.room)
 
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        await self.accept()
+        await self.accept_with_codec()
+        await self.join_presence()
 
     async def disconnect(self, close_code):
+        await self.discard_upload()
+        self.stop_backlog()
+        if self.room_group_name is None:
+            return
+        await self.leave_presence()
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
-        message = data.get("message", "").strip()
-        media_url = data.get("media_url", "")
+    async def receive(self, text_data=None, bytes_data=None):
+        data = self.codec.decode(text_data, bytes_data)
+        action = data.get("action", "")
+        if action in EPHEMERAL_ACTIONS:
+            return await self.handle_ephemeral(action)
+        if action == "upload_chunk":
+            return await self.receive_upload_chunk(data.get("data", b""))
+        if action.startswith("upload_"):
+            if action == "upload_start" and not await self.admit_upload(data.get("upload_id")):
+                return
+            return await self.handle_upload_action(data)
+        if action == "read":
+            return await self.mark_read(data)
 
-        sender = self.user
-        msg_obj = await self.save_message(sender, self.room_id, message, media_url)
+        message = data.get("message", "").strip()
+        if not message:
+            return
+        await self.submit_message(message)
+
+    async def post_message(self, message):
+        try:
+            msg_obj = await self.save_message(message)
+        except BufferFull:
+            # Messages are not being stored right now; tell the sender instead of broadcasting
+            return await self.send_frame({
+                "action": "error", "code": "not_stored", "error": "Message not sent, please try again.",
+            })
+        await self.broadcast_message(msg_obj)
+
+    async def broadcast_message(self, msg_obj):
         timestamp = self.format_timestamp(msg_obj.timestamp)
 
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 "type": "group_chat_message",
-                "message": msg_obj.content,
-                "media_url": msg_obj.media.url if msg_obj.media else "",
-                "sender": sender.username,
-                "timestamp": timestamp,
-                "message_id": msg_obj.id,
+                "frames": message_frame(msg_obj, timestamp),
             }
         )
 
     async def group_chat_message(self, event):
-        await self.send(text_data=json.dumps({
-            "message": event["message"],
-            "media_url": event["media_url"],
-            "sender": event["sender"],
-            "timestamp": event["timestamp"],
-            "message_id": event["message_id"],
-        }))
+        await self.forward_frames(event)
 
     @database_sync_to_async
-    def save_message(self, sender, room_id, message, media_url=""):
-        room = ChatRoom.objects.get(id=room_id, room_type="group")
-        message_obj = Message(sender=sender, room=room, content=message)
-
-        if media_url:
-            from django.core.files.base import ContentFile
-            import base64
-            format, imgstr = media_url.split(';base64,')
-            ext = format.split('/')[-1]
-            file_data = ContentFile(base64.b64decode(imgstr), name=f"upload_{timezone.now().strftime('%Y%m%d%H%M%S')}.{ext}")
-            message_obj.media = file_data
+    def get_room(self, room_id, user):
+        room = ChatRoom.objects.filter(id=room_id, room_type="group").first()
+        if room is None:
+            return None, False
+        return room, is_room_member(user, room)
 
-        message_obj.save()
-        return message_obj
+    async def save_message(self, message, media=None):
+        message_obj = Message(sender=self.user, room=self.room, content=message, media=media)
+        return await persist_message(message_obj)
 
     def format_timestamp(self, timestamp):
         now = timezone.localtime(timezone.now())
@@ -377,7 +413,14 @@ class GroupChatConsumer(AsyncWebsocketConsumer):
         """
         Sends a delete message event to all connected clients in the room.
         """
-        await self.send(text_data=json.dumps({
-            "action": "delete_message",
-            "message_id": event["message_id"]
-        }))
+        await self.forward_frames(event)
+
+    async def room_deleted(self, event):
+        # The cached room is gone; nothing more can be saved on this socket
+        self.room = None
+        await self.close()
+
+    async def room_member_removed(self, event):
+        if event["user_id"] == self.user.id:
+            self.is_member = False
+            await self.close()
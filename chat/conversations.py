@@ -0,0 +1,96 @@
+# chat/conversations.py
+"""
+Conversation list for a user: each room with its latest message and unread
+count, in two queries regardless of how many rooms the user is in.
+
+The latest message id and the unread count are correlated subqueries served
+by the (room, id) indexes, so the send path stays a single INSERT — nothing
+on ChatRoom is denormalized. A message is unread when its id is above the
+user's read cursor for the room (see chat/receipts.py).
+"""
+from django.conf import settings
+from django.db.models import (
+    BigIntegerField, Case, Count, Exists, F, IntegerField, OuterRef, Subquery, Value, When,
+)
+from django.db.models.functions import Coalesce
+
+from .models import ChatRoom, Message, ReadCursor
+
+
+class Conversation:
+    def __init__(self, room, title, last_message, unread_count):
+        self.room = room
+        self.title = title
+        self.last_message = last_message
+        self.unread_count = unread_count
+
+    @property
+    def preview(self):
+        msg = self.last_message
+        if msg is None:
+            return ""
+        if msg.is_deleted:
+            return "[message deleted]"
+        if msg.content:
+            return msg.content[:60]
+        return "📎 Attachment" if msg.media else ""
+
+
+def _unread_subqueries(user):
+    cursor = ReadCursor.objects.filter(user=user, room=OuterRef("pk")).values("last_read_id")[:1]
+    unread = (
+        Message.objects.filter(room=OuterRef("pk"), id__gt=OuterRef("last_read_id"), is_deleted=False)
+        .exclude(sender=user)
+        .values("room")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    return Subquery(cursor), Subquery(unread, output_field=IntegerField())
+
+
+def with_unread_counts(rooms, user):
+    """Annotate ``rooms`` with ``last_read_id`` and ``unread_count`` for ``user``."""
+    cursor, unread = _unread_subqueries(user)
+    return rooms.annotate(
+        last_read_id=Coalesce(cursor, Value(0), output_field=BigIntegerField()),
+        unread_count=Coalesce(unread, Value(0)),
+    )
+
+
+def with_member_unread_counts(rooms, user):
+    """
+    Like ``with_unread_counts`` for a list of rooms ``user`` may not be in:
+    also annotates ``is_member``, and only member rooms get a count. The
+    others have no cursor, so counting them would scan their whole history.
+    """
+    cursor, unread = _unread_subqueries(user)
+    membership = ChatRoom.members.through.objects.filter(chatroom_id=OuterRef("pk"), customuser_id=user.id)
+    return rooms.annotate(
+        is_member=Exists(membership),
+        last_read_id=Coalesce(cursor, Value(0), output_field=BigIntegerField()),
+        unread_count=Case(When(is_member=True, then=Coalesce(unread, Value(0))), default=Value(0)),
+    )
+
+
+def conversation_summaries(user, limit=None):
+    limit = limit or settings.CHAT_CONVERSATION_LIMIT
+    latest = Message.objects.filter(room=OuterRef("pk")).order_by("-id").values("id")[:1]
+    rooms = list(
+        with_unread_counts(ChatRoom.objects.filter(members=user), user)
+        .select_related("user_low", "user_high")
+        .annotate(last_message_id=Subquery(latest))
+        .order_by(F("last_message_id").desc(nulls_last=True), "-id")[:limit]
+    )
+
+    message_ids = [room.last_message_id for room in rooms if room.last_message_id]
+    last_messages = Message.objects.select_related("sender").in_bulk(message_ids)
+
+    conversations = []
+    for room in rooms:
+        if room.room_type == "private" and room.user_low_id:
+            peer = room.user_high if room.user_low_id == user.id else room.user_low
+            title = peer.username
+        else:
+            title = room.name
+        conversations.append(Conversation(room, title, last_messages.get(room.last_message_id), room.unread_count))
+    return conversations
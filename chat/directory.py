@@ -0,0 +1,132 @@
+# chat/directory.py
+"""
+In-process user directory for typeahead search.
+
+Usernames are kept in a sorted list so a prefix search is a binary search
+plus a slice, independent of how many accounts exist. Only ids and usernames
+are indexed or returned; emails never leave the database. The index is built
+once per process and kept current on user saves and deletes through model
+signals. Every ``CHAT_DIRECTORY_REFRESH_INTERVAL`` seconds it catches up with
+changes made by other worker processes: new users and renames through
+``CustomUser.updated_at``, deletions by comparing the row count with its own.
+"""
+import bisect
+import threading
+import time
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+
+from .models import CustomUser
+
+# Re-read changes this far behind the newest one seen: a transaction that
+# commits late still shows up with its earlier updated_at
+CHANGE_OVERLAP = timedelta(seconds=60)
+
+
+class UserDirectory:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._refreshed_at = 0.0
+        self._changed_up_to = None  # newest CustomUser.updated_at seen
+        self._users = {}        # id -> username
+        self._by_username = []  # sorted (username.lower(), id)
+
+    # -------------------------
+    # Maintenance
+    # -------------------------
+    def _ensure_fresh(self):
+        interval = settings.CHAT_DIRECTORY_REFRESH_INTERVAL
+        if self._loaded and time.monotonic() - self._refreshed_at < interval:
+            return
+        users = CustomUser.objects.all()
+        if self._changed_up_to is not None:
+            users = users.filter(updated_at__gte=self._changed_up_to - CHANGE_OVERLAP)
+        rows = list(users.values_list("id", "username", "updated_at"))
+        with self._lock:
+            for user_id, username, updated_at in rows:
+                self._put(user_id, username)
+                if self._changed_up_to is None or updated_at > self._changed_up_to:
+                    self._changed_up_to = updated_at
+        # Deleted rows leave no trace to query for; a differing count means some went
+        if self._loaded and CustomUser.objects.count() != len(self._users):
+            self._reconcile()
+        with self._lock:
+            self._loaded = True
+            self._refreshed_at = time.monotonic()
+
+    def _reconcile(self):
+        ids = set(CustomUser.objects.values_list("id", flat=True))
+        missing = list(ids.difference(self._users))
+        rows = list(CustomUser.objects.filter(id__in=missing).values_list("id", "username")) if missing else []
+        with self._lock:
+            for user_id in set(self._users).difference(ids):
+                self._drop(user_id)
+            for user_id, username in rows:
+                self._put(user_id, username)
+
+    def _put(self, user_id, username):
+        current = self._users.get(user_id)
+        if current == username:
+            return
+        if current is not None:
+            self._drop(user_id)
+        self._users[user_id] = username
+        bisect.insort(self._by_username, (username.lower(), user_id))
+
+    def _drop(self, user_id):
+        username = self._users.pop(user_id, None)
+        if username is None:
+            return
+        keys = self._by_username
+        i = bisect.bisect_left(keys, (username.lower(), user_id))
+        if i < len(keys) and keys[i] == (username.lower(), user_id):
+            del keys[i]
+
+    def update(self, user):
+        # Before the first load there is nothing to keep in sync
+        if self._loaded:
+            with self._lock:
+                self._put(user.id, user.username)
+
+    def remove(self, user_id):
+        with self._lock:
+            self._drop(user_id)
+
+    # -------------------------
+    # Search
+    # -------------------------
+    def search(self, prefix="", cursor=None, limit=20, exclude_ids=frozenset()):
+        """
+        Users whose username starts with ``prefix`` (case-insensitive), as
+        ``{"id", "username"}`` dicts ordered by username. ``cursor`` is the
+        ``next_cursor`` of the previous page. Returns ``(users, next_cursor)``.
+        """
+        self._ensure_fresh()
+        prefix = prefix.strip().lower()
+        with self._lock:
+            entries = self._by_username
+            start = bisect.bisect_left(entries, (prefix,))
+            end = bisect.bisect_left(entries, (prefix + "\uffff",)) if prefix else len(entries)
+            if cursor:
+                key, _, last_id = cursor.rpartition(":")
+                start = max(start, bisect.bisect_right(entries, (key, int(last_id))))
+
+            page = []
+            for entry in islice(entries, start, end):
+                if entry[1] in exclude_ids:
+                    continue
+                if len(page) == limit + 1:
+                    break
+                page.append(entry)
+
+            has_more = len(page) > limit
+            page = page[:limit]
+            users = [{"id": user_id, "username": self._users[user_id]} for _, user_id in page]
+        next_cursor = f"{page[-1][0]}:{page[-1][1]}" if has_more else None
+        return users, next_cursor
+
+
+directory = UserDirectory()
@@ -0,0 +1,58 @@
+# chat/frames.py
+"""
+Outgoing WebSocket frames.
+
+Broadcasts are encoded once by whoever sends them (once per wire codec, see
+chat/codecs.py) and the encoded frames are what travel through the channel
+layer, so each recipient consumer only forwards the one matching its codec
+instead of re-encoding the same payload for every member of the room.
+"""
+from .codecs import encode_all
+from .media import media_url
+
+
+def message_payload(msg_obj, timestamp):
+    return {
+        "message": msg_obj.content,
+        "media_url": media_url(msg_obj) if msg_obj.media else "",
+        "thumbnail_url": media_url(msg_obj, "thumbnail") if msg_obj.media_thumbnail else "",
+        "sender": msg_obj.sender.username,
+        "timestamp": timestamp,
+        "message_id": msg_obj.id,
+    }
+
+
+def message_frame(msg_obj, timestamp):
+    return encode_all(message_payload(msg_obj, timestamp))
+
+
+def delete_frame(message_id):
+    return encode_all({
+        "action": "delete_message",
+        "message_id": message_id,
+    })
+
+
+def receipt_frame(room_id, cursors):
+    return encode_all({
+        "action": "read_receipt",
+        "room_id": room_id,
+        "cursors": cursors,
+    })
+
+
+def typing_frame(user):
+    return encode_all({
+        "action": "typing",
+        "user_id": user.id,
+        "username": user.username,
+    })
+
+
+def presence_frame(user, online):
+    return encode_all({
+        "action": "presence",
+        "user_id": user.id,
+        "username": user.username,
+        "online": online,
+    })
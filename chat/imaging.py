@@ -0,0 +1,46 @@
+# chat/imaging.py
+"""
+Image work that runs inside the media process pool (see chat/media.py).
+
+Kept free of Django imports so worker processes can import it without
+setting Django up. Everything takes and returns plain bytes.
+"""
+import io
+
+from PIL import Image, ImageOps
+
+
+def _flatten(image):
+    # JPEG has no alpha; composite transparent images onto white
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def render_variants(data, thumbnail_size, max_dimension, webp_quality, jpeg_quality):
+    """
+    Returns ``(thumbnail_webp, compressed_jpeg)`` for the image in ``data``.
+    Orientation from EXIF is applied first; no metadata is written to either
+    variant. Animated images use their first frame.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        source.seek(0)
+        image = ImageOps.exif_transpose(source)
+        image.load()
+
+    thumbnail = image.copy()
+    thumbnail.thumbnail((thumbnail_size, thumbnail_size), Image.Resampling.LANCZOS)
+    if thumbnail.mode not in ("RGB", "RGBA"):
+        thumbnail = thumbnail.convert("RGBA")
+    thumb_out = io.BytesIO()
+    thumbnail.save(thumb_out, "WEBP", quality=webp_quality, method=4)
+
+    compressed = _flatten(image)
+    compressed.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+    jpeg_out = io.BytesIO()
+    compressed.save(jpeg_out, "JPEG", quality=jpeg_quality, optimize=True, progressive=True)
+
+    return thumb_out.getvalue(), jpeg_out.getvalue()
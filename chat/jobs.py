@@ -0,0 +1,306 @@
+# chat/jobs.py
+"""
+Database-backed queue for slow side effects (OTP emails, media release) and
+periodic maintenance (message archival, see chat/archive.py).
+
+Request handlers ``enqueue()`` a ``Job`` row, which costs one INSERT, and
+return right away. The in-process loop started from the ASGI lifespan
+(``CHAT_JOB_WORKER_IN_PROCESS``, on by default) and/or the ``chat_worker``
+management command claim due jobs and run their handler:
+
+* A job is claimed with a conditional UPDATE, so any number of workers can
+  share the table. A claim is a lease of ``CHAT_JOB_LEASE`` seconds. If the
+  worker dies mid-job, the job runs again once the lease has expired; that
+  run counts as an attempt, so a job that keeps killing its worker fails.
+* A failed job is retried with exponential backoff and jitter, up to
+  ``max_attempts`` runs; after that it stays ``failed`` for inspection.
+  A job enqueued with ``expires_in`` is never run or retried past that
+  point: an OTP email that arrives after the OTP expired is useless.
+* Enqueueing with an ``idempotency_key`` that is already in the table returns
+  the existing job instead of adding another one.
+* Handlers registered with ``atomic=True`` run in the same transaction that
+  marks the job done, so their database effects happen exactly once. Other
+  handlers (e.g. sending email) may run more than once and must tolerate it.
+"""
+import asyncio
+import logging
+import random
+import time
+from datetime import timedelta
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .archive import archive_messages
+from .models import Job
+from .storage import get_media_storage
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}  # kind -> (function, atomic)
+
+
+class LeaseLost(Exception):
+    """Another worker re-claimed the job while it was running."""
+
+
+class JobExpired(Exception):
+    """The job was claimed after its ``expires_at``."""
+
+
+def register(kind, atomic=False):
+    """Decorator registering a job handler; it is called with the job payload as keyword arguments."""
+    def decorator(func):
+        _handlers[kind] = (func, atomic)
+        return func
+    return decorator
+
+
+# -------------------------
+# Producer side
+# -------------------------
+def enqueue(kind, key=None, delay=0, max_attempts=None, expires_in=None, **payload):
+    """
+    Queue a ``kind`` job. ``payload`` must be JSON-serialisable. A job with
+    ``expires_in`` (seconds) is dropped rather than run or retried after that.
+    """
+    now = timezone.now()
+    job = Job(
+        kind=kind,
+        payload=payload,
+        idempotency_key=key,
+        run_at=now + timedelta(seconds=delay),
+        max_attempts=max_attempts or settings.CHAT_JOB_MAX_ATTEMPTS,
+        expires_at=now + timedelta(seconds=expires_in) if expires_in is not None else None,
+    )
+    if key is None:
+        job.save(force_insert=True)
+        return job
+    try:
+        with transaction.atomic():
+            job.save(force_insert=True)
+    except IntegrityError:
+        return Job.objects.get(idempotency_key=key)
+    return job
+
+
+def enqueue_email(subject, message, recipient_list, key=None, expires_in=None):
+    return enqueue(
+        "send_email", key=key, expires_in=expires_in,
+        subject=subject,
+        message=message,
+        from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@example.com'),
+        recipient_list=list(recipient_list),
+    )
+
+
+def enqueue_media_release(msg):
+    """Queue dropping ``msg``'s references on its media files (original and variants)."""
+    names = [field.name for field in (msg.media_thumbnail, msg.media_compressed, msg.media) if field]
+    if names:
+        enqueue("release_media", key=f"release_media:{msg.id}", names=names)
+
+
+# -------------------------
+# Handlers
+# -------------------------
+@register("send_email")
+def send_email_job(subject, message, from_email, recipient_list):
+    send_mail(
+        subject=subject,
+        message=message,
+        from_email=from_email,
+        recipient_list=recipient_list,
+        fail_silently=False,
+    )
+
+
+@register("release_media", atomic=True)
+def release_media_job(names):
+    # Reference counts are rows, so this commits together with the job
+    storage = get_media_storage()
+    for name in names:
+        storage.delete(name)
+
+
+@register("purge_jobs")
+def purge_jobs_job():
+    purge_finished()
+
+
+@register("archive_messages")
+def archive_messages_job():
+    # Stay well inside the lease; a follow-up job carries on where this one stopped
+    purged, archived, finished = archive_messages(deadline=time.monotonic() + settings.CHAT_JOB_LEASE / 2)
+    logger.info("Archived %d messages, purged %d tombstones", archived, purged)
+    if not finished:
+        enqueue("archive_messages")
+
+
+# -------------------------
+# Worker side
+# -------------------------
+def _due():
+    now = timezone.now()
+    return (
+        Q(status=Job.PENDING, run_at__lte=now)
+        | Q(status=Job.RUNNING, locked_until__lt=now, attempts__lt=F("max_attempts"))
+    )
+
+
+def fail_abandoned():
+    """Fail jobs whose worker died during their last allowed attempt."""
+    now = timezone.now()
+    failed = Job.objects.filter(status=Job.RUNNING, locked_until__lt=now, attempts__gte=F("max_attempts")).update(
+        status=Job.FAILED, finished_at=now, locked_until=None,
+        last_error="LeaseExpired: the worker stopped during the last attempt",
+    )
+    if failed:
+        logger.error("%d job(s) failed permanently: lease expired on the last attempt", failed)
+    return failed
+
+
+def claim_jobs(limit):
+    """Lease up to ``limit`` due jobs to the calling worker."""
+    fail_abandoned()
+    candidates = list(Job.objects.filter(_due()).order_by("run_at").values_list("id", flat=True)[:limit])
+    lease = timezone.now() + timedelta(seconds=settings.CHAT_JOB_LEASE)
+    claimed = [
+        job_id for job_id in candidates
+        # Loses the race (0 rows) when another worker claimed it first
+        if Job.objects.filter(_due(), id=job_id).update(
+            status=Job.RUNNING, locked_until=lease, attempts=F("attempts") + 1,
+        )
+    ]
+    return list(Job.objects.filter(id__in=claimed).order_by("run_at"))
+
+
+def backoff(attempts):
+    """Seconds to wait before retry number ``attempts``: exponential, capped, with jitter."""
+    delay = min(settings.CHAT_JOB_BACKOFF_BASE * 2 ** (attempts - 1), settings.CHAT_JOB_BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _mark_done(job):
+    # Guarded by attempts so a worker whose lease ran out cannot finish a re-claimed job
+    if not Job.objects.filter(id=job.id, status=Job.RUNNING, attempts=job.attempts).update(
+        status=Job.DONE, finished_at=timezone.now(), locked_until=None, last_error="",
+    ):
+        raise LeaseLost(job.id)
+
+
+def _mark_failed(job, exc, permanent=False):
+    now = timezone.now()
+    error = f"{type(exc).__name__}: {exc}"
+    retry_at = now + timedelta(seconds=backoff(job.attempts))
+    if permanent or job.attempts >= job.max_attempts or (job.expires_at is not None and retry_at >= job.expires_at):
+        changes = {"status": Job.FAILED, "finished_at": now}
+        logger.error("Job %s (%s) failed permanently: %s", job.id, job.kind, error)
+    else:
+        changes = {"status": Job.PENDING, "run_at": retry_at}
+        logger.warning("Job %s (%s) attempt %d failed: %s", job.id, job.kind, job.attempts, error)
+    Job.objects.filter(id=job.id, status=Job.RUNNING, attempts=job.attempts).update(
+        locked_until=None, last_error=error, **changes,
+    )
+
+
+def run_job(job):
+    """Run one claimed job. Returns ``True`` if it succeeded."""
+    if job.kind not in _handlers:
+        _mark_failed(job, LookupError(f"no handler for {job.kind!r}"), permanent=True)
+        return False
+    if job.expires_at is not None and job.expires_at <= timezone.now():
+        _mark_failed(job, JobExpired(f"expired at {job.expires_at.isoformat()}"), permanent=True)
+        return False
+    handler, atomic = _handlers[job.kind]
+    try:
+        if atomic:
+            with transaction.atomic():
+                handler(**job.payload)
+                _mark_done(job)
+        else:
+            handler(**job.payload)
+            _mark_done(job)
+    except LeaseLost:
+        logger.warning("Job %s (%s) was re-claimed while running", job.id, job.kind)
+        return False
+    except Exception as exc:
+        _mark_failed(job, exc)
+        return False
+    return True
+
+
+def run_pending(batch_size=None, max_jobs=None):
+    """
+    Run due jobs until none are left (or ``max_jobs`` have run); an in-process
+    worker. Returns ``(succeeded, failed)``.
+    """
+    batch_size = batch_size or settings.CHAT_JOB_BATCH_SIZE
+    succeeded = failed = 0
+    while max_jobs is None or succeeded + failed < max_jobs:
+        limit = batch_size if max_jobs is None else min(batch_size, max_jobs - succeeded - failed)
+        jobs = claim_jobs(limit)
+        if not jobs:
+            break
+        for job in jobs:
+            if run_job(job):
+                succeeded += 1
+            else:
+                failed += 1
+    return succeeded, failed
+
+
+_scheduled = {}  # kind -> interval number this process last queued
+
+
+def periodic_jobs():
+    """``(kind, interval)`` of jobs the workers queue on a timer; an interval of 0 disables one."""
+    return (
+        ("purge_jobs", 3600),
+        ("archive_messages", settings.CHAT_ARCHIVE_INTERVAL),
+    )
+
+
+def schedule_periodic_jobs():
+    """
+    Queue every periodic job once per interval. Called from each worker loop;
+    the idempotency key (kind plus interval number) keeps it to one job in
+    total however many workers are running.
+    """
+    now = time.time()
+    for kind, interval in periodic_jobs():
+        if interval <= 0:
+            continue
+        bucket = int(now // interval)
+        if _scheduled.get(kind) != bucket:
+            enqueue(kind, key=f"{kind}:{bucket}")
+            _scheduled[kind] = bucket
+
+
+def purge_finished(retention=None):
+    """Delete jobs that finished successfully more than ``retention`` seconds ago."""
+    if retention is None:
+        retention = settings.CHAT_JOB_RETENTION
+    cutoff = timezone.now() - timedelta(seconds=retention)
+    deleted, _ = Job.objects.filter(status=Job.DONE, finished_at__lt=cutoff).delete()
+    return deleted
+
+
+async def run_jobs_periodically():
+    """In-process worker loop started from the ASGI lifespan (see chat/lifespan.py)."""
+    # Not thread-sensitive: a slow SMTP server must not hold up sync views
+    run = database_sync_to_async(run_pending, thread_sensitive=False)
+    schedule = database_sync_to_async(schedule_periodic_jobs, thread_sensitive=False)
+    while True:
+        try:
+            await schedule()
+            succeeded, failed = await run()
+        except Exception:
+            logger.exception("Job worker iteration failed")
+            succeeded = failed = 0
+        if not succeeded + failed:
+            await asyncio.sleep(settings.CHAT_JOB_POLL_INTERVAL)
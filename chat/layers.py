@@ -0,0 +1,145 @@
+# chat/layers.py
+"""
+Channel layer sharded over several Redis nodes with a consistent-hash ring.
+
+``channels_redis`` can already spread a layer over several ``hosts``, but it
+picks the node from the CRC of the name modulo the number of hosts. Adding a
+node therefore moves most groups, and every connected socket has to rejoin.
+``ShardedRedisChannelLayer`` keeps the rest of ``RedisChannelLayer`` and
+replaces only that placement:
+
+* Each group (``group_chat_<id>``, ``private_chat_<id>``) lives on the node
+  the ring assigns to its name. Its membership set and every ``group_send``
+  for it go to that node only.
+* Each process's channels all live on one node. A channel is placed by its
+  non-local part (``specific.<process prefix>!``), so a process keeps a
+  single receive loop on a single connection.
+* Each node owns ``vnodes`` points on the ring. Going from N to N+1 nodes
+  moves about 1/(N+1) of the groups and processes, not (N-1)/N.
+
+With ``local_fanout`` (the default) there is a second, per-process tier for
+group sends:
+
+* The Redis group holds one member per subscribed process, that process's
+  fan-out channel. The process keeps the group's local channels in memory.
+* ``group_send`` therefore writes one copy per process, not one per member,
+  and no longer ships the member list.
+* The process's receive loop expands that copy into the buffers of its local
+  member channels (see ``receive_single``).
+
+Every process must be configured with the same host list. Roll out node
+changes to all ASGI processes together: a group that moved is rejoined when
+its sockets reconnect.
+"""
+import bisect
+import hashlib
+
+from channels_redis.core import RedisChannelLayer
+
+
+class HashRing:
+    """Consistent-hash ring mapping keys to node indexes."""
+
+    def __init__(self, nodes, vnodes=160):
+        points = sorted(
+            (self.hash(f"{node}#{replica}"), index)
+            for index, node in enumerate(nodes)
+            for replica in range(vnodes)
+        )
+        self._points = [point for point, _ in points]
+        self._owners = [index for _, index in points]
+
+    @staticmethod
+    def hash(key):
+        return int.from_bytes(hashlib.blake2b(key.encode("utf8"), digest_size=8).digest(), "big")
+
+    def node_for(self, key):
+        i = bisect.bisect(self._points, self.hash(key))
+        return self._owners[i % len(self._owners)]
+
+
+def host_key(host):
+    """Stable ring identity of a decoded ``channels_redis`` host entry."""
+    if "address" in host:
+        return str(host["address"])
+    if "host" in host:
+        return f"{host['host']}:{host.get('port', 6379)}"
+    return repr(sorted(host.items()))
+
+
+class ShardedRedisChannelLayer(RedisChannelLayer):
+    """
+    ``RedisChannelLayer`` with consistent-hash placement and per-process group
+    fan-out; extra CONFIG keys: ``vnodes``, ``local_fanout``.
+    """
+    FANOUT_GROUP_KEY = "__fanout_group__"
+
+    def __init__(self, *args, vnodes=160, local_fanout=True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ring = HashRing([host_key(host) for host in self.hosts], vnodes)
+        self.local_fanout = local_fanout
+        # Shares the non-local part of this process's channels, so it lands in
+        # the same Redis list and receive loop
+        self.fanout_channel = f"specific.{self.client_prefix}!fanout"
+        self.local_groups = {}  # group -> set of local channel names
+
+    def consistent_hash(self, value):
+        if self.ring_size == 1:
+            return 0
+        if isinstance(value, bytes):
+            value = value.decode("utf8")
+        # Place a specific channel by its process part only. The upstream send()
+        # hashes the full name while receive() hashes the non-local one; this
+        # makes both agree.
+        if "!" in value:
+            value = value[:value.index("!") + 1]
+        return self.ring.node_for(value)
+
+    async def flush(self):
+        self.local_groups.clear()
+        await super().flush()
+
+    def is_local(self, channel):
+        return "!" in channel and self.non_local_name(channel).endswith(self.client_prefix + "!")
+
+    # -------------------------
+    # Per-process fan-out
+    # -------------------------
+    async def group_add(self, group, channel):
+        if not (self.local_fanout and self.is_local(channel)):
+            return await super().group_add(group, channel)
+        self.local_groups.setdefault(group, set()).add(channel)
+        # Every join refreshes the process entry's group_expiry timestamp
+        await super().group_add(group, self.fanout_channel)
+
+    async def group_discard(self, group, channel):
+        if not (self.local_fanout and self.is_local(channel)):
+            return await super().group_discard(group, channel)
+        members = self.local_groups.get(group)
+        if members is None:
+            return
+        members.discard(channel)
+        if members:
+            return
+        del self.local_groups[group]
+        await super().group_discard(group, self.fanout_channel)
+        if self.local_groups.get(group):
+            # Someone joined while the entry was being removed
+            await super().group_add(group, self.fanout_channel)
+
+    async def group_send(self, group, message):
+        if self.local_fanout:
+            message = {**message, self.FANOUT_GROUP_KEY: group}
+        await super().group_send(group, message)
+
+    async def receive_single(self, channel):
+        message_channel, message = await super().receive_single(channel)
+        group = message.pop(self.FANOUT_GROUP_KEY, None)
+        if group is None:
+            return message_channel, message
+        channels = message_channel if isinstance(message_channel, list) else [message_channel]
+        if self.fanout_channel in channels:
+            # receive() puts the message in each listed channel's buffer
+            channels = [c for c in channels if c != self.fanout_channel]
+            channels.extend(self.local_groups.get(group, ()))
+        return channels, message
@@ -0,0 +1,33 @@
+# chat/lifespan.py
+import asyncio
+
+from django.conf import settings
+
+from .jobs import run_jobs_periodically
+from .persistence import flush_pending_messages
+from .receipts import flush_pending_receipts
+from .storage import collect_garbage_periodically
+
+
+async def lifespan_app(scope, receive, send):
+    """
+    Minimal ASGI lifespan handler so uvicorn gives us a chance to start
+    background work and to drain process-local state (the write-behind
+    message and read-cursor buffers) before exiting.
+    """
+    background = []
+    while True:
+        event = await receive()
+        if event["type"] == "lifespan.startup":
+            if settings.CHAT_MEDIA_GC_INTERVAL > 0:
+                background.append(asyncio.ensure_future(collect_garbage_periodically()))
+            if settings.CHAT_JOB_WORKER_IN_PROCESS:
+                background.append(asyncio.ensure_future(run_jobs_periodically()))
+            await send({"type": "lifespan.startup.complete"})
+        elif event["type"] == "lifespan.shutdown":
+            for task in background:
+                task.cancel()
+            await flush_pending_messages()
+            await flush_pending_receipts()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
@@ -0,0 +1,161 @@
+# chat/management/commands/_loadtest_server.py
+"""
+Server side of ``manage.py chat_loadtest``.
+
+The command serves this module's ``application`` under uvicorn against a
+throwaway SQLite database. It is ``chat_config.asgi.application`` with every
+database query counted, plus two HTTP endpoints under ``/__loadtest__/``:
+
+* ``POST setup`` creates users (each with a logged-in session), group rooms
+  and private rooms, and returns the names, session keys and room ids.
+* ``GET stats`` returns the query count and the process's RSS.
+
+Both answer only when the request carries the ``CHAT_LOADTEST_TOKEN`` the
+command started the server with, and ``setup`` refuses anything but SQLite.
+It lives next to the command (the leading underscore keeps Django from
+listing it as one) so that nothing in the ``chat`` app can import it.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from importlib import import_module
+
+# Sets Django up, so it goes before anything touching models
+from chat_config.asgi import application as chat_application
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.db.backends.signals import connection_created
+
+from chat.models import ChatRoom, CustomUser
+from chat.rooms import get_private_room
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PREFIX = "/__loadtest__/"
+
+_queries = 0
+_lock = threading.Lock()
+
+
+def count_query(execute, sql, params, many, context):
+    global _queries
+    with _lock:
+        _queries += 1
+    return execute(sql, params, many, context)
+
+
+def instrument(sender, connection, **kwargs):
+    connection.execute_wrappers.append(count_query)
+
+
+connection_created.connect(instrument)
+
+
+def rss_bytes():
+    """Current resident set size, or ``None`` where it cannot be read."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def server_stats():
+    peak = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        peak = peak if sys.platform == "darwin" else peak * 1024
+    return {"queries": _queries, "rss_bytes": rss_bytes(), "peak_rss_bytes": peak}
+
+
+@database_sync_to_async
+def create_fixtures(users, groups=(), pairs=()):
+    """
+    ``users`` accounts, one group room per list of user indexes in
+    ``groups`` and one private room per ``[a, b]`` in ``pairs``.
+    """
+    if not settings.DATABASES["default"]["ENGINE"].endswith("sqlite3"):
+        raise PermissionError("load test fixtures are only written to SQLite")
+    prefix = f"lt{int(time.time() * 1000)}_"
+    store_class = import_module(settings.SESSION_ENGINE).SessionStore
+    with transaction.atomic():
+        CustomUser.objects.bulk_create([
+            CustomUser(
+                email=f"{prefix}{i}@example.com",
+                username=f"{prefix}{i}",
+                age=30,
+                contact="0000000000",
+                gender="other",
+                password=make_password(None),
+            )
+            for i in range(users)
+        ])
+        accounts = list(CustomUser.objects.filter(username__startswith=prefix).order_by("id"))
+
+        sessions = []
+        for user in accounts:
+            session = store_class()
+            session[SESSION_KEY] = str(user.pk)
+            session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+            session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            session.create()
+            sessions.append(session.session_key)
+
+        group_ids = []
+        for number, members in enumerate(groups):
+            room = ChatRoom.objects.create(name=f"{prefix}group{number}", room_type="group", creator=accounts[members[0]])
+            room.members.set([accounts[i] for i in members])
+            group_ids.append(room.id)
+        for a, b in pairs:
+            get_private_room(accounts[a], accounts[b])
+
+    return {
+        "session_cookie": settings.SESSION_COOKIE_NAME,
+        "users": [{"username": user.username, "session": key} for user, key in zip(accounts, sessions)],
+        "groups": group_ids,
+    }
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def respond(send, status, payload):
+    await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": json.dumps(payload).encode()})
+
+
+async def application(scope, receive, send):
+    if scope["type"] != "http" or not scope["path"].startswith(PREFIX):
+        return await chat_application(scope, receive, send)
+
+    token = os.environ.get("CHAT_LOADTEST_TOKEN", "")
+    headers = dict(scope["headers"])
+    if not token or headers.get(b"x-loadtest-token", b"").decode() != token:
+        return await respond(send, 404, {"error": "not found"})
+
+    endpoint = scope["path"][len(PREFIX):].strip("/")
+    body = await read_body(receive)
+    if endpoint == "stats":
+        return await respond(send, 200, server_stats())
+    if endpoint == "setup" and scope["method"] == "POST":
+        try:
+            return await respond(send, 200, await create_fixtures(**json.loads(body)))
+        except PermissionError as exc:
+            return await respond(send, 403, {"error": str(exc)})
+    return await respond(send, 404, {"error": "not found"})
@@ -0,0 +1,31 @@
+# chat/management/commands/chat_archive.py
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.archive import archive_messages, archive_stats
+from chat.models import ChatRoom
+
+
+class Command(BaseCommand):
+    help = "Move messages past their room's horizon into the archive and purge old tombstones."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--room", type=int, action="append", dest="rooms",
+                            help="Only this room id (repeatable).")
+        parser.add_argument("--stats", action="store_true", help="Only report hot and archived sizes.")
+
+    def handle(self, *args, rooms, stats, **options):
+        if not stats:
+            if rooms:
+                found = list(ChatRoom.objects.filter(id__in=rooms).only("id", "archive_after_days"))
+                if len(found) != len(set(rooms)):
+                    raise CommandError("Unknown room id.")
+                rooms = found
+            purged, archived, _ = archive_messages(rooms=rooms)
+            self.stdout.write(f"Archived {archived} messages, purged {purged} tombstones.")
+
+        totals = archive_stats()
+        self.stdout.write(
+            f"Hot: {totals['hot_messages']} messages ({totals['tombstones']} tombstones). "
+            f"Archive: {totals['archived_messages']} messages in {totals['segments']} segments, "
+            f"{totals['archived_bytes'] / 1024 / 1024:.1f} MB."
+        )
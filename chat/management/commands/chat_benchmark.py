@@ -0,0 +1,868 @@
+# chat/management/commands/chat_benchmark.py
+import asyncio
+import binascii
+import json
+import os
+import random
+import shutil
+import socketserver
+import statistics
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.mail import send_mail
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Min
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from chat.consumers import GroupChatConsumer
+from chat.codecs import CODECS
+from chat.archive import archive_room
+from chat.conversations import conversation_summaries
+from chat.frames import message_frame
+from chat.jobs import enqueue_email, run_pending
+from chat.layers import HashRing, ShardedRedisChannelLayer
+from chat.models import ArchivedSegment, ChatRoom, CustomUser, Job, MediaBlob, Message, ReadCursor
+from chat.persistence import MessageBuffer, MessageIdAllocator
+from chat.ratelimit import LocalRateLimiter, RateLimitMixin
+from chat.search import get_search_backend, rebuild_index, search_messages
+from chat.storage import ContentAddressedStorage
+from chat.views import get_history_page
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """
+    Local SMTP sink for the jobs scenario: accepts every message after
+    ``latency`` seconds, and answers 451 to the first ``fail_first`` ones.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency=0.0, fail_first=0):
+        super().__init__(("127.0.0.1", 0), SMTPStandInHandler)
+        self.latency = latency
+        self.fail_first = fail_first
+        self.lock = threading.Lock()
+        self.received = []  # (recipients, subject)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class SMTPStandInHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        recipients = []
+        self.reply("220 localhost stand-in")
+        for raw in self.rfile:
+            command = raw.decode(errors="replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb in ("EHLO", "HELO"):
+                self.reply("250 localhost")
+            elif verb == "MAIL":
+                recipients = []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(command.split(":", 1)[1].strip(" <>"))
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                subject = ""
+                for line in self.rfile:
+                    if line in (b".\r\n", b".\n"):
+                        break
+                    if line.lower().startswith(b"subject:"):
+                        subject = line[8:].decode(errors="replace").strip()
+                time.sleep(server.latency)
+                with server.lock:
+                    if server.fail_first > 0:
+                        server.fail_first -= 1
+                        self.reply("451 Try again later")
+                        continue
+                    server.received.append((tuple(recipients), subject))
+                self.reply("250 Queued")
+            elif verb == "RSET":
+                recipients = []
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+class Command(BaseCommand):
+    help = (
+        "Timing benchmarks for the chat hot paths. Scenarios that need rows run in a throwaway "
+        "test database; correctness checks live in chat/tests."
+    )
+
+    # Scenarios that never touch the database
+    DATABASE_FREE = {"codecs", "fanout", "sharding", "group_fanout", "ratelimit"}
+
+    def add_arguments(self, parser):
+        parser.add_argument("scenario", choices=sorted(self.scenarios()))
+        parser.add_argument("--messages", type=int, default=2000)
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--rounds", type=int, default=200)
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000",
+                            help="Running server for http_load, e.g. 'uvicorn chat_config.asgi:application'")
+        parser.add_argument("--concurrency", type=int, default=32)
+        parser.add_argument("--rooms", type=int, default=1000)
+        parser.add_argument("--redis-urls", default="",
+                            help="Comma-separated local redis-server URLs for sharding / group_fanout.")
+        parser.add_argument("--processes", type=int, default=4,
+                            help="Worker processes simulated by group_fanout (one channel layer each).")
+        parser.add_argument("--smtp-latency", type=float, default=0.05,
+                            help="Seconds the jobs scenario's SMTP stand-in takes per message.")
+
+    def scenarios(self):
+        return {
+            "persistence": self.bench_persistence,
+            "fanout": self.bench_fanout,
+            "codecs": self.bench_codecs,
+            "indexes": self.bench_indexes,
+            "conversations": self.bench_conversations,
+            "search": self.bench_search,
+            "dedup": self.bench_dedup,
+            "jobs": self.bench_jobs,
+            "archive": self.bench_archive,
+            "sharding": self.bench_sharding,
+            "group_fanout": self.bench_group_fanout,
+            "ratelimit": self.bench_ratelimit,
+            "http_load": self.bench_http_load,
+        }
+
+    def handle(self, *args, **options):
+        scenario = options["scenario"]
+        if scenario in self.DATABASE_FREE:
+            return self.scenarios()[scenario](**options)
+        if scenario == "http_load":
+            # The server under load must see the same rows, so no throwaway database here
+            name = os.path.basename(str(connection.settings_dict["NAME"]))
+            if not name.startswith("test_"):
+                raise CommandError(
+                    f"http_load writes to the configured database '{name}'. Point DATABASE_URL at a "
+                    "database whose name starts with 'test_' for both the server and this command."
+                )
+            return self.scenarios()[scenario](**options)
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.scenarios()[scenario](**options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    # -------------------------
+    # Fixtures
+    # -------------------------
+    def make_room(self, members=1):
+        stamp = int(time.time() * 1000)
+        users = [
+            CustomUser.objects.create(
+                email=f"bench{stamp}_{i}@example.com",
+                username=f"bench{stamp}_{i}",
+                age=30,
+                contact="0000000000",
+                gender="other",
+            )
+            for i in range(members)
+        ]
+        room = ChatRoom.objects.create(name=f"bench_{stamp}", room_type="group", creator=users[0])
+        room.members.set(users)
+        return room, users
+
+    def cleanup(self, room, users):
+        room.delete()
+        CustomUser.objects.filter(id__in=[u.id for u in users]).delete()
+
+    def report(self, label, count, elapsed):
+        self.stdout.write(f"{label:<24} {count:>8} msgs  {elapsed:8.3f}s  {count / elapsed:10.1f} msgs/sec")
+
+    # -------------------------
+    # Scenarios
+    # -------------------------
+    def bench_persistence(self, messages, batch_size, **options):
+        """Single-row save() per message versus the write-behind bulk_create buffer."""
+        room, users = self.make_room()
+        sender = users[0]
+        try:
+            async def sync_mode():
+                save = database_sync_to_async(lambda m: m.save())
+                for i in range(messages):
+                    await save(Message(sender=sender, room=room, content=f"sync {i}"))
+
+            async def batched_mode():
+                allocator = MessageIdAllocator(node_id=0)
+                buffer = MessageBuffer(batch_size=batch_size, flush_interval=0.05)
+                for i in range(messages):
+                    msg = Message(id=allocator.next_id(), sender=sender, room=room, content=f"batched {i}")
+                    await buffer.add(msg)
+                await buffer.flush()
+
+            for label, runner in (("sync (save per message)", sync_mode), (f"batched (size={batch_size})", batched_mode)):
+                start = time.perf_counter()
+                asyncio.run(runner())
+                self.report(label, messages, time.perf_counter() - start)
+        finally:
+            self.cleanup(room, users)
+
+    def bench_fanout(self, rounds, **options):
+        """Per-recipient json.dumps versus forwarding the sender's pre-encoded frame."""
+        sender = CustomUser(id=1, username="bench_sender")
+        msg = Message(id=1, sender=sender, content="x" * 120)
+        timestamp = "03:15 PM, Today"
+
+        async def deliver(consumers, event):
+            for consumer in consumers:
+                await consumer.group_chat_message(event)
+
+        async def deliver_per_recipient(consumers, event):
+            # The previous handler: rebuild and encode the payload for every channel
+            for consumer in consumers:
+                await consumer.send(text_data=json.dumps({
+                    "message": event["message"],
+                    "media_url": event["media_url"],
+                    "sender": event["sender"],
+                    "timestamp": event["timestamp"],
+                    "message_id": event["message_id"],
+                }))
+
+        async def sink(text_data=None, bytes_data=None):
+            pass
+
+        for recipients in (10, 100, 1000):
+            consumers = []
+            for _ in range(recipients):
+                consumer = GroupChatConsumer()
+                consumer.send = sink
+                consumers.append(consumer)
+
+            start = time.perf_counter()
+            for _ in range(rounds):
+                event = {
+                    "type": "group_chat_message",
+                    "message": msg.content,
+                    "media_url": "",
+                    "sender": sender.username,
+                    "timestamp": timestamp,
+                    "message_id": msg.id,
+                }
+                asyncio.run(deliver_per_recipient(consumers, event))
+            self.report(f"per-recipient n={recipients}", rounds, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for _ in range(rounds):
+                event = {"type": "group_chat_message", "frames": message_frame(msg, timestamp)}
+                asyncio.run(deliver(consumers, event))
+            self.report(f"serialize-once n={recipients}", rounds, time.perf_counter() - start)
+
+    def bench_codecs(self, rounds, **options):
+        """Encode/decode throughput and bytes on the wire for a typical mix of chat frames."""
+        traffic = [
+            {"message": "hey, are we still on for tonight?", "media_url": "", "sender": "alice",
+             "timestamp": "07:42 PM, Today", "message_id": 118230457634816},
+            {"message": "", "media_url": "/media/chat_media/upload_20250820170900.jpeg", "sender": "bob",
+             "timestamp": "07:43 PM, Today", "message_id": 118230457634817},
+            {"action": "delete_message", "message_id": 118230457634816},
+            {"action": "upload_ack", "upload_id": "lz3k9q", "received": 262144},
+            {"message": "ok 👍"},
+        ]
+        iterations = rounds * 100
+        for name, codec in CODECS.items():
+            encoded = [codec.encode(frame) for frame in traffic]
+            wire_bytes = sum(len(e.encode() if isinstance(e, str) else e) for e in encoded)
+
+            start = time.perf_counter()
+            for _ in range(iterations):
+                for frame in traffic:
+                    codec.encode(frame)
+            encode_elapsed = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for _ in range(iterations):
+                for frame in encoded:
+                    if codec.binary:
+                        codec.decode(bytes_data=frame)
+                    else:
+                        codec.decode(text_data=frame)
+            decode_elapsed = time.perf_counter() - start
+
+            frames = iterations * len(traffic)
+            self.stdout.write(
+                f"{name:<18} encode {frames / encode_elapsed:10.0f} frames/sec  "
+                f"decode {frames / decode_elapsed:10.0f} frames/sec  "
+                f"{wire_bytes / len(traffic):6.1f} bytes/frame"
+            )
+
+    def bench_indexes(self, messages, rounds, **options):
+        """
+        EXPLAIN plans and timings for the hot message/room queries on the
+        configured backend (SQLite or MySQL), with every migration applied.
+        """
+        room, users = self.make_room(members=2)
+        other_room = ChatRoom.objects.create(name=f"{room.name}_other", room_type="group", creator=users[0])
+        try:
+            batch = []
+            for i in range(messages):
+                batch.append(Message(
+                    room=room if i % 4 else other_room,
+                    sender=users[i % 2],
+                    content=f"seeded message {i}",
+                    is_read=i % 10 != 0,
+                    is_deleted=i % 50 == 0,
+                ))
+                if len(batch) == 1000:
+                    Message.objects.bulk_create(batch)
+                    batch = []
+            Message.objects.bulk_create(batch)
+
+            queries = {
+                "history by id": lambda: list(Message.objects.filter(room=room).order_by("-id")[:50]),
+                "history by time": lambda: list(Message.objects.filter(room=room).order_by("-timestamp")[:50]),
+                "undeleted": lambda: list(Message.objects.filter(room=room, is_deleted=False).order_by("-id")[:50]),
+                "unread for user": lambda: Message.objects.filter(room=room, is_read=False).exclude(sender=users[0]).count(),
+                "contact lookup": lambda: CustomUser.objects.filter(contact=users[0].contact).exists(),
+                "private room by pair": lambda: ChatRoom.objects.filter(
+                    room_type="private", user_low=users[0], user_high=users[1]).first(),
+            }
+            plans = {
+                "history by id": Message.objects.filter(room=room).order_by("-id")[:50],
+                "history by time": Message.objects.filter(room=room).order_by("-timestamp")[:50],
+                "undeleted": Message.objects.filter(room=room, is_deleted=False).order_by("-id")[:50],
+                "unread for user": Message.objects.filter(room=room, is_read=False).exclude(sender=users[0]),
+                "contact lookup": CustomUser.objects.filter(contact=users[0].contact),
+                "private room by pair": ChatRoom.objects.filter(
+                    room_type="private", user_low=users[0], user_high=users[1]),
+            }
+
+            self.stdout.write(f"backend: {connection.vendor}, {messages} seeded messages")
+            for label, run in queries.items():
+                start = time.perf_counter()
+                for _ in range(rounds):
+                    run()
+                elapsed = time.perf_counter() - start
+                self.stdout.write(f"\n{label:<22} {elapsed / rounds * 1000:8.3f} ms/query")
+                self.stdout.write(plans[label].explain())
+        finally:
+            other_room.delete()
+            self.cleanup(room, users)
+
+    def bench_conversations(self, rooms, rounds, **options):
+        """
+        Conversation list for a user in ``--rooms`` rooms with a few messages
+        each: the summary service against one query per room.
+        """
+        room, users = self.make_room(members=2)
+        user, other = users
+        # Created one by one: bulk_create does not return primary keys on MySQL
+        extra_rooms = [
+            ChatRoom.objects.create(name=f"{room.name}_{i}", room_type="group", creator=other)
+            for i in range(rooms - 1)
+        ]
+        all_rooms = [room] + extra_rooms
+        try:
+            Membership = ChatRoom.members.through
+            Membership.objects.bulk_create(
+                [Membership(chatroom_id=r.id, customuser_id=u.id) for r in extra_rooms for u in users],
+                batch_size=1000,
+            )
+            Message.objects.bulk_create(
+                [
+                    Message(room=r, sender=users[i % 2], content=f"message {i}")
+                    for r in all_rooms
+                    for i in range(5)
+                ],
+                batch_size=1000,
+            )
+            # Half the rooms have a read cursor past their first message
+            first_ids = Message.objects.filter(room__in=all_rooms[::2]).values("room").annotate(first_id=Min("id"))
+            ReadCursor.objects.bulk_create(
+                [ReadCursor(room_id=row["room"], user=user, last_read_id=row["first_id"]) for row in first_ids],
+                batch_size=1000,
+            )
+
+            def per_room():
+                summaries = []
+                for r in ChatRoom.objects.filter(members=user):
+                    last = Message.objects.filter(room=r).select_related("sender").order_by("-id").first()
+                    cursor = ReadCursor.objects.filter(room=r, user=user).first()
+                    unread = (
+                        Message.objects.filter(room=r, id__gt=cursor.last_read_id if cursor else 0, is_deleted=False)
+                        .exclude(sender=user).count()
+                    )
+                    summaries.append((r, last, unread))
+                return summaries
+
+            runs = {
+                "summary service": lambda: conversation_summaries(user, limit=rooms),
+                "query per room": per_room,
+            }
+            self.stdout.write(f"backend: {connection.vendor}, {rooms} rooms, {rooms * 5} messages")
+            for label, run in runs.items():
+                with CaptureQueriesContext(connection) as ctx:
+                    run()
+                queries = len(ctx.captured_queries)
+                n = max(rounds // 20, 1)
+                start = time.perf_counter()
+                for _ in range(n):
+                    run()
+                elapsed = time.perf_counter() - start
+                self.stdout.write(f"{label:<18} {queries:>6} queries  {elapsed / n * 1000:10.2f} ms/list")
+        finally:
+            ChatRoom.objects.filter(id__in=[r.id for r in extra_rooms]).delete()
+            self.cleanup(room, users)
+
+    def bench_search(self, messages, rounds, **options):
+        """
+        Full-text search over a seeded corpus (use --messages 1000000 for the
+        full run) against a content__icontains scan, on the active backend.
+        """
+        rng = random.Random(42)
+        # Zipf-like vocabulary: a few very common words and a long tail of rare ones
+        vocabulary = [f"word{i}" for i in range(5000)]
+        weights = [1 / (i + 1) for i in range(len(vocabulary))]
+
+        room, users = self.make_room(members=2)
+        rooms = [room] + [
+            ChatRoom.objects.create(name=f"{room.name}_{i}", room_type="group", creator=users[0]) for i in range(9)
+        ]
+        for extra in rooms[1:]:
+            extra.members.set(users)
+        # No cleanup: cascading a million rows would not fit in memory, and the
+        # throwaway database is dropped afterwards
+        start = time.perf_counter()
+        batch = []
+        for i in range(messages):
+            words = rng.choices(vocabulary, weights, k=rng.randint(4, 16))
+            batch.append(Message(room=rooms[i % len(rooms)], sender=users[i % 2], content=" ".join(words),
+                                 is_deleted=i % 100 == 0))
+            if len(batch) == 5000:
+                Message.objects.bulk_create(batch)
+                batch = []
+        Message.objects.bulk_create(batch)
+        self.report("seed", messages, time.perf_counter() - start)
+
+        backend = get_search_backend()
+        if backend.indexes_on_save:
+            start = time.perf_counter()
+            rebuild_index()
+            self.report("build inverted index", messages, time.perf_counter() - start)
+
+        queries = {
+            "common term": ("word1", None),
+            "rare term": ("word4321", None),
+            "two terms": ("word2 word40", None),
+            "common term, one room": ("word1", room.id),
+            "two terms, one room": ("word2 word40", room.id),
+        }
+        self.stdout.write(f"backend: {connection.vendor}/{backend.name}, {messages} messages in {len(rooms)} rooms")
+        for label, (query, room_id) in queries.items():
+            start = time.perf_counter()
+            for _ in range(rounds):
+                results, _ = search_messages(query, users[0], room_id=room_id)
+            search_ms = (time.perf_counter() - start) / rounds * 1000
+
+            scan = Message.objects.filter(is_deleted=False, room__in=rooms if room_id is None else [room_id])
+            for word in query.split():
+                scan = scan.filter(content__icontains=word)
+            scan_rounds = max(rounds // 20, 1)
+            start = time.perf_counter()
+            for _ in range(scan_rounds):
+                list(scan.order_by("-id")[:20])
+            scan_ms = (time.perf_counter() - start) / scan_rounds * 1000
+            self.stdout.write(
+                f"{label:<24} search {search_ms:9.3f} ms/page ({len(results)} hits)  icontains {scan_ms:9.3f} ms/page"
+            )
+
+    def bench_dedup(self, messages, **options):
+        """
+        Disk usage of plain versus content-addressed storage for a chat-like
+        upload mix: --messages uploads, about a third of them forwards or
+        re-shares of an earlier file (popular files re-shared most).
+        """
+        rng = random.Random(7)
+        plain_dir, cas_dir = tempfile.mkdtemp(), tempfile.mkdtemp()
+        plain, cas = FileSystemStorage(location=plain_dir), ContentAddressedStorage(location=cas_dir)
+        originals, cas_names = [], set()
+        try:
+            timings = {"plain": 0.0, "content-addressed": 0.0}
+            for i in range(messages):
+                if originals and rng.random() < 0.35:
+                    # Re-share, skewed towards the most popular files
+                    data, ext = originals[min(int(rng.paretovariate(1.2)) - 1, len(originals) - 1)]
+                else:
+                    # Photos and clips: log-normal sizes around 200 KB, capped at the upload limit
+                    size = min(int(rng.lognormvariate(12.2, 1.0)), 10 * 1024 * 1024)
+                    data, ext = rng.randbytes(size), rng.choice([".jpeg", ".png", ".mp4"])
+                    originals.insert(0, (data, ext))
+
+                start = time.perf_counter()
+                plain.save(f"chat_media/upload_{i}{ext}", ContentFile(data))
+                timings["plain"] += time.perf_counter() - start
+                start = time.perf_counter()
+                cas_names.add(cas.save(f"chat_media/upload_{i}{ext}", ContentFile(data)))
+                timings["content-addressed"] += time.perf_counter() - start
+
+            for label, root in (("plain", plain_dir), ("content-addressed", cas_dir)):
+                files = stored = 0
+                for dirpath, _, filenames in os.walk(root):
+                    files += len(filenames)
+                    stored += sum(os.path.getsize(os.path.join(dirpath, name)) for name in filenames)
+                self.stdout.write(
+                    f"{label:<18} {files:>6} files  {stored / 1024 / 1024:9.1f} MB  "
+                    f"{messages / timings[label]:8.1f} uploads/sec"
+                )
+                if label == "plain":
+                    plain_bytes = stored
+            saved = plain_bytes - stored
+            self.stdout.write(f"saved {saved / 1024 / 1024:.1f} MB ({saved / plain_bytes * 100:.1f}%)")
+        finally:
+            MediaBlob.objects.filter(name__in=cas_names).delete()
+            shutil.rmtree(plain_dir, ignore_errors=True)
+            shutil.rmtree(cas_dir, ignore_errors=True)
+
+    def bench_jobs(self, rounds, smtp_latency, **options):
+        """
+        Request-path cost of sending an OTP email inline versus queueing it,
+        against a local SMTP stand-in. The queued emails are then delivered by
+        an in-process worker, with a few transient SMTP failures to retry and
+        every job enqueued twice under the same idempotency key.
+        """
+        stand_in = SMTPStandIn(latency=smtp_latency)
+        threading.Thread(target=stand_in.serve_forever, daemon=True).start()
+        smtp = override_settings(
+            EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+            EMAIL_HOST="127.0.0.1", EMAIL_PORT=stand_in.port, EMAIL_USE_TLS=False, EMAIL_USE_SSL=False,
+            EMAIL_HOST_USER="", EMAIL_HOST_PASSWORD="",
+            # Retry straight away so the run does not wait out real backoff
+            CHAT_JOB_BACKOFF_BASE=0, CHAT_JOB_MAX_ATTEMPTS=3,
+        )
+        stamp = int(time.time() * 1000)
+        keys = [f"bench:{stamp}:{i}" for i in range(rounds)]
+        try:
+            with smtp:
+                inline = []
+                for i in range(rounds):
+                    start = time.perf_counter()
+                    send_mail("Inline OTP", f"Your OTP is: {i:06d}.", "bench@example.com", [f"inline{i}@example.com"])
+                    inline.append(time.perf_counter() - start)
+                stand_in.received.clear()
+                stand_in.fail_first = max(rounds // 10, 1)
+
+                queued = []
+                for i, key in enumerate(keys):
+                    start = time.perf_counter()
+                    enqueue_email("Queued OTP", f"Your OTP is: {i:06d}.", [f"queued{i}@example.com"], key=key)
+                    queued.append(time.perf_counter() - start)
+                    # A double submit: same key, no second job
+                    enqueue_email("Queued OTP", f"Your OTP is: {i:06d}.", [f"queued{i}@example.com"], key=key)
+
+                start = time.perf_counter()
+                succeeded, failed = run_pending()
+                drained = time.perf_counter() - start
+
+            for label, latencies in (("send_mail inline", inline), ("enqueue_email", queued)):
+                latencies.sort()
+                self.stdout.write(
+                    f"{label:<18} p50 {statistics.median(latencies) * 1000:8.2f} ms  "
+                    f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:8.2f} ms"
+                )
+            self.report("worker drain", rounds, drained)
+            delivered = len(stand_in.received)
+            self.stdout.write(f"delivered {delivered}/{rounds}, {failed} attempts retried")
+        finally:
+            stand_in.shutdown()
+            stand_in.server_close()
+            Job.objects.filter(idempotency_key__in=keys).delete()
+
+    def bench_archive(self, messages, **options):
+        """
+        Archives the older part of a room spanning a year and reports the
+        per-page cost of paging through its history before and after.
+        """
+        room, users = self.make_room(members=2)
+        try:
+            room.archive_after_days = 90
+            room.save(update_fields=["archive_after_days"])
+            start_ts = timezone.now() - timedelta(days=365)
+            step = timedelta(days=365) / messages
+            batch = []
+            for i in range(messages):
+                batch.append(Message(
+                    room=room, sender=users[i % 2], timestamp=start_ts + i * step,
+                    content=f"seeded message {i} " + "lorem ipsum " * (i % 7),
+                    is_deleted=i % 200 == 0,
+                ))
+                if len(batch) == 1000:
+                    Message.objects.bulk_create(batch)
+                    batch = []
+            Message.objects.bulk_create(batch)
+
+            def walk():
+                pages, before, has_more = [], None, True
+                while has_more:
+                    room.refresh_from_db(fields=["archived_up_to"])
+                    start = time.perf_counter()
+                    page, has_more = async_to_sync(get_history_page)(room, before=before, limit=50)
+                    pages.append(time.perf_counter() - start)
+                    before = page[0].id if page else None
+                return pages
+
+            before_pages = walk()
+            content_bytes = sum(len(c.encode()) for c in Message.objects.filter(room=room).values_list("content", flat=True))
+            start = time.perf_counter()
+            moved = archive_room(room)
+            elapsed = time.perf_counter() - start
+            self.report("archive_room", moved, elapsed)
+            after_pages = walk()
+
+            stored = sum(len(s.data) for s in ArchivedSegment.objects.filter(room=room).only("data"))
+            hot = Message.objects.filter(room=room).count()
+            self.stdout.write(f"hot rows {hot}, archived rows {moved}, archive {stored / 1024:.1f} KB "
+                              f"for {content_bytes / 1024:.1f} KB of message text (all rows)")
+            for label, pages in (("before archival", before_pages), ("after archival", after_pages)):
+                self.stdout.write(f"{label:<16} {len(pages):>4} pages  p50 {statistics.median(pages) * 1000:7.2f} ms  "
+                                  f"max {max(pages) * 1000:7.2f} ms")
+        finally:
+            self.cleanup(room, users)
+
+    def bench_sharding(self, rooms, redis_urls, **options):
+        """
+        Group placement over N Redis nodes: the share of --rooms groups that
+        move when a node is added, and the load on the busiest node. Compares
+        channels_redis' CRC range placement with the hash ring. With
+        --redis-urls it also round-trips group messages through real nodes,
+        using one layer per simulated process.
+        """
+        groups = [f"{kind}_chat_{i}" for i in range(rooms) for kind in ("group", "private")]
+
+        def crc_range(nodes):
+            return lambda key: int((binascii.crc32(key.encode()) & 0xFFF) / (4096 / len(nodes)))
+
+        def ring(nodes):
+            return HashRing(nodes).node_for
+
+        for nodes in (2, 4, 8):
+            hosts = [f"redis://shard{i}:6379" for i in range(nodes + 1)]
+            for label, placement in (("crc range", crc_range), ("hash ring", ring)):
+                before, after = placement(hosts[:nodes]), placement(hosts)
+                moved = sum(before(g) != after(g) for g in groups) / len(groups)
+                busiest = max(Counter(before(g) for g in groups).values()) / (len(groups) / nodes)
+                self.stdout.write(f"{label:<10} {nodes}->{nodes + 1} nodes  moved {moved * 100:5.1f}%  "
+                                  f"busiest node {busiest:4.2f}x average")
+
+        urls = [url.strip() for url in redis_urls.split(",") if url.strip()]
+        if not urls:
+            return
+
+        async def live():
+            # Separate layers stand in for separate ASGI processes
+            processes = [ShardedRedisChannelLayer(hosts=urls, prefix=f"bench{int(time.time())}") for _ in range(4)]
+            members = []
+            for i, group in enumerate(groups[:200]):
+                layer = processes[i % len(processes)]
+                channel = await layer.new_channel()
+                await layer.group_add(group, channel)
+                members.append((layer, group, channel))
+            start = time.perf_counter()
+            for layer, group, channel in members:
+                await processes[0].group_send(group, {"type": "bench", "group": group})
+                message = await asyncio.wait_for(layer.receive(channel), timeout=5)
+                if message["group"] != group:
+                    raise CommandError(f"{group} received a message for {message['group']}")
+            elapsed = time.perf_counter() - start
+            per_node = Counter(processes[0].consistent_hash(group) for _, group, _ in members)
+            for layer in processes:
+                await layer.flush()
+            return elapsed, len(members), per_node
+
+        elapsed, count, per_node = asyncio.run(live())
+        self.report(f"live ({len(urls)} nodes)", count, elapsed)
+        self.stdout.write("groups per node: " + ", ".join(f"{urls[i]}={n}" for i, n in sorted(per_node.items())))
+
+    def bench_group_fanout(self, rounds, redis_urls, processes, **options):
+        """
+        Redis commands and end-to-end latency per group message, by group size,
+        with members spread over --processes simulated workers: one Redis copy
+        per member channel (local_fanout off) versus one per worker process.
+        Needs --redis-urls; commands are counted from each node's INFO stats.
+        """
+        urls = [url.strip() for url in redis_urls.split(",") if url.strip()]
+        if not urls:
+            raise CommandError("group_fanout needs --redis-urls (local redis-server instances).")
+        import redis
+
+        nodes = [redis.Redis.from_url(url) for url in urls]
+
+        def commands():
+            return sum(node.info("stats")["total_commands_processed"] for node in nodes)
+
+        async def run(local_fanout, members):
+            prefix = f"bench{int(time.time() * 1000)}"
+            layers = [
+                ShardedRedisChannelLayer(hosts=urls, prefix=prefix, local_fanout=local_fanout, capacity=rounds + 10)
+                for _ in range(processes)
+            ]
+            group = "group_chat_bench"
+            channels = []
+            for i in range(members):
+                layer = layers[i % processes]
+                channel = await layer.new_channel()
+                await layer.group_add(group, channel)
+                channels.append((layer, channel))
+
+            latencies = []
+            ops_before = await asyncio.to_thread(commands)
+            for i in range(rounds):
+                receivers = [asyncio.ensure_future(layer.receive(channel)) for layer, channel in channels]
+                # Let every receiver block on its layer before sending
+                await asyncio.sleep(0.01)
+                start = time.perf_counter()
+                await layers[0].group_send(group, {"type": "bench", "round": i, "text": "x" * 120})
+                received = await asyncio.wait_for(asyncio.gather(*receivers), timeout=30)
+                latencies.append(time.perf_counter() - start)
+                if any(message["round"] != i for message in received):
+                    raise CommandError("Out-of-round message delivered")
+            ops = (await asyncio.to_thread(commands)) - ops_before
+            for layer in layers:
+                await layer.flush()
+            return ops / rounds, latencies
+
+        self.stdout.write(f"{len(urls)} Redis node(s), {processes} processes, {rounds} messages per row")
+        for members in (10, 100, 1000, 5000):
+            for label, local_fanout in (("per channel", False), ("per process", True)):
+                ops, latencies = asyncio.run(run(local_fanout, members))
+                latencies.sort()
+                self.stdout.write(
+                    f"{label:<12} n={members:<5} {ops:8.1f} redis cmds/msg  "
+                    f"p50 {statistics.median(latencies) * 1000:8.2f} ms  "
+                    f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:8.2f} ms"
+                )
+
+    def bench_ratelimit(self, rounds, **options):
+        """
+        Cost of a bucket check, then one client flooding --rounds messages
+        under each over-limit policy: how many reach post_message (one DB
+        write and broadcast each) and which error frames it gets back.
+        """
+        limiter = LocalRateLimiter()
+        buckets = [("conn:bench", 1e9, 1e9), ("user:bench", 1e9, 1e9), ("room:bench", 1e9, 1e9)]
+        start = time.perf_counter()
+        for _ in range(rounds * 100):
+            async_to_sync(limiter.take)(buckets)
+        self.report("take() x3 buckets", rounds * 100, time.perf_counter() - start)
+
+        class FloodClient(RateLimitMixin):
+            user = CustomUser(id=0)
+
+            def __init__(self, name):
+                # Fresh buckets per run: the process-wide limiter outlives it
+                self.channel_name = self.room_group_name = f"bench_flood_{name}_{time.time()}"
+                self.posted, self.frames = [], Counter()
+
+            async def post_message(self, text):
+                self.posted.append(text)
+
+            async def send_frame(self, frame):
+                self.frames[f"{frame['code']}/{frame['policy']}"] += 1
+
+        async def flood(client):
+            for i in range(rounds):
+                await client.submit_message(f"flood {i}")
+            if client.drain_task is not None:
+                await client.drain_task
+
+        limits = {
+            "CHAT_RATE_LIMIT_STORE": "local",
+            "CHAT_RATE_LIMIT_QUEUE": 20,
+            "CHAT_RATE_LIMIT_CONNECTION_RATE": 100,
+            "CHAT_RATE_LIMIT_CONNECTION_BURST": 10,
+            "CHAT_RATE_LIMIT_USER_RATE": 1000,
+            "CHAT_RATE_LIMIT_USER_BURST": 1000,
+            "CHAT_RATE_LIMIT_ROOM_RATE": 1000,
+            "CHAT_RATE_LIMIT_ROOM_BURST": 1000,
+        }
+        self.stdout.write(f"{rounds} messages back to back, 10 burst + 100/s per connection, queue of 20")
+        for policy in ("reject", "queue", "coalesce"):
+            with override_settings(CHAT_RATE_LIMIT_POLICY=policy, **limits):
+                client = FloodClient(policy)
+                start = time.perf_counter()
+                async_to_sync(flood)(client)
+                elapsed = time.perf_counter() - start
+            delivered = sum(len(text.split("\n")) for text in client.posted)
+            frames = ", ".join(f"{key} x{count}" for key, count in sorted(client.frames.items()))
+            self.stdout.write(
+                f"{policy:<9} {len(client.posted):>5} writes  {delivered:>5} msgs delivered  "
+                f"{elapsed:6.2f}s  frames: {frames or 'none'}"
+            )
+
+    # 1x1 transparent PNG
+    TINY_PNG = bytes.fromhex(
+        "89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c489"
+        "0000000d49444154789c63000100000500010d0a2db40000000049454e44ae426082"
+    )
+
+    def bench_http_load(self, messages, base_url, concurrency, **options):
+        """Concurrent media uploads and deletes against a running uvicorn server."""
+        room, users = self.make_room()
+        try:
+            client = Client()
+            client.force_login(users[0])
+            cookies = {settings.SESSION_COOKIE_NAME: client.cookies[settings.SESSION_COOKIE_NAME].value}
+            upload_url = base_url.rstrip("/") + reverse("upload_media_room", args=[room.id])
+
+            def upload(i):
+                start = time.perf_counter()
+                response = requests.post(
+                    upload_url, cookies=cookies, allow_redirects=False,
+                    files={"media": (f"bench_{i}.png", self.TINY_PNG, "image/png")},
+                )
+                return response.status_code, time.perf_counter() - start
+
+            def delete(message_id):
+                start = time.perf_counter()
+                response = requests.post(
+                    base_url.rstrip("/") + reverse("delete_message", args=[message_id]), cookies=cookies,
+                )
+                return response.status_code, time.perf_counter() - start
+
+            self.run_http_load("uploads", upload, range(messages), {302}, concurrency)
+            message_ids = list(
+                Message.objects.filter(room=room, sender=users[0], is_deleted=False).values_list("id", flat=True)
+            )
+            self.run_http_load("deletes", delete, message_ids, {200}, concurrency)
+        finally:
+            self.cleanup(room, users)
+
+    def run_http_load(self, label, request, items, ok_statuses, concurrency):
+        items = list(items)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(request, items))
+        elapsed = time.perf_counter() - start
+
+        latencies = sorted(latency for _, latency in results)
+        errors = sum(1 for status, _ in results if status not in ok_statuses)
+        self.report(f"{label} (c={concurrency})", len(items), elapsed)
+        if latencies:
+            p95 = latencies[int(len(latencies) * 0.95) - 1] if len(latencies) > 1 else latencies[0]
+            self.stdout.write(f"    p50 {statistics.median(latencies) * 1000:.1f} ms  p95 {p95 * 1000:.1f} ms  errors {errors}")
@@ -0,0 +1,374 @@
+# chat/management/commands/chat_loadtest.py
+import asyncio
+import importlib.util
+import json
+import os
+import random
+import secrets
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an ascending list."""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Connection:
+    """One client socket: a user connected to one room."""
+
+    def __init__(self, index, user, path, room):
+        self.index = index
+        self.user = user
+        self.path = path
+        self.room = room  # shared list of this room's open connections
+        self.ws = None
+
+
+class Command(BaseCommand):
+    help = (
+        "Boot the ASGI app under uvicorn with the in-memory channel layer and a throwaway SQLite "
+        "database, drive thousands of authenticated chat sockets at a fixed send rate and print "
+        "latency, throughput, queries per message and server RSS as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--connections", type=int, default=1000, help="Sockets to open, one user each.")
+        parser.add_argument("--group-size", type=int, default=20, help="Members per group room.")
+        parser.add_argument("--private-share", type=float, default=0.5,
+                            help="Fraction of the sockets on private chats (in pairs); the rest join groups.")
+        parser.add_argument("--rate", type=float, default=0.2,
+                            help="Messages per second each socket sends (Poisson arrivals).")
+        parser.add_argument("--duration", type=float, default=30, help="Seconds of sending.")
+        parser.add_argument("--drain", type=float, default=10,
+                            help="Seconds to wait for outstanding deliveries after sending stops.")
+        parser.add_argument("--connect-concurrency", type=int, default=100)
+        parser.add_argument("--persistence", choices=("sync", "batched"), default="sync",
+                            help="CHAT_PERSISTENCE_MODE of the server under test.")
+        parser.add_argument("--no-rate-limits", action="store_true",
+                            help="Lift the inbound rate limits (they apply by default, as configured).")
+        parser.add_argument("--port", type=int, default=0, help="Server port (default: any free port).")
+        parser.add_argument("--output", default="", help="Write the JSON report here instead of stdout.")
+        parser.add_argument("--keep", action="store_true", help="Keep the SQLite database and server log.")
+
+    def handle(self, *args, **options):
+        if importlib.util.find_spec("websockets") is None:
+            raise CommandError("chat_loadtest needs the 'websockets' package.")
+
+        self.raise_file_limit(options["connections"])
+        workdir = tempfile.mkdtemp(prefix="chat_loadtest_")
+        port = options["port"] or free_port()
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.token = secrets.token_hex(16)
+        server = None
+        try:
+            env = self.server_env(workdir, options)
+            self.log("Migrating the throwaway database...")
+            subprocess.run(
+                [sys.executable, "manage.py", "migrate", "--noinput", "-v", "0"],
+                cwd=settings.BASE_DIR, env=env, check=True,
+            )
+            server, log_path = self.start_server(workdir, env, port)
+            report = asyncio.run(self.run(options))
+            report["server"]["log"] = log_path if options["keep"] else None
+        except subprocess.CalledProcessError as exc:
+            raise CommandError(f"Migrating the load test database failed: {exc}")
+        finally:
+            if server is not None:
+                server.terminate()
+                try:
+                    server.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+            if options["keep"]:
+                self.log(f"Kept {workdir}")
+            else:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                fh.write(output + "\n")
+            self.log(f"Wrote {options['output']}")
+        else:
+            self.stdout.write(output)
+
+    # -------------------------
+    # Server
+    # -------------------------
+    def log(self, message):
+        # stdout carries the JSON report only
+        self.stderr.write(message)
+
+    def raise_file_limit(self, connections):
+        # Client and server each hold a descriptor per socket
+        if resource is None:
+            return
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        wanted = connections * 2 + 256
+        if soft != resource.RLIM_INFINITY and soft < wanted:
+            limit = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+            if limit < wanted:
+                self.log(f"Open file limit is {limit}; some connections may fail (raise it with ulimit -n).")
+
+    def server_env(self, workdir, options):
+        env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'loadtest.sqlite3')}",
+            "CHANNEL_LAYER": "memory",
+            "CHAT_PRESENCE_STORE": "local",
+            "CHAT_RATE_LIMIT_STORE": "local",
+            "CHAT_PERSISTENCE_MODE": options["persistence"],
+            # One server process, so one node ID
+            "CHAT_NODE_ID": "0",
+            "CHAT_MEDIA_GC_INTERVAL": "0",
+            "CHAT_JOB_WORKER_IN_PROCESS": "False",
+            "CHAT_LOADTEST_TOKEN": self.token,
+            # DEBUG keeps every query in memory, which would swamp the RSS figure
+            "DEBUG": "False",
+            "ALLOWED_HOSTS": "127.0.0.1,localhost",
+        }
+        if options["no_rate_limits"]:
+            for scope in ("CONNECTION", "USER", "ROOM"):
+                env[f"CHAT_RATE_LIMIT_{scope}_RATE"] = env[f"CHAT_RATE_LIMIT_{scope}_BURST"] = "1e9"
+        return env
+
+    def start_server(self, workdir, env, port):
+        log_path = os.path.join(workdir, "server.log")
+        with open(log_path, "w") as log:
+            server = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "chat.management.commands._loadtest_server:application",
+                 "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning", "--lifespan", "on"],
+                cwd=settings.BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+            )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                break
+            try:
+                self.stats()
+                return server, log_path
+            except requests.RequestException:
+                time.sleep(0.2)
+        server.kill()
+        with open(log_path) as log:
+            raise CommandError(f"uvicorn did not come up:\n{log.read()[-4000:]}")
+
+    def api(self, method, endpoint, **kwargs):
+        response = requests.request(
+            method, f"{self.base_url}/__loadtest__/{endpoint}",
+            headers={"X-Loadtest-Token": self.token}, timeout=600, **kwargs,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def stats(self):
+        return self.api("GET", "stats")
+
+    # -------------------------
+    # Fixtures
+    # -------------------------
+    def plan(self, connections, group_size, private_share):
+        """Split the sockets into private pairs and groups; returns the setup request."""
+        private = int(connections * private_share) // 2 * 2
+        pairs = [[i, i + 1] for i in range(0, private, 2)]
+        grouped = list(range(private, connections))
+        groups = [grouped[i:i + group_size] for i in range(0, len(grouped), group_size)]
+        return {"users": connections, "groups": groups, "pairs": pairs}
+
+    def build_connections(self, plan, fixtures):
+        users = fixtures["users"]
+        connections = []
+        for a, b in plan["pairs"]:
+            room = []
+            connections.append(Connection(a, users[a], f"/ws/chat/private/{users[b]['username']}/", room))
+            connections.append(Connection(b, users[b], f"/ws/chat/private/{users[a]['username']}/", room))
+        for members, room_id in zip(plan["groups"], fixtures["groups"]):
+            room = []
+            connections.extend(Connection(i, users[i], f"/ws/chat/group/{room_id}/", room) for i in members)
+        return connections
+
+    # -------------------------
+    # Load
+    # -------------------------
+    async def run(self, options):
+        from websockets.asyncio.client import connect
+
+        plan = self.plan(options["connections"], options["group_size"], options["private_share"])
+        self.log(f"Creating {plan['users']} users, {len(plan['groups'])} groups, {len(plan['pairs'])} private rooms...")
+        fixtures = await asyncio.to_thread(self.api, "POST", "setup", json=plan)
+        connections = self.build_connections(plan, fixtures)
+        cookie = fixtures["session_cookie"]
+        ws_base = self.base_url.replace("http://", "ws://")
+
+        pending = {}  # message text -> send time
+        latencies = []
+        errors = Counter()
+        counts = Counter()
+        connect_times = []
+        gate = asyncio.Semaphore(options["connect_concurrency"])
+
+        async def open_socket(conn):
+            async with gate:
+                start = time.perf_counter()
+                try:
+                    conn.ws = await connect(
+                        ws_base + conn.path,
+                        additional_headers={"Cookie": f"{cookie}={conn.user['session']}"},
+                        open_timeout=60, ping_interval=None, compression=None, max_queue=None,
+                    )
+                except Exception as exc:
+                    errors[f"connect: {type(exc).__name__}"] += 1
+                    return
+                connect_times.append(time.perf_counter() - start)
+                conn.room.append(conn)
+
+        async def read(conn):
+            try:
+                async for raw in conn.ws:
+                    now = time.perf_counter()
+                    frame = json.loads(raw)
+                    text = frame.get("message")
+                    if text in pending:
+                        latencies.append(now - pending[text])
+                        counts["delivered"] += 1
+                    elif frame.get("action") == "error":
+                        errors[f"{frame.get('code')}/{frame.get('policy')}"] += 1
+                        if frame.get("policy") == "rejected":
+                            counts["rejected"] += 1
+                            counts["expected"] -= len(conn.room)
+            except Exception as exc:
+                errors[f"read: {type(exc).__name__}"] += 1
+
+        async def write(conn, stop_at):
+            rate = options["rate"]
+            await asyncio.sleep(random.expovariate(rate))
+            seq = 0
+            while time.perf_counter() < stop_at:
+                text = f"lt {conn.index} {seq}"
+                seq += 1
+                counts["expected"] += len(conn.room)
+                counts["sent"] += 1
+                pending[text] = time.perf_counter()
+                try:
+                    await conn.ws.send(json.dumps({"message": text}))
+                except Exception as exc:
+                    errors[f"send: {type(exc).__name__}"] += 1
+                    return
+                await asyncio.sleep(random.expovariate(rate))
+
+        self.log(f"Opening {len(connections)} sockets...")
+        baseline = await asyncio.to_thread(self.stats)
+        connect_start = time.perf_counter()
+        await asyncio.gather(*(open_socket(conn) for conn in connections))
+        connect_elapsed = time.perf_counter() - connect_start
+        connected = [conn for conn in connections if conn.ws is not None]
+        readers = [asyncio.ensure_future(read(conn)) for conn in connected]
+        # Let presence and join frames settle before counting queries
+        await asyncio.sleep(1)
+        idle = await asyncio.to_thread(self.stats)
+
+        self.log(f"{len(connected)} sockets open; sending for {options['duration']}s at {options['rate']}/s each...")
+        send_start = time.perf_counter()
+        stop_at = send_start + options["duration"]
+        if options["rate"] > 0:
+            await asyncio.gather(*(write(conn, stop_at) for conn in connected))
+        send_elapsed = time.perf_counter() - send_start
+
+        drain_deadline = time.perf_counter() + options["drain"]
+        while counts["delivered"] < counts["expected"] and time.perf_counter() < drain_deadline:
+            await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - send_start
+        loaded = await asyncio.to_thread(self.stats)
+
+        for conn in connected:
+            await conn.ws.close()
+        for reader in readers:
+            reader.cancel()
+
+        latencies.sort()
+        connect_times.sort()
+        accepted = counts["sent"] - counts["rejected"]
+        queries = loaded["queries"] - idle["queries"]
+        return {
+            "commit": self.commit(),
+            "config": {key: options[key] for key in (
+                "connections", "group_size", "private_share", "rate", "duration", "persistence", "no_rate_limits",
+            )},
+            "connections": {
+                "requested": len(connections),
+                "open": len(connected),
+                "seconds": round(connect_elapsed, 3),
+                "p50_ms": self.ms(percentile(connect_times, 0.5)),
+                "p99_ms": self.ms(percentile(connect_times, 0.99)),
+                "queries_per_connection": (
+                    round((idle["queries"] - baseline["queries"]) / len(connected), 2) if connected else None
+                ),
+            },
+            "messages": {
+                "sent": counts["sent"],
+                "rejected": counts["rejected"],
+                "expected_deliveries": counts["expected"],
+                "delivered": counts["delivered"],
+                "lost": max(0, counts["expected"] - counts["delivered"]),
+            },
+            "throughput": {
+                "messages_per_sec": round(accepted / send_elapsed, 1) if send_elapsed else None,
+                "deliveries_per_sec": round(counts["delivered"] / elapsed, 1) if elapsed else None,
+            },
+            "latency_ms": {
+                "p50": self.ms(percentile(latencies, 0.5)),
+                "p95": self.ms(percentile(latencies, 0.95)),
+                "p99": self.ms(percentile(latencies, 0.99)),
+                "max": self.ms(latencies[-1] if latencies else None),
+                "mean": self.ms(statistics.fmean(latencies) if latencies else None),
+            },
+            "db": {
+                "queries": queries,
+                "queries_per_message": round(queries / accepted, 2) if accepted else None,
+            },
+            "server": {
+                "rss_idle_bytes": idle["rss_bytes"],
+                "rss_loaded_bytes": loaded["rss_bytes"],
+                "peak_rss_bytes": loaded["peak_rss_bytes"],
+            },
+            "errors": dict(errors),
+        }
+
+    @staticmethod
+    def ms(seconds):
+        return None if seconds is None else round(seconds * 1000, 3)
+
+    @staticmethod
+    def commit():
+        try:
+            result = subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR, capture_output=True, text=True,
+            )
+        except OSError:
+            return None
+        return result.stdout.strip() or None
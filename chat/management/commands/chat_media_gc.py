@@ -0,0 +1,30 @@
+# chat/management/commands/chat_media_gc.py
+from django.core.management.base import BaseCommand
+
+from chat.storage import collect_garbage, dedup_stats, recount_references
+
+
+class Command(BaseCommand):
+    help = "Delete unreferenced media blobs and report deduplication savings."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--grace", type=int, default=None,
+                            help="Seconds a blob must have been unreferenced (default CHAT_MEDIA_GC_GRACE).")
+        parser.add_argument("--recount", action="store_true",
+                            help="Recompute reference counts from messages before collecting.")
+        parser.add_argument("--stats", action="store_true", help="Only report disk usage and savings.")
+
+    def handle(self, *args, grace, recount, stats, **options):
+        if not stats:
+            if recount:
+                self.stdout.write(f"Corrected {recount_references()} reference counts.")
+            files, freed = collect_garbage(grace=grace)
+            self.stdout.write(f"Removed {files} unreferenced blobs, {freed / 1024 / 1024:.1f} MB freed.")
+
+        logical, stored = dedup_stats()
+        saved = logical - stored
+        share = saved / logical * 100 if logical else 0
+        self.stdout.write(
+            f"Referenced media: {logical / 1024 / 1024:.1f} MB, stored: {stored / 1024 / 1024:.1f} MB, "
+            f"saved by deduplication: {saved / 1024 / 1024:.1f} MB ({share:.1f}%)"
+        )
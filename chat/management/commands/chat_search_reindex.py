@@ -0,0 +1,20 @@
+# chat/management/commands/chat_search_reindex.py
+from django.core.management.base import BaseCommand
+
+from chat.search import get_search_backend, rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the inverted message search index (only used when no native full-text index is available)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=5000)
+        parser.add_argument("--force", action="store_true", help="Rebuild even if another backend is active.")
+
+    def handle(self, *args, chunk_size, force, **options):
+        backend = get_search_backend()
+        if not backend.indexes_on_save and not force:
+            self.stdout.write(f"Search uses the '{backend.name}' backend, which the database keeps current. Nothing to do.")
+            return
+        indexed = rebuild_index(chunk_size=chunk_size)
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} messages."))
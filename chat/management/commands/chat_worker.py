@@ -0,0 +1,48 @@
+# chat/management/commands/chat_worker.py
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from chat.jobs import run_pending, schedule_periodic_jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (emails, media release, archival). Any number of workers may run side by side."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Run the jobs that are due now, then exit.")
+        parser.add_argument("--batch-size", type=int, default=None,
+                            help="Jobs claimed per round trip (default CHAT_JOB_BATCH_SIZE).")
+        parser.add_argument("--poll-interval", type=float, default=None,
+                            help="Seconds to sleep when the queue is empty (default CHAT_JOB_POLL_INTERVAL).")
+
+    def handle(self, *args, once, batch_size, poll_interval, **options):
+        if once:
+            succeeded, failed = run_pending(batch_size=batch_size)
+            self.stdout.write(f"Ran {succeeded + failed} jobs, {failed} failed.")
+            return
+
+        poll_interval = poll_interval or settings.CHAT_JOB_POLL_INTERVAL
+        stopping = False
+
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+
+        # Finish the job in hand on SIGTERM / Ctrl-C instead of leaving it leased
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        self.stdout.write("Job worker started.")
+        while not stopping:
+            close_old_connections()
+            schedule_periodic_jobs()
+            succeeded, failed = run_pending(batch_size=batch_size, max_jobs=batch_size or settings.CHAT_JOB_BATCH_SIZE)
+            if succeeded or failed:
+                self.stdout.write(f"Ran {succeeded + failed} jobs, {failed} failed.")
+            if not succeeded + failed:
+                time.sleep(poll_interval)
+        self.stdout.write("Job worker stopped.")
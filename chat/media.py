@@ -0,0 +1,127 @@
+# chat/media.py
+"""
+Post-upload media processing.
+
+Images get a WebP thumbnail and a recompressed JPEG, both without metadata,
+saved through the same content-addressed storage as the original. The
+uploaded image itself is kept for the variants to be rendered from but never
+served: it may carry EXIF, GPS position included. Decoding
+and encoding run in a process pool so a large image never holds up the ASGI
+event loop or the GIL; storage I/O runs in a thread. A re-shared image reuses
+the variants already rendered for it. Other media (video) is left as
+uploaded.
+"""
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.urls import reverse
+
+from .imaging import render_variants
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+PROCESSED_TYPES = {".jpeg", ".jpg", ".png", ".gif"}
+
+_pool = None
+
+
+def is_processed_image(name):
+    return os.path.splitext(name)[1].lower() in PROCESSED_TYPES
+
+
+def media_field(msg, variant):
+    """
+    The file behind a served variant: ``original``, ``thumbnail`` or
+    ``display`` (the recompressed image when there is one, else the original).
+    For images, ``original`` and ``display`` are both the recompressed copy,
+    and nothing is served until it exists.
+    """
+    if msg.media and is_processed_image(msg.media.name):
+        field = {
+            "original": msg.media_compressed,
+            "thumbnail": msg.media_thumbnail,
+            "display": msg.media_compressed,
+        }.get(variant)
+        return field or None
+    field = {
+        "original": msg.media,
+        "thumbnail": msg.media_thumbnail,
+        "display": msg.display_media,
+    }.get(variant)
+    return field or None
+
+
+def media_url(msg, variant="display"):
+    return reverse("serve_media", args=[msg.id, variant])
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=settings.CHAT_MEDIA_WORKERS)
+    return _pool
+
+
+def variant_name(name, suffix):
+    return f"{os.path.splitext(name)[0]}.{suffix}"
+
+
+def read_original(msg):
+    with msg.media.open("rb") as f:
+        return f.read()
+
+
+def reuse_variants(msg):
+    """Take references on variants rendered for an earlier upload of the same file."""
+    existing = (
+        Message.objects.filter(media=msg.media.name).exclude(id=msg.id)
+        .exclude(media_thumbnail="").exclude(media_thumbnail=None)
+        .values_list("media_thumbnail", "media_compressed").first()
+    )
+    if existing is None:
+        return False
+    storage = msg.media.storage
+    for name in existing:
+        storage.add_reference(name, 0)
+    msg.media_thumbnail.name, msg.media_compressed.name = existing
+    Message.objects.filter(id=msg.id).update(media_thumbnail=existing[0], media_compressed=existing[1])
+    return True
+
+
+def store_variants(msg, thumbnail, compressed):
+    storage = msg.media.storage
+    msg.media_thumbnail.name = storage.save(variant_name(msg.media.name, "thumb.webp"), ContentFile(thumbnail))
+    msg.media_compressed.name = storage.save(variant_name(msg.media.name, "web.jpg"), ContentFile(compressed))
+    Message.objects.filter(id=msg.id).update(
+        media_thumbnail=msg.media_thumbnail.name, media_compressed=msg.media_compressed.name,
+    )
+
+
+async def process_message_media(msg):
+    """
+    Create the variants for ``msg.media`` and record them on ``msg``. Failures
+    are logged and leave an image message with nothing to serve.
+    """
+    if not msg.media or not is_processed_image(msg.media.name):
+        return msg
+    try:
+        if await database_sync_to_async(reuse_variants)(msg):
+            return msg
+        data = await sync_to_async(read_original, thread_sensitive=False)(msg)
+        thumbnail, compressed = await asyncio.get_running_loop().run_in_executor(
+            get_pool(), render_variants, data,
+            settings.CHAT_MEDIA_THUMBNAIL_SIZE, settings.CHAT_MEDIA_MAX_DIMENSION,
+            settings.CHAT_MEDIA_WEBP_QUALITY, settings.CHAT_MEDIA_JPEG_QUALITY,
+        )
+        await database_sync_to_async(store_variants)(msg, thumbnail, compressed)
+    except Exception:
+        logger.exception("Could not process media for message %s", msg.id)
+    return msg
+
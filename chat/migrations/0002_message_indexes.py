@@ -0,0 +1,50 @@
+# Schema tuning for the hot message/room access paths.
+
+from django.db import migrations, models
+
+
+class AddPartialIndex(migrations.AddIndex):
+    """
+    AddIndex for indexes with a condition. Backends without partial index
+    support (MySQL/MariaDB) would otherwise silently build a full duplicate
+    of the index, so the operation is a no-op there.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.features.supports_partial_indexes:
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.features.supports_partial_indexes:
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customuser',
+            name='contact',
+            field=models.CharField(db_index=True, max_length=15),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'timestamp'], name='chat_msg_room_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'id'], name='chat_msg_room_id_idx'),
+        ),
+        AddPartialIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['room', 'id'], name='chat_msg_room_live_idx'),
+        ),
+        AddPartialIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['room', 'sender'], name='chat_msg_room_unread_idx'),
+        ),
+    ]
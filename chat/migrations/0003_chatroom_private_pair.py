@@ -0,0 +1,52 @@
+# Canonical participant-pair key for private rooms.
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_private_pairs(apps, schema_editor):
+    """
+    Derive the pair from each existing private room's members (rooms were
+    always created with both participants as members). Rooms whose pair is
+    already taken or that don't have one or two members are left unset and
+    will be superseded by a fresh room on next use.
+    """
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    seen = set()
+    for room in ChatRoom.objects.filter(room_type='private').order_by('id').iterator():
+        member_ids = sorted(room.members.values_list('id', flat=True))
+        if len(member_ids) == 1:
+            member_ids = member_ids * 2
+        if len(member_ids) != 2:
+            continue
+        pair = tuple(member_ids)
+        if pair in seen:
+            continue
+        seen.add(pair)
+        ChatRoom.objects.filter(id=room.id).update(user_low_id=pair[0], user_high_id=pair[1])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_message_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='user_low',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='user_high',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.UniqueConstraint(fields=('user_low', 'user_high'), name='chat_room_private_pair_uniq'),
+        ),
+        migrations.RunPython(fill_private_pairs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,81 @@
+# Full-text search over Message.content (see chat/search.py).
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.utils import OperationalError
+
+FTS5_FORWARDS = [
+    "CREATE VIRTUAL TABLE chat_message_fts USING fts5(content, content='chat_message', content_rowid='id')",
+    """CREATE TRIGGER chat_message_fts_ai AFTER INSERT ON chat_message BEGIN
+        INSERT INTO chat_message_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER chat_message_fts_ad AFTER DELETE ON chat_message BEGIN
+        INSERT INTO chat_message_fts(chat_message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER chat_message_fts_au AFTER UPDATE OF content ON chat_message BEGIN
+        INSERT INTO chat_message_fts(chat_message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO chat_message_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    "INSERT INTO chat_message_fts(chat_message_fts) VALUES ('rebuild')",
+]
+# NB: SQLite rebuilds chat_message on most AlterField/AddField operations,
+# which drops these triggers; such migrations must re-run FTS5_FORWARDS[1:4].
+
+FTS5_BACKWARDS = [
+    "DROP TRIGGER IF EXISTS chat_message_fts_au",
+    "DROP TRIGGER IF EXISTS chat_message_fts_ad",
+    "DROP TRIGGER IF EXISTS chat_message_fts_ai",
+    "DROP TABLE IF EXISTS chat_message_fts",
+]
+
+
+def create_native_index(apps, schema_editor):
+    """
+    FULLTEXT on MySQL, FTS5 on SQLite. SQLite builds without FTS5 and other
+    backends fall back to the SearchPosting inverted index, which is filled
+    by 'manage.py chat_search_reindex'.
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute("CREATE FULLTEXT INDEX chat_msg_content_ft ON chat_message (content)")
+    elif vendor == 'sqlite':
+        try:
+            schema_editor.execute(FTS5_FORWARDS[0])
+        except OperationalError:
+            return  # no FTS5 in this SQLite build
+        for sql in FTS5_FORWARDS[1:]:
+            schema_editor.execute(sql)
+
+
+def drop_native_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute("DROP INDEX chat_msg_content_ft ON chat_message")
+    elif vendor == 'sqlite':
+        for sql in FTS5_BACKWARDS:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_readcursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('frequency', models.PositiveSmallIntegerField(default=1)),
+                ('message', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='chat.message')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='chat.chatroom')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['term', 'room', 'message'], name='chat_posting_term_room_idx')],
+                'constraints': [models.UniqueConstraint(fields=('message', 'term'), name='chat_posting_message_term_uniq')],
+            },
+        ),
+        migrations.RunPython(create_native_index, drop_native_index),
+    ]
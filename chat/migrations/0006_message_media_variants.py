@@ -0,0 +1,23 @@
+# Thumbnail and recompressed variants of uploaded images (see chat/media.py).
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_message_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='media_compressed',
+            field=models.FileField(blank=True, max_length=150, null=True, upload_to=''),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='media_thumbnail',
+            field=models.FileField(blank=True, max_length=150, null=True, upload_to=''),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Content-addressed, reference-counted media storage (see chat/storage.py).
+
+import chat.storage
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_message_media_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=150, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('ref_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('released_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+            ],
+        ),
+        # Storage is not a column property; state only, so SQLite does not rebuild
+        # chat_message (which would drop the FTS5 triggers from 0005).
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='message',
+                    name='media',
+                    field=models.FileField(blank=True, null=True, storage=chat.storage.get_media_storage, upload_to='chat_media/'),
+                ),
+                migrations.AlterField(
+                    model_name='message',
+                    name='media_compressed',
+                    field=models.FileField(blank=True, max_length=150, null=True, storage=chat.storage.get_media_storage, upload_to=''),
+                ),
+                migrations.AlterField(
+                    model_name='message',
+                    name='media_thumbnail',
+                    field=models.FileField(blank=True, max_length=150, null=True, storage=chat.storage.get_media_storage, upload_to=''),
+                ),
+            ],
+        ),
+    ]
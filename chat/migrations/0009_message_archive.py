@@ -0,0 +1,52 @@
+# Hot/cold message archival (see chat/archive.py).
+
+import chat.storage
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='archive_after_days',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='archived_up_to',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ArchivedSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_id', models.BigIntegerField()),
+                ('last_id', models.BigIntegerField()),
+                ('message_count', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('room', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='chat.chatroom')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['room', 'last_id'], name='chat_archive_room_last_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedAttachment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_id', models.BigIntegerField(unique=True)),
+                ('media', models.FileField(blank=True, null=True, storage=chat.storage.get_media_storage, upload_to='chat_media/')),
+                ('media_thumbnail', models.FileField(blank=True, max_length=150, null=True, storage=chat.storage.get_media_storage, upload_to='')),
+                ('media_compressed', models.FileField(blank=True, max_length=150, null=True, storage=chat.storage.get_media_storage, upload_to='')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='chat.chatroom')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Expiry for queued jobs (see chat/jobs.py).
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_customuser_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -90,6 +90,8 @@ from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
 from django.utils import timezone
 
+from .storage import get_media_storage
+
 class CustomUserManager(BaseUserManager):
     def create_user(self, email, username, age, contact, gender, password=None):
         if not email:
@@ -115,13 +117,15 @@ class CustomUser(AbstractBaseUser):
     email = models.EmailField(unique=True)
     username = models.CharField(max_length=100, unique=True)
     age = models.IntegerField()
-    contact = models.CharField(max_length=15)
+    contact = models.CharField(max_length=15, db_index=True)  # RegisterForm.clean_contact lookups
     gender = models.CharField(max_length=10)
     is_active = models.BooleanField(default=True)
     is_admin = models.BooleanField(default=False)
 
     otp = models.CharField(max_length=6, blank=True, null=True)
     otp_created_at = models.DateTimeField(blank=True, null=True)  # ✅ Added this
+    # Lets each process's user directory pick up renames (chat/directory.py)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     objects = CustomUserManager()
 
@@ -146,8 +150,21 @@ class ChatRoom(models.Model):
     creator = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, related_name='created_rooms')
     created_at = models.DateTimeField(default=timezone.now)  # ✅ Creation time
 
+    # Private rooms only: ordered participant pair (user_low.id <= user_high.id), see chat/rooms.py
+    user_low = models.ForeignKey(CustomUser, on_delete=models.CASCADE, null=True, blank=True, related_name='+', db_index=False)
+    user_high = models.ForeignKey(CustomUser, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    # Messages older than this many days move to the archive (see chat/archive.py);
+    # NULL uses CHAT_ARCHIVE_AFTER_DAYS, 0 keeps everything in chat_message
+    archive_after_days = models.PositiveIntegerField(null=True, blank=True)
+    # Highest message id moved to the archive; history reads only look there below it
+    archived_up_to = models.BigIntegerField(null=True, blank=True)
+
     class Meta:
         unique_together = ('name', 'room_type')
+        constraints = [
+            # Also serves the (user_low, user_high) lookup; group rooms leave both NULL
+            models.UniqueConstraint(fields=['user_low', 'user_high'], name='chat_room_private_pair_uniq'),
+        ]
 
     def __str__(self):
         return self.name or f"Room {self.id}"
@@ -157,10 +174,160 @@ class Message(models.Model):
     room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     content = models.TextField(blank=True)
-    media = models.FileField(upload_to='chat_media/', blank=True, null=True)
+    # Content-addressed and deduplicated, see chat/storage.py
+    media = models.FileField(upload_to='chat_media/', storage=get_media_storage, blank=True, null=True)
+    # Variants of image uploads, see chat/media.py
+    media_thumbnail = models.FileField(max_length=150, storage=get_media_storage, blank=True, null=True)
+    media_compressed = models.FileField(max_length=150, storage=get_media_storage, blank=True, null=True)
     timestamp = models.DateTimeField(default=timezone.now)
     is_read = models.BooleanField(default=False)
     is_deleted = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # Room history ordered by time, and keyset pages on (room, id)
+            models.Index(fields=['room', 'timestamp'], name='chat_msg_room_ts_idx'),
+            models.Index(fields=['room', 'id'], name='chat_msg_room_id_idx'),
+            # Partial indexes; only created on backends with partial index support
+            models.Index(fields=['room', 'id'], condition=models.Q(is_deleted=False), name='chat_msg_room_live_idx'),
+            models.Index(fields=['room', 'sender'], condition=models.Q(is_read=False), name='chat_msg_room_unread_idx'),
+        ]
+
     def __str__(self):
         return f"{self.sender.username}: {self.content[:30]}"
+
+    @property
+    def display_media(self):
+        """The recompressed variant when there is one, else the original upload."""
+        return self.media_compressed or self.media
+
+
+class ReadCursor(models.Model):
+    """Highest message id a user has read in a room; everything above it is unread."""
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='read_cursors')
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='read_cursors')
+    last_read_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'room'], name='chat_read_cursor_user_room_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} read room {self.room_id} up to {self.last_read_id}"
+
+
+class SearchPosting(models.Model):
+    """
+    Inverted index entry for the fallback search backend: ``term`` occurs
+    ``frequency`` times in ``message`` (see chat/search.py).
+    """
+    term = models.CharField(max_length=64)
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='+', db_index=False)
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='+')
+    frequency = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['term', 'room', 'message'], name='chat_posting_term_room_idx'),
+        ]
+        constraints = [
+            # Also serves the ON DELETE CASCADE lookups by message
+            models.UniqueConstraint(fields=['message', 'term'], name='chat_posting_message_term_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.term} in {self.message_id}"
+
+
+class MediaBlob(models.Model):
+    """A stored media file and how many message fields refer to it (see chat/storage.py)."""
+    name = models.CharField(max_length=150, unique=True)
+    size = models.BigIntegerField()
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    # When ref_count last dropped to zero; garbage collection waits a grace period
+    released_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} refs)"
+
+
+class Job(models.Model):
+    """A queued background side effect, run by the chat_worker command (see chat/jobs.py)."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=64)
+    payload = models.JSONField(default=dict)
+    # Enqueueing the same key twice yields the existing job
+    idempotency_key = models.CharField(max_length=150, unique=True, null=True, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    # Not run, nor retried, after this (e.g. an OTP email once the OTP has expired)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    # A running job whose lease has expired (worker died) is picked up again
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='chat_job_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.id} ({self.status}, attempt {self.attempts})"
+
+
+class ArchivedSegment(models.Model):
+    """
+    A run of one room's oldest messages, moved out of ``chat_message`` and
+    stored as a single compressed blob (see chat/archive.py).
+    """
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='+', db_index=False)
+    first_id = models.BigIntegerField()
+    last_id = models.BigIntegerField()
+    message_count = models.PositiveIntegerField()
+    data = models.BinaryField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Newest-first walk of a room's segments; also serves the room FK
+            models.Index(fields=['room', 'last_id'], name='chat_archive_room_last_idx'),
+        ]
+
+    def __str__(self):
+        return f"Room {self.room_id} messages {self.first_id}..{self.last_id}"
+
+
+class ArchivedAttachment(models.Model):
+    """
+    Media of an archived message. Holds the storage references the message
+    row held, and lets the media view find the files without a segment scan.
+    """
+    message_id = models.BigIntegerField(unique=True)
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='+')
+    media = models.FileField(upload_to='chat_media/', storage=get_media_storage, blank=True, null=True)
+    media_thumbnail = models.FileField(max_length=150, storage=get_media_storage, blank=True, null=True)
+    media_compressed = models.FileField(max_length=150, storage=get_media_storage, blank=True, null=True)
+
+    def __str__(self):
+        return f"Attachment of archived message {self.message_id}"
+
+    @property
+    def display_media(self):
+        return self.media_compressed or self.media
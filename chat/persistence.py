@@ -0,0 +1,252 @@
+# chat/persistence.py
+"""
+Message persistence for the WebSocket consumers.
+
+Two durability modes are supported (``settings.CHAT_PERSISTENCE_MODE``):
+
+* ``"sync"``    – every message is written with its own ``save()`` before it is
+                  broadcast (the original behaviour, and the default).
+* ``"batched"`` – messages are given an ID up front, broadcast immediately and
+                  written behind with ``bulk_create`` once the buffer reaches
+                  ``CHAT_PERSISTENCE_BATCH_SIZE`` rows or
+                  ``CHAT_PERSISTENCE_FLUSH_INTERVAL`` seconds have passed.
+
+In batched mode every ``Message`` insert takes its ID from the allocator,
+including media messages, which are still written synchronously, so IDs never
+mix with the database's autoincrement counter. Each worker process needs its
+own ``CHAT_NODE_ID``; the app refuses to start without one.
+"""
+import asyncio
+import atexit
+import logging
+import threading
+import time
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, IntegrityError, transaction
+
+from .frames import delete_frame
+from .models import Message
+from .rooms import room_group_name
+from .search import index_messages
+
+logger = logging.getLogger(__name__)
+
+SYNC = "sync"
+BATCHED = "batched"
+
+
+# -------------------------
+# Helper: Up-front Message IDs
+# -------------------------
+class MessageIdAllocator:
+    """
+    Time-ordered 53-bit IDs, so they stay exact as JavaScript numbers.
+
+    Layout: 41 bits of milliseconds since ``EPOCH_MS`` | 5 bits node | 7 bits
+    sequence. IDs from one process are strictly increasing, which keeps
+    ``ORDER BY id`` equivalent to ``ORDER BY timestamp`` for batched rows.
+    Two workers with the same ``node_id`` can mint the same ID, so every worker
+    in a deployment must get its own.
+    """
+    EPOCH_MS = 1735689600000  # 2025-01-01T00:00:00Z
+    NODE_BITS = 5
+    SEQUENCE_BITS = 7
+
+    def __init__(self, node_id):
+        if not 0 <= node_id < 1 << self.NODE_BITS:
+            raise ImproperlyConfigured(f"CHAT_NODE_ID must be between 0 and {(1 << self.NODE_BITS) - 1}, got {node_id}")
+        self.node_id = node_id
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def next_id(self):
+        with self._lock:
+            now_ms = int(time.time() * 1000) - self.EPOCH_MS
+            if now_ms < self._last_ms:
+                # Clock went backwards; keep handing out IDs from the last tick.
+                now_ms = self._last_ms
+            if now_ms == self._last_ms:
+                self._sequence = (self._sequence + 1) % (1 << self.SEQUENCE_BITS)
+                if self._sequence == 0:
+                    # Sequence exhausted for this millisecond, borrow the next one.
+                    now_ms = self._last_ms + 1
+            else:
+                self._sequence = 0
+            self._last_ms = now_ms
+            return (
+                (now_ms << (self.NODE_BITS + self.SEQUENCE_BITS))
+                | (self.node_id << self.SEQUENCE_BITS)
+                | self._sequence
+            )
+
+
+# -------------------------
+# Write-behind buffer
+# -------------------------
+class BufferFull(Exception):
+    """The write-behind buffer is at ``CHAT_MESSAGE_BUFFER_MAX``; the message was not taken."""
+
+
+class MessageBuffer:
+    """
+    Per-process write-behind buffer for ``Message`` rows.
+
+    ``add()`` never waits on the database unless the buffer is full; a
+    background timer flushes partial batches. ``flush()`` is safe to call at
+    any time and is awaited on ASGI lifespan shutdown.
+
+    Every message in the buffer has already been broadcast. A batch the
+    database cannot take right now goes back into the buffer and is retried. A
+    row it rejects for good (e.g. its room was deleted meanwhile) is logged and
+    retracted from the room with a delete frame, so clients stop showing it.
+
+    At most ``max_size`` messages are held, counting a batch being written.
+    Once that many are waiting (the database has been failing for a while),
+    ``add()`` raises ``BufferFull`` before the message is broadcast.
+    """
+
+    def __init__(self, batch_size, flush_interval, max_size):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self._pending = []
+        self._in_flight = 0
+        self._timer = None
+        self._flush_lock = None
+
+    def __len__(self):
+        return len(self._pending) + self._in_flight
+
+    async def add(self, message):
+        if len(self) >= self.max_size:
+            raise BufferFull(len(self))
+        self._pending.append(message)
+        if len(self._pending) >= self.batch_size:
+            await self.flush()
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            batch, self._pending = self._pending, []
+            if not batch:
+                return
+            self._in_flight = len(batch)
+            try:
+                rejected = await database_sync_to_async(self.write)(batch)
+            except DatabaseError:
+                logger.exception("Writing %d buffered messages failed, will retry", len(batch))
+                self._pending[:0] = batch
+                if self._timer is None or self._timer.done():
+                    self._timer = asyncio.ensure_future(self._flush_later())
+                return
+            finally:
+                self._in_flight = 0
+        for message in rejected:
+            await retract_message(message)
+
+    def flush_sync(self):
+        """Drain whatever is left without an event loop (used at interpreter exit)."""
+        batch, self._pending = self._pending, []
+        if batch:
+            self.write(batch)
+
+    def write(self, batch):
+        """Insert ``batch``; returns the messages the database rejected."""
+        try:
+            with transaction.atomic():
+                Message.objects.bulk_create(batch, batch_size=self.batch_size)
+                index_messages(batch)
+            return []
+        except IntegrityError:
+            # One bad row must not take the whole batch with it
+            logger.warning("Batched message insert failed, retrying %d rows one by one", len(batch))
+        rejected = []
+        for message in batch:
+            try:
+                with transaction.atomic():
+                    message.save(force_insert=True)
+                    index_messages([message])
+            except IntegrityError:
+                logger.exception("Message %s in room %s was broadcast but cannot be stored", message.pk, message.room_id)
+                rejected.append(message)
+        return rejected
+
+
+async def retract_message(message):
+    """Tell the room to drop a broadcast message that was never stored."""
+    await get_channel_layer().group_send(
+        room_group_name(message.room),
+        {
+            "type": "delete_message_event",
+            "frames": delete_frame(message.id),
+        }
+    )
+
+
+_allocator = None
+_buffer = None
+
+
+def get_allocator():
+    global _allocator
+    if _allocator is None:
+        if settings.CHAT_NODE_ID is None:
+            raise ImproperlyConfigured(
+                "CHAT_PERSISTENCE_MODE = 'batched' needs CHAT_NODE_ID, unique per worker process"
+            )
+        _allocator = MessageIdAllocator(settings.CHAT_NODE_ID)
+    return _allocator
+
+
+def get_buffer():
+    global _buffer
+    if _buffer is None:
+        _buffer = MessageBuffer(
+            batch_size=settings.CHAT_PERSISTENCE_BATCH_SIZE,
+            flush_interval=settings.CHAT_PERSISTENCE_FLUSH_INTERVAL,
+            max_size=settings.CHAT_MESSAGE_BUFFER_MAX,
+        )
+        atexit.register(_buffer.flush_sync)
+    return _buffer
+
+
+def is_batched():
+    return settings.CHAT_PERSISTENCE_MODE == BATCHED
+
+
+async def persist_message(message):
+    """
+    Persist ``message`` according to ``CHAT_PERSISTENCE_MODE``.
+
+    In batched mode the message gets its primary key here, so callers can
+    broadcast ``message.id`` right away. Messages carrying media are always
+    written synchronously because their storage name is only final after save,
+    but they still take their ID from the allocator. Raises ``BufferFull``
+    when the write-behind buffer cannot take another message.
+    """
+    if not is_batched():
+        await database_sync_to_async(message.save)()
+        return message
+    message.id = get_allocator().next_id()
+    if message.media:
+        await database_sync_to_async(message.save)(force_insert=True)
+    else:
+        await get_buffer().add(message)
+    return message
+
+
+async def flush_pending_messages():
+    if _buffer is not None:
+        await _buffer.flush()
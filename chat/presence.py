@@ -0,0 +1,176 @@
+# chat/presence.py
+"""
+Ephemeral typing, presence and heartbeat signals.
+
+These never reach ``save_message`` or the ORM: a frame is throttled (at most
+one per user per room per interval), encoded once and fanned out through the
+channel layer. Client protocol:
+
+    client -> {"action": "typing"}
+    client -> {"action": "heartbeat"}      (every ``heartbeat`` seconds)
+    server -> {"action": "presence_state", "online": [user_id, ...], "heartbeat"}   (on connect)
+    server -> {"action": "presence", "user_id", "username", "online": true|false}
+    server -> {"action": "typing", "user_id", "username"}
+
+Presence is a set of ``"<user_id>:<channel_name>"`` members per room group,
+each expiring ``CHAT_PRESENCE_TTL`` seconds after its last heartbeat. It lives
+in a Redis sorted set scored by expiry time, or in process memory with
+``CHAT_PRESENCE_STORE = "local"`` (single process, in-memory channel layer).
+"""
+import math
+import time
+
+from django.conf import settings
+
+from .frames import presence_frame, typing_frame
+
+EPHEMERAL_ACTIONS = ("typing", "heartbeat")
+
+
+class Throttle:
+    """Remembers when each key last passed, so bursts collapse to one per interval."""
+    MAX_KEYS = 10000
+
+    def __init__(self):
+        self._last = {}
+
+    def allow(self, key, interval):
+        now = time.monotonic()
+        last = self._last.get(key)
+        if last is not None and now - last < interval:
+            return False
+        if len(self._last) >= self.MAX_KEYS:
+            horizon = now - settings.CHAT_PRESENCE_TTL
+            self._last = {k: t for k, t in self._last.items() if t > horizon}
+        self._last[key] = now
+        return True
+
+
+def online_user_ids(members):
+    return {int(member.split(":", 1)[0]) for member in members}
+
+
+class LocalPresenceStore:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._groups = {}  # group -> {member: expires_at}
+
+    def _live(self, group, now):
+        entries = self._groups.get(group, {})
+        for member in [m for m, expires in entries.items() if expires <= now]:
+            del entries[member]
+        return entries
+
+    async def touch(self, group, member):
+        """Refresh ``member``; returns ``(is_new, live_members)``."""
+        now = time.time()
+        entries = self._live(group, now)
+        is_new = member not in entries
+        entries[member] = now + self.ttl
+        self._groups[group] = entries
+        return is_new, list(entries)
+
+    async def leave(self, group, member):
+        entries = self._live(group, time.time())
+        entries.pop(member, None)
+        if not entries:
+            self._groups.pop(group, None)
+        return list(entries)
+
+
+class RedisPresenceStore:
+    def __init__(self, url, ttl):
+        import redis.asyncio as redis
+
+        self.ttl = ttl
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+
+    @staticmethod
+    def _key(group):
+        return f"chat:presence:{group}"
+
+    async def touch(self, group, member):
+        key, now = self._key(group), time.time()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(key, "-inf", now)
+            pipe.zadd(key, {member: now + self.ttl})
+            pipe.expire(key, math.ceil(self.ttl))
+            pipe.zrangebyscore(key, now, "+inf")
+            _, added, _, members = await pipe.execute()
+        return bool(added), members
+
+    async def leave(self, group, member):
+        key = self._key(group)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(key, member)
+            pipe.zrangebyscore(key, time.time(), "+inf")
+            _, members = await pipe.execute()
+        return members
+
+
+_store = None
+_throttle = Throttle()
+
+
+def get_presence_store():
+    global _store
+    if _store is None:
+        if settings.CHAT_PRESENCE_STORE == "local":
+            _store = LocalPresenceStore(ttl=settings.CHAT_PRESENCE_TTL)
+        else:
+            _store = RedisPresenceStore(settings.REDIS_URL, ttl=settings.CHAT_PRESENCE_TTL)
+    return _store
+
+
+class PresenceMixin:
+    """
+    Adds ephemeral events to a chat consumer. The consumer must provide
+    ``self.user``, ``self.room_group_name``, ``send_frame`` and ``forward_frames``.
+    """
+
+    @property
+    def presence_member(self):
+        return f"{self.user.id}:{self.channel_name}"
+
+    async def join_presence(self):
+        is_new, members = await get_presence_store().touch(self.room_group_name, self.presence_member)
+        online = online_user_ids(members)
+        await self.send_frame({
+            "action": "presence_state",
+            "online": sorted(online),
+            "heartbeat": settings.CHAT_PRESENCE_HEARTBEAT_INTERVAL,
+        })
+        await self.announce_presence(is_new, members)
+
+    async def leave_presence(self):
+        members = await get_presence_store().leave(self.room_group_name, self.presence_member)
+        if self.user.id not in online_user_ids(members):
+            await self.send_ephemeral(presence_frame(self.user, online=False))
+
+    async def announce_presence(self, is_new, members):
+        # Only the user's first live connection in the room makes them "online"
+        others = [m for m in members if m != self.presence_member]
+        if is_new and self.user.id not in online_user_ids(others):
+            await self.send_ephemeral(presence_frame(self.user, online=True))
+
+    async def handle_ephemeral(self, action):
+        if action == "typing":
+            if _throttle.allow(("typing", self.room_group_name, self.user.id), settings.CHAT_TYPING_INTERVAL):
+                await self.send_ephemeral(typing_frame(self.user))
+        elif action == "heartbeat":
+            # Half the client interval, so timer jitter never drops a heartbeat
+            interval = settings.CHAT_PRESENCE_HEARTBEAT_INTERVAL / 2
+            if _throttle.allow(("heartbeat", self.presence_member), interval):
+                is_new, members = await get_presence_store().touch(self.room_group_name, self.presence_member)
+                await self.announce_presence(is_new, members)
+
+    async def send_ephemeral(self, frames):
+        await self.channel_layer.group_send(self.room_group_name, {
+            "type": "ephemeral_event",
+            "frames": frames,
+            "sender_channel": self.channel_name,
+        })
+
+    async def ephemeral_event(self, event):
+        if event["sender_channel"] != self.channel_name:
+            await self.forward_frames(event)
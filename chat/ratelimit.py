@@ -0,0 +1,225 @@
+# chat/ratelimit.py
+"""
+Token-bucket limits on inbound chat frames.
+
+Every message a client sends costs one token from three buckets: its
+connection, its user (across all their sockets) and its room. Each bucket
+holds at most ``burst`` tokens and refills at ``rate`` tokens per second. A
+message passes only if all three have a token (all or nothing). Otherwise
+``CHAT_RATE_LIMIT_POLICY`` decides:
+
+* ``"reject"``   – drop it.
+* ``"queue"``    – keep it in a per-connection backlog of at most
+                   ``CHAT_RATE_LIMIT_QUEUE`` messages and send it, in order,
+                   once tokens are available again.
+* ``"coalesce"`` – like ``"queue"``, but everything waiting goes out as one
+                   message (one database write and one broadcast).
+
+Whatever happens, the client is told with a typed frame:
+
+    server -> {"action": "error", "code": "rate_limited" | "queue_full",
+               "scope": "connection" | "user" | "room",
+               "policy": "rejected" | "queued" | "coalesced", "retry_after"}
+
+Upload handshakes are limited the same way but always rejected, with an
+``upload_error`` that carries the same ``code`` / ``retry_after``.
+
+Buckets live in process memory (``CHAT_RATE_LIMIT_STORE = "local"``, so user
+and room limits apply per worker) or in Redis (``"redis"``, shared by every
+worker; one round trip per message).
+"""
+import asyncio
+import time
+
+from django.conf import settings
+
+REJECT = "reject"
+QUEUE = "queue"
+COALESCE = "coalesce"
+SCOPES = ("connection", "user", "room")
+
+
+def bucket_limits():
+    """``(rate, burst)`` per scope, from settings."""
+    return {
+        "connection": (settings.CHAT_RATE_LIMIT_CONNECTION_RATE, settings.CHAT_RATE_LIMIT_CONNECTION_BURST),
+        "user": (settings.CHAT_RATE_LIMIT_USER_RATE, settings.CHAT_RATE_LIMIT_USER_BURST),
+        "room": (settings.CHAT_RATE_LIMIT_ROOM_RATE, settings.CHAT_RATE_LIMIT_ROOM_BURST),
+    }
+
+
+class LocalRateLimiter:
+    MAX_KEYS = 10000
+
+    def __init__(self):
+        self._buckets = {}  # key -> (tokens, updated_at, full_at)
+
+    def _prune(self, now):
+        # A bucket that has refilled completely is the same as no bucket
+        self._buckets = {key: state for key, state in self._buckets.items() if state[2] > now}
+
+    async def take(self, buckets, cost=1):
+        """
+        ``buckets`` is a list of ``(key, rate, burst)``. Takes ``cost`` tokens
+        from each if all have them and returns ``(None, 0)``; otherwise takes
+        nothing and returns ``(index of the slowest bucket, seconds to wait)``.
+        """
+        now = time.monotonic()
+        if len(self._buckets) >= self.MAX_KEYS:
+            self._prune(now)
+        levels = []
+        blocked, wait = None, 0.0
+        for i, (key, rate, burst) in enumerate(buckets):
+            tokens, updated, _ = self._buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            levels.append(tokens)
+            if tokens < cost and (cost - tokens) / rate > wait:
+                blocked, wait = i, (cost - tokens) / rate
+        if blocked is None:
+            for (key, rate, burst), tokens in zip(buckets, levels):
+                left = tokens - cost
+                self._buckets[key] = (left, now, now + (burst - left) / rate)
+        return blocked, wait
+
+
+class RedisRateLimiter:
+    # All-or-nothing over every bucket, on the server's clock so workers agree
+    SCRIPT = """
+        local now = redis.call('TIME')
+        now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+        local cost = tonumber(ARGV[1])
+        local levels = {}
+        local blocked, wait = 0, 0
+        for i, key in ipairs(KEYS) do
+            local rate, burst = tonumber(ARGV[2 * i]), tonumber(ARGV[2 * i + 1])
+            local state = redis.call('HMGET', key, 't', 'ts')
+            local tokens = tonumber(state[1]) or burst
+            local updated = tonumber(state[2]) or now
+            tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+            levels[i] = tokens
+            if tokens < cost and (cost - tokens) / rate > wait then
+                blocked, wait = i, (cost - tokens) / rate
+            end
+        end
+        if blocked == 0 then
+            for i, key in ipairs(KEYS) do
+                local rate, burst = tonumber(ARGV[2 * i]), tonumber(ARGV[2 * i + 1])
+                redis.call('HSET', key, 't', tostring(levels[i] - cost), 'ts', tostring(now))
+                redis.call('PEXPIRE', key, math.ceil(burst / rate * 1000) + 1000)
+            end
+        end
+        return {blocked, tostring(wait)}
+    """
+
+    def __init__(self, url):
+        import redis.asyncio as redis
+
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.script = self.redis.register_script(self.SCRIPT)
+
+    async def take(self, buckets, cost=1):
+        args = [cost]
+        for _, rate, burst in buckets:
+            args += [rate, burst]
+        blocked, wait = await self.script(keys=[f"chat:ratelimit:{key}" for key, _, _ in buckets], args=args)
+        return (int(blocked) - 1 if int(blocked) else None), float(wait)
+
+
+_limiter = None
+
+
+def get_rate_limiter():
+    global _limiter
+    if _limiter is None:
+        if settings.CHAT_RATE_LIMIT_STORE == "redis":
+            _limiter = RedisRateLimiter(settings.REDIS_URL)
+        else:
+            _limiter = LocalRateLimiter()
+    return _limiter
+
+
+class RateLimitMixin:
+    """
+    Adds inbound limits to a chat consumer. The consumer must provide
+    ``self.user``, ``self.room_group_name``, ``send_frame`` and
+    ``post_message(text)``, which saves and broadcasts a text message.
+    """
+    backlog = None
+    drain_task = None
+
+    async def check_rate(self):
+        """``(None, 0)`` and a token spent, or ``(scope, retry_after)`` when over a limit."""
+        limits = bucket_limits()
+        keys = {
+            "connection": f"conn:{self.channel_name}",
+            "user": f"user:{self.user.id}",
+            "room": f"room:{self.room_group_name}",
+        }
+        buckets = [(keys[scope], *limits[scope]) for scope in SCOPES]
+        blocked, wait = await get_rate_limiter().take(buckets)
+        return (SCOPES[blocked] if blocked is not None else None), wait
+
+    async def send_rate_error(self, scope, retry_after, policy, code="rate_limited"):
+        await self.send_frame({
+            "action": "error",
+            "code": code,
+            "scope": scope,
+            "policy": policy,
+            "retry_after": round(retry_after, 2),
+        })
+
+    async def submit_message(self, text):
+        """Post ``text`` now, or apply the over-limit policy."""
+        if self.backlog:
+            # Messages already waiting go first
+            return await self.defer_message(text, "connection", 0)
+        scope, retry_after = await self.check_rate()
+        if scope is None:
+            return await self.post_message(text)
+        if settings.CHAT_RATE_LIMIT_POLICY not in (QUEUE, COALESCE):
+            return await self.send_rate_error(scope, retry_after, "rejected")
+        await self.defer_message(text, scope, retry_after)
+
+    async def defer_message(self, text, scope, retry_after):
+        if self.backlog is None:
+            self.backlog = []
+        if len(self.backlog) >= settings.CHAT_RATE_LIMIT_QUEUE:
+            return await self.send_rate_error(scope, retry_after, "rejected", code="queue_full")
+        self.backlog.append(text)
+        policy = "coalesced" if settings.CHAT_RATE_LIMIT_POLICY == COALESCE else "queued"
+        await self.send_rate_error(scope, retry_after, policy)
+        if self.drain_task is None or self.drain_task.done():
+            self.drain_task = asyncio.ensure_future(self.drain_backlog())
+
+    async def drain_backlog(self):
+        while self.backlog:
+            scope, retry_after = await self.check_rate()
+            if scope is not None:
+                await asyncio.sleep(retry_after)
+                continue
+            if settings.CHAT_RATE_LIMIT_POLICY == COALESCE:
+                texts, self.backlog = self.backlog, []
+                await self.post_message("\n".join(texts))
+            else:
+                await self.post_message(self.backlog.pop(0))
+
+    async def admit_upload(self, upload_id):
+        """Limit upload handshakes; over the limit they are always rejected."""
+        scope, retry_after = await self.check_rate()
+        if scope is None:
+            return True
+        await self.send_frame({
+            "action": "upload_error",
+            "upload_id": upload_id,
+            "error": "Too many messages, slow down.",
+            "code": "rate_limited",
+            "scope": scope,
+            "retry_after": round(retry_after, 2),
+        })
+        return False
+
+    def stop_backlog(self):
+        """Drop anything still waiting (the socket is closing)."""
+        self.backlog = None
+        if self.drain_task is not None:
+            self.drain_task.cancel()
@@ -0,0 +1,208 @@
+# chat/receipts.py
+"""
+Read receipts backed by per-user, per-room read cursors.
+
+Clients report "read up to message X" over the chat socket
+(``{"action": "read", "up_to": X}``). Reports are merged in memory, keeping
+only the highest id per (room, user), and every ``CHAT_READ_RECEIPT_INTERVAL``
+seconds the pending cursors are written with one INSERT for new cursors and
+one conditional UPDATE that only moves existing ones forward, and announced
+with one ``read_receipt`` frame per room. ``up_to`` comes from the client, so
+each cursor is first clamped to the newest message its room actually has.
+Unread counts are derived from the cursor (see chat/conversations.py), so
+``Message.is_read`` is never touched.
+"""
+import asyncio
+import atexit
+import logging
+from collections import defaultdict
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import DatabaseError, DataError, IntegrityError, transaction
+from django.db.models import BigIntegerField, Case, F, Max, Q, Value, When
+from django.utils import timezone
+
+from .frames import receipt_frame
+from .models import ChatRoom, ReadCursor
+from .rooms import room_group_name
+
+logger = logging.getLogger(__name__)
+
+
+class ReadCursorBuffer:
+    """
+    Per-process buffer of pending cursor moves. A cursor only ever moves
+    forward, within a process and in the database.
+    """
+
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self._pending = {}  # (room_id, user_id) -> last_read_id
+        self._groups = {}   # room_id -> channel group name
+        self._timer = None
+        self._flush_lock = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def mark_read(self, room, user_id, message_id):
+        key = (room.id, user_id)
+        if message_id <= self._pending.get(key, 0):
+            return
+        self._pending[key] = message_id
+        self._groups[room.id] = room_group_name(room)
+        if self._timer is None or self._timer.done():
+            self._timer = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            pending, self._pending = self._pending, {}
+            groups, self._groups = self._groups, {}
+            if not pending:
+                return
+            try:
+                pending = await database_sync_to_async(self.write)(pending)
+            except DatabaseError:
+                logger.exception("Read cursor flush failed, keeping %d cursors for the next one", len(pending))
+                self.requeue(pending, groups)
+                return
+            await self.broadcast(pending, groups)
+
+    def requeue(self, pending, groups):
+        """Put back cursors from a failed flush; newer reports that arrived since win."""
+        for key, message_id in pending.items():
+            if message_id > self._pending.get(key, 0):
+                self._pending[key] = message_id
+        for room_id, group in groups.items():
+            self._groups.setdefault(room_id, group)
+        if self._timer is None or self._timer.done():
+            self._timer = asyncio.ensure_future(self._flush_later())
+
+    def flush_sync(self):
+        """Write whatever is left without an event loop (used at interpreter exit)."""
+        pending, self._pending = self._pending, {}
+        if pending:
+            self.write(pending)
+
+    def write(self, pending):
+        """
+        Insert the cursors that don't exist yet and move the others forward in
+        one UPDATE. A cursor is never moved back, even when another process
+        flushes an older report after a newer one. Returns the cursors as
+        written, after clamping.
+        """
+        pending = self.clamp(pending)
+        if not pending:
+            return pending
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                ReadCursor.objects.bulk_create([
+                    ReadCursor(room_id=room_id, user_id=user_id, last_read_id=last_read_id, updated_at=now)
+                    for (room_id, user_id), last_read_id in pending.items()
+                ], ignore_conflicts=True)
+                self.advance(pending, now)
+        except (IntegrityError, DataError):
+            # A room or user deleted since the report; keep the other cursors.
+            logger.warning("Read cursor write failed, retrying %d rows one by one", len(pending))
+            for (room_id, user_id), last_read_id in pending.items():
+                try:
+                    with transaction.atomic():
+                        ReadCursor.objects.get_or_create(
+                            room_id=room_id, user_id=user_id,
+                            defaults={"last_read_id": last_read_id, "updated_at": now},
+                        )
+                        self.advance({(room_id, user_id): last_read_id}, now)
+                except (IntegrityError, DataError):
+                    logger.exception("Dropping read cursor for user %s in room %s", user_id, room_id)
+        return pending
+
+    @staticmethod
+    def clamp(pending):
+        """
+        Cap each cursor at the newest message in its room, archived ones
+        included, so a bogus ``up_to`` can neither overflow the column nor mark
+        future messages read. Cursors for rooms that are gone are dropped.
+        Messages still in another worker's write-behind buffer are not seen
+        yet; the client's next report moves the cursor past them.
+        """
+        rooms = ChatRoom.objects.filter(id__in={room_id for room_id, _ in pending}).annotate(newest=Max("messages__id"))
+        newest = {
+            room_id: max(latest or 0, archived_up_to or 0)
+            for room_id, latest, archived_up_to in rooms.values_list("id", "newest", "archived_up_to")
+        }
+        clamped = {}
+        for (room_id, user_id), last_read_id in pending.items():
+            last_read_id = min(last_read_id, newest.get(room_id, 0))
+            if last_read_id > 0:
+                clamped[room_id, user_id] = last_read_id
+        return clamped
+
+    @staticmethod
+    def advance(pending, now):
+        behind = Q()
+        for (room_id, user_id), last_read_id in pending.items():
+            behind |= Q(room_id=room_id, user_id=user_id, last_read_id__lt=last_read_id)
+        # The WHERE clause and the new value are evaluated together for each
+        # row, so a concurrent higher cursor is left alone
+        ReadCursor.objects.filter(behind).update(
+            last_read_id=Case(*(
+                When(room_id=room_id, user_id=user_id, then=Value(last_read_id))
+                for (room_id, user_id), last_read_id in pending.items()
+            ), default=F("last_read_id"), output_field=BigIntegerField()),
+            updated_at=now,
+        )
+
+    async def broadcast(self, pending, groups):
+        by_room = defaultdict(list)
+        for (room_id, user_id), last_read_id in pending.items():
+            by_room[room_id].append({"user_id": user_id, "last_read_id": last_read_id})
+
+        channel_layer = get_channel_layer()
+        for room_id, cursors in by_room.items():
+            await channel_layer.group_send(groups[room_id], {
+                "type": "read_receipt",
+                "frames": receipt_frame(room_id, cursors),
+            })
+
+
+_buffer = None
+
+
+def get_receipt_buffer():
+    global _buffer
+    if _buffer is None:
+        _buffer = ReadCursorBuffer(flush_interval=settings.CHAT_READ_RECEIPT_INTERVAL)
+        atexit.register(_buffer.flush_sync)
+    return _buffer
+
+
+async def flush_pending_receipts():
+    if _buffer is not None:
+        await _buffer.flush()
+
+
+class ReadReceiptMixin:
+    """
+    Adds ``read`` frames and ``read_receipt`` events to a chat consumer. The
+    consumer must provide ``self.room``, ``self.user`` and ``forward_frames``.
+    """
+
+    async def mark_read(self, data):
+        try:
+            up_to = int(data.get("up_to", 0))
+        except (TypeError, ValueError):
+            return
+        if up_to > 0 and self.room is not None:
+            get_receipt_buffer().mark_read(self.room, self.user.id, up_to)
+
+    async def read_receipt(self, event):
+        await self.forward_frames(event)
@@ -0,0 +1,72 @@
+# chat/rooms.py
+"""
+Room resolution shared by views, consumers and broadcasts.
+
+A private conversation is identified by its ordered participant pair
+``(user_low, user_high)``, so finding it is one lookup on an integer-keyed
+unique index. Channel-layer group names are derived from the room's primary
+key here and nowhere else.
+"""
+from .models import ChatRoom
+
+
+def private_pair(user, other):
+    return (user.id, other.id) if user.id <= other.id else (other.id, user.id)
+
+
+def get_private_room(user, other):
+    low, high = private_pair(user, other)
+    room, created = ChatRoom.objects.get_or_create(
+        room_type="private",
+        user_low_id=low,
+        user_high_id=high,
+        defaults={"name": f"private_{low}_{high}", "creator": user},
+    )
+    if created:
+        room.members.set([user, other])
+    return room, created
+
+
+async def aget_private_room(user, other):
+    low, high = private_pair(user, other)
+    room, created = await ChatRoom.objects.aget_or_create(
+        room_type="private",
+        user_low_id=low,
+        user_high_id=high,
+        defaults={"name": f"private_{low}_{high}", "creator": user},
+    )
+    if created:
+        await room.members.aset([user, other])
+    return room, created
+
+
+def room_group_name(room):
+    """Channel-layer group for a room; private and group rooms never share a name."""
+    if room.room_type == "private":
+        return f"private_chat_{room.id}"
+    return f"group_chat_{room.id}"
+
+
+def is_room_member(user, room):
+    """Membership as the group socket checks it on connect."""
+    return room.members.filter(id=user.id).exists()
+
+
+async def ais_room_member(user, room):
+    return await room.members.filter(id=user.id).aexists()
+
+
+def can_view_room(user, room):
+    """
+    Private rooms are visible to their two participants, group rooms to their
+    current members only.
+    """
+    if room.room_type == "private" and room.user_low_id is not None:
+        return user.id in (room.user_low_id, room.user_high_id)
+    return is_room_member(user, room)  # group rooms, and private rooms from before the pair columns
+
+
+async def acan_view_room(user, room):
+    if room.room_type == "private" and room.user_low_id is not None:
+        return user.id in (room.user_low_id, room.user_high_id)
+    return await ais_room_member(user, room)
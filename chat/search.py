@@ -0,0 +1,249 @@
+# chat/search.py
+"""
+Full-text search over message content.
+
+The backend follows the database (``CHAT_SEARCH_BACKEND = "auto"``):
+
+* MySQL    – a FULLTEXT index on ``chat_message.content`` (migration 0005),
+             queried in boolean mode so every term must match.
+* SQLite   – an external-content FTS5 table kept current by triggers, ranked
+             with bm25().
+* anything else, or ``"inverted"`` – ``SearchPosting`` rows written as
+             messages are saved, ranked by summed term frequency.
+
+All three index incrementally as messages are written, including batched
+``bulk_create`` writes, and never return deleted messages. Snippets are built
+here so they look the same whatever the backend.
+"""
+import re
+import sqlite3
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Sum
+from django.utils.html import escape
+
+from .models import ChatRoom, Message, SearchPosting
+
+TOKEN_RE = re.compile(r"\w+")
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 8
+SNIPPET_WIDTH = 120
+
+FTS_TABLE = "chat_message_fts"
+
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall(text.lower()) if len(t) <= MAX_TERM_LENGTH]
+
+
+def query_terms(query):
+    # Unique terms in query order
+    return list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+
+
+def make_snippet(content, terms, width=SNIPPET_WIDTH):
+    """An HTML-escaped excerpt around the first match, with matches in ``<mark>``."""
+    pattern = re.compile(r"\b(?:" + "|".join(map(re.escape, terms)) + r")\b", re.IGNORECASE)
+    first = pattern.search(content)
+    start = max((first.start() if first else 0) - width // 3, 0)
+    end = min(start + width, len(content))
+    window = content[start:end]
+
+    parts, pos = [], 0
+    for match in pattern.finditer(window):
+        parts.append(escape(window[pos:match.start()]))
+        parts.append(f"<mark>{escape(match.group())}</mark>")
+        pos = match.end()
+    parts.append(escape(window[pos:]))
+    return ("…" if start else "") + "".join(parts) + ("…" if end < len(content) else "")
+
+
+# -------------------------
+# Backends
+# -------------------------
+# Each backend's ``search(terms, room_id, user, offset, limit)`` returns
+# ``[(message_id, score)]`` best first, restricted to ``room_id`` when given
+# and otherwise to the rooms ``user`` is a member of.
+
+class RawSQLBackend:
+    indexes_on_save = False
+
+    def scope_sql(self, room_id, user):
+        if room_id is not None:
+            return "m.room_id = %s", [room_id]
+        members = ChatRoom.members.through._meta.db_table
+        return f"m.room_id IN (SELECT chatroom_id FROM {members} WHERE customuser_id = %s)", [user.id]
+
+    def run(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [(row[0], float(row[1])) for row in cursor.fetchall()]
+
+
+class MySQLFullTextBackend(RawSQLBackend):
+    name = "mysql"
+
+    def search(self, terms, room_id, user, offset, limit):
+        # InnoDB does not index tokens shorter than innodb_ft_min_token_size (3)
+        terms = [t for t in terms if len(t) >= 3]
+        if not terms:
+            return []
+        against = " ".join(f"+{t}" for t in terms)
+        scope, scope_params = self.scope_sql(room_id, user)
+        sql = (
+            f"SELECT m.id, MATCH(m.content) AGAINST (%s IN BOOLEAN MODE) AS score "
+            f"FROM {Message._meta.db_table} m "
+            f"WHERE MATCH(m.content) AGAINST (%s IN BOOLEAN MODE) AND m.is_deleted = 0 AND {scope} "
+            f"ORDER BY score DESC, m.id DESC LIMIT %s OFFSET %s"
+        )
+        return self.run(sql, [against, against, *scope_params, limit, offset])
+
+
+class SQLiteFTS5Backend(RawSQLBackend):
+    name = "fts5"
+
+    def search(self, terms, room_id, user, offset, limit):
+        match = " ".join(f'"{t}"' for t in terms)
+        scope, scope_params = self.scope_sql(room_id, user)
+        # bm25() is lower for better matches; negate so higher is better everywhere
+        sql = (
+            f"SELECT m.id, -bm25({FTS_TABLE}) AS score "
+            f"FROM {FTS_TABLE} JOIN {Message._meta.db_table} m ON m.id = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH %s AND m.is_deleted = 0 AND {scope} "
+            f"ORDER BY score DESC, m.id DESC LIMIT %s OFFSET %s"
+        )
+        return self.run(sql, [match, *scope_params, limit, offset])
+
+
+class InvertedIndexBackend:
+    name = "inverted"
+    indexes_on_save = True
+
+    def search(self, terms, room_id, user, offset, limit):
+        postings = SearchPosting.objects.filter(term__in=terms, message__is_deleted=False)
+        if room_id is not None:
+            postings = postings.filter(room_id=room_id)
+        else:
+            postings = postings.filter(
+                room_id__in=ChatRoom.members.through.objects.filter(customuser_id=user.id).values("chatroom_id")
+            )
+        rows = (
+            postings.values("message_id")
+            .annotate(matched=Count("term"), score=Sum("frequency"))
+            .filter(matched=len(terms))
+            .order_by("-score", "-message_id")[offset:offset + limit]
+        )
+        return [(row["message_id"], float(row["score"])) for row in rows]
+
+
+def postings_for(messages):
+    postings = []
+    for message in messages:
+        if message.is_deleted:
+            continue
+        for term, frequency in Counter(tokenize(message.content)).items():
+            postings.append(SearchPosting(
+                term=term, message_id=message.id, room_id=message.room_id, frequency=min(frequency, 32767),
+            ))
+    return postings
+
+
+def index_messages(messages):
+    """Add ``messages`` to the inverted index; a no-op for database-native backends."""
+    if get_search_backend().indexes_on_save:
+        SearchPosting.objects.bulk_create(postings_for(messages), batch_size=1000, ignore_conflicts=True)
+
+
+def rebuild_index(chunk_size=5000):
+    """Re-create the inverted index from scratch. Returns the number of messages indexed."""
+    SearchPosting.objects.all().delete()
+    indexed, last_id = 0, 0
+    while True:
+        chunk = list(
+            Message.objects.filter(id__gt=last_id).order_by("id").only("id", "room_id", "content", "is_deleted")[:chunk_size]
+        )
+        if not chunk:
+            return indexed
+        SearchPosting.objects.bulk_create(postings_for(chunk), batch_size=1000)
+        indexed += len(chunk)
+        last_id = chunk[-1].id
+
+
+def fts5_supported():
+    """
+    Whether this SQLite build has FTS5, which is when migration 0005 creates
+    the FTS table. Asks a private in-memory database, not the configured one.
+    """
+    probe = sqlite3.connect(":memory:")
+    try:
+        probe.execute("CREATE VIRTUAL TABLE probe USING fts5(content)")
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        probe.close()
+
+
+_backend = None
+
+
+def select_search_backend():
+    """
+    Pick the backend from ``CHAT_SEARCH_BACKEND`` and the database vendor.
+    Called from ``ChatConfig.ready()``; it runs no queries, so nothing is left
+    to decide when the first message is saved.
+    """
+    global _backend
+    choice = settings.CHAT_SEARCH_BACKEND
+    if choice == "auto":
+        if connection.vendor == "mysql":
+            choice = "mysql"
+        elif connection.vendor == "sqlite" and fts5_supported():
+            choice = "fts5"
+        else:
+            choice = "inverted"
+    _backend = {
+        "mysql": MySQLFullTextBackend,
+        "fts5": SQLiteFTS5Backend,
+        "inverted": InvertedIndexBackend,
+    }[choice]()
+    return _backend
+
+
+def get_search_backend():
+    return _backend or select_search_backend()
+
+
+def search_messages(query, user, room_id=None, page=1, page_size=None):
+    """
+    One page of matches for ``query``, best first. Returns
+    ``(results, has_more)`` where each result is a dict ready for JSON.
+    """
+    page_size = page_size or settings.CHAT_SEARCH_PAGE_SIZE
+    terms = query_terms(query)
+    if not terms:
+        return [], False
+
+    offset = (page - 1) * page_size
+    hits = get_search_backend().search(terms, room_id, user, offset, page_size + 1)
+    has_more = len(hits) > page_size
+    hits = hits[:page_size]
+
+    messages = Message.objects.select_related("sender", "room").in_bulk([message_id for message_id, _ in hits])
+    results = []
+    for message_id, score in hits:
+        msg = messages.get(message_id)
+        if msg is None:
+            continue
+        results.append({
+            "message_id": msg.id,
+            "room_id": msg.room_id,
+            "room_name": msg.room.name,
+            "sender": msg.sender.username,
+            "timestamp": msg.timestamp.isoformat(),
+            "snippet": make_snippet(msg.content, terms),
+            "score": round(score, 4),
+        })
+    return results, has_more
@@ -0,0 +1,132 @@
+# chat/serving.py
+"""
+HTTP delivery of stored media: conditional requests, byte ranges and
+hand-off to the front-end server.
+
+With ``CHAT_MEDIA_SENDFILE`` set, the response only carries an
+``X-Accel-Redirect`` (nginx) or ``X-Sendfile`` (Apache, lighttpd) header and
+the web server sends the file with sendfile(2), ranges included. Otherwise a
+``FileResponse`` streams it; under WSGI a full response goes out through the
+server's ``wsgi.file_wrapper`` (sendfile where available) and a range is
+streamed in blocks from the requested offset.
+"""
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_etags
+
+from .storage import BLOB_PREFIX
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangeFile:
+    """
+    Reads at most ``length`` bytes of ``file`` from its current position.
+    Deliberately has no ``fileno()``, so WSGI file wrappers cannot sendfile
+    past the end of the range.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b""
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """
+    ``(start, end)`` inclusive for a single-range ``Range`` header, ``None`` if
+    it cannot be satisfied. Multi-range requests are served as the first range.
+    """
+    match = RANGE_RE.match(header.split(",")[0].strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    elif last:
+        # Suffix range: the final N bytes
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        return None
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+def file_etag(name, stat):
+    if name.startswith(f"{BLOB_PREFIX}/"):
+        # Content-addressed: the name is the SHA-256 of the bytes
+        return '"%s"' % os.path.splitext(os.path.basename(name))[0]
+    return '"%x-%x"' % (stat.st_size, int(stat.st_mtime))
+
+
+def serve_file(request, field):
+    """Response for the stored file behind ``field`` (a ``FieldFile``)."""
+    try:
+        path = field.path
+        stat = os.stat(path)
+    except (OSError, ValueError):
+        raise Http404("Media not found")
+
+    etag = file_etag(field.name, stat)
+    immutable = field.name.startswith(f"{BLOB_PREFIX}/")
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(stat.st_mtime),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=31536000, immutable" if immutable else "private, no-cache",
+    }
+
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in parse_etags(if_none_match)):
+        response = HttpResponseNotModified()
+        for header, value in headers.items():
+            response.headers[header] = value
+        return response
+
+    content_type = mimetypes.guess_type(field.name)[0] or "application/octet-stream"
+
+    if settings.CHAT_MEDIA_SENDFILE:
+        # The front-end server streams the file and answers Range itself
+        response = HttpResponse(content_type=content_type, headers=headers)
+        if settings.CHAT_MEDIA_SENDFILE == "nginx":
+            response.headers["X-Accel-Redirect"] = settings.CHAT_MEDIA_ACCEL_PREFIX + field.name
+        else:
+            response.headers["X-Sendfile"] = path
+        return response
+
+    size = stat.st_size
+    byte_range = None
+    range_header = request.headers.get("Range")
+    if_range = request.headers.get("If-Range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        byte_range = parse_range(range_header, size)
+        if byte_range is None:
+            return HttpResponse(status=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    file = open(path, "rb")
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type, headers=headers)
+    else:
+        start, end = byte_range
+        file.seek(start)
+        response = FileResponse(RangeFile(file, end - start + 1), status=206, content_type=content_type, headers=headers)
+        response.headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response.headers["Content-Length"] = str(end - start + 1)
+    return response
@@ -0,0 +1,106 @@
+# chat/signals.py
+from functools import partial
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .directory import directory
+from .models import ArchivedAttachment, ChatRoom, CustomUser, Message
+from .rooms import room_group_name
+from .search import index_messages
+
+
+def _broadcast(room, event):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    group = room_group_name(room)
+    # Only once the change is committed, and a layer outage must not undo it
+    transaction.on_commit(lambda: async_to_sync(channel_layer.group_send)(group, event), robust=True)
+
+
+def _broadcast_removed(room, user_ids):
+    for user_id in user_ids:
+        _broadcast(room, {"type": "room_member_removed", "room_id": room.id, "user_id": user_id})
+
+
+# -------------------------
+# Consumer cache invalidation
+# -------------------------
+# Consumers resolve their room, peer and membership once in connect(); these
+# events tell connected sockets when that cached state is no longer valid.
+
+@receiver(post_delete, sender=ChatRoom)
+def room_deleted(sender, instance, **kwargs):
+    _broadcast(instance, {"type": "room_deleted", "room_id": instance.id})
+
+
+@receiver(m2m_changed, sender=ChatRoom.members.through)
+def room_members_changed(sender, instance, action, pk_set, reverse, **kwargs):
+    # Forward (room.members...): instance is the room, pk_set holds user ids.
+    # Reverse (user.rooms...): instance is the user, pk_set holds room ids.
+    if action == "pre_clear":
+        # post_clear does not say who was removed, so remember it here
+        if reverse:
+            instance._cleared_rooms = list(ChatRoom.objects.filter(members=instance))
+        else:
+            instance._cleared_members = list(instance.members.values_list("id", flat=True))
+        return
+    if action == "post_clear":
+        if reverse:
+            for room in instance.__dict__.pop("_cleared_rooms", ()):
+                _broadcast_removed(room, [instance.id])
+        else:
+            _broadcast_removed(instance, instance.__dict__.pop("_cleared_members", ()))
+        return
+    if action != "post_remove":
+        return
+    if reverse:
+        for room in ChatRoom.objects.filter(id__in=pk_set):
+            _broadcast_removed(room, [instance.id])
+    else:
+        _broadcast_removed(instance, pk_set)
+
+
+# -------------------------
+# User directory
+# -------------------------
+
+@receiver(post_save, sender=CustomUser)
+def user_saved(sender, instance, created, **kwargs):
+    directory.update(instance)
+
+
+@receiver(post_delete, sender=CustomUser)
+def user_deleted(sender, instance, **kwargs):
+    directory.remove(instance.id)
+
+
+# -------------------------
+# Message search
+# -------------------------
+# Batched writes bypass signals and are indexed by MessageBuffer.write().
+
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, created, **kwargs):
+    if created:
+        index_messages([instance])
+
+
+# -------------------------
+# Media references
+# -------------------------
+# delete_message() releases its files through the job queue; this covers rows
+# removed with their room or sender, and archived attachments removed with
+# their room.
+
+@receiver(post_delete, sender=Message)
+@receiver(post_delete, sender=ArchivedAttachment)
+def message_deleted(sender, instance, **kwargs):
+    for field in (instance.media, instance.media_thumbnail, instance.media_compressed):
+        if field:
+            # Dropped once the delete is durable; a rollback keeps the reference
+            transaction.on_commit(partial(field.storage.delete, field.name), robust=True)
@@ -0,0 +1,229 @@
+# chat/storage.py
+"""
+Content-addressed storage for chat media.
+
+Files are stored once under ``blobs/<aa>/<sha256><ext>``, where the SHA-256
+is computed while the upload is streamed to disk, so forwarding or re-sharing
+a file costs no extra space and names can never collide. Every ``save()``
+takes a reference on a ``MediaBlob`` row and every ``delete()`` drops one;
+the file itself is only removed by ``collect_garbage()`` once its count has
+been zero for ``CHAT_MEDIA_GC_GRACE`` seconds. Taking a reference and
+collecting a blob both lock its row, so a re-upload of a file that is
+being collected either waits and writes it again, or keeps it alive.
+
+Files saved before this storage existed have no ``MediaBlob`` row and are
+deleted immediately, as before.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from datetime import timedelta
+
+from channels.db import database_sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+logger = logging.getLogger(__name__)
+
+BLOB_PREFIX = "blobs"
+
+
+def _blob_model():
+    # Looked up lazily: chat.models refers to this module for its storage
+    return apps.get_model("chat", "MediaBlob")
+
+
+class BlobWriter:
+    """
+    Streams bytes into the storage directory while hashing them; ``commit()``
+    files them under their hash without copying. Used by ``_save()`` and by
+    the HTTP upload handler, which writes request bodies straight here.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.size = 0
+        self.digest = hashlib.sha256()
+        os.makedirs(storage.location, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=storage.location, prefix=".upload-")
+        self.file = os.fdopen(fd, "wb")
+
+    def write(self, chunk):
+        self.digest.update(chunk)
+        self.file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self, ext):
+        """Store the bytes as ``blobs/<aa>/<sha256><ext>`` and take a reference; returns the name."""
+        self.file.close()
+        sha = self.digest.hexdigest()
+        name = f"{BLOB_PREFIX}/{sha[:2]}/{sha}{ext.lower()}"
+        full_path = self.storage.path(name)
+
+        def place():
+            if not os.path.exists(self.tmp_path):
+                return  # placed by an earlier attempt
+            if os.path.exists(full_path):
+                os.unlink(self.tmp_path)  # already stored
+            else:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                if self.storage.file_permissions_mode is not None:
+                    os.chmod(self.tmp_path, self.storage.file_permissions_mode)
+                os.replace(self.tmp_path, full_path)
+
+        self.storage.add_reference(name, self.size, place=place)
+        return name
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.unlink(self.tmp_path)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+
+    def open_writer(self):
+        return BlobWriter(self)
+
+    def _save(self, name, content):
+        writer = self.open_writer()
+        try:
+            for chunk in content.chunks():
+                writer.write(chunk)
+            return writer.commit(os.path.splitext(name)[1])
+        except BaseException:
+            writer.abort()
+            raise
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is chosen from the content in _save()
+        return name
+
+    def add_reference(self, name, size, place=None):
+        """
+        Take a reference on blob ``name``, creating its row if needed. The row
+        is locked first and ``place()``, which puts the file on disk, runs
+        under that lock, so ``collect_garbage()`` cannot remove the file
+        between the existence check and the new reference.
+        """
+        MediaBlob = _blob_model()
+        for attempt in range(2):
+            try:
+                with transaction.atomic():
+                    blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+                    if place is not None:
+                        place()
+                    if blob is not None:
+                        MediaBlob.objects.filter(pk=blob.pk).update(ref_count=F("ref_count") + 1, released_at=None)
+                    else:
+                        MediaBlob.objects.create(name=name, size=size, ref_count=1)
+                return
+            except IntegrityError:
+                # Created concurrently by another upload of the same content;
+                # its row is there to lock on the second attempt
+                if attempt:
+                    raise
+
+    def delete(self, name):
+        MediaBlob = _blob_model()
+        if not MediaBlob.objects.filter(name=name).update(ref_count=F("ref_count") - 1):
+            super().delete(name)  # stored before deduplication
+            return
+        MediaBlob.objects.filter(name=name, ref_count__lte=0, released_at=None).update(released_at=timezone.now())
+
+
+_storage = None
+
+
+def get_media_storage():
+    global _storage
+    if _storage is None:
+        _storage = ContentAddressedStorage()
+    return _storage
+
+
+def collect_garbage(grace=None):
+    """Delete blobs nobody has referenced for ``grace`` seconds. Returns ``(files, bytes)`` freed."""
+    MediaBlob = _blob_model()
+    grace = settings.CHAT_MEDIA_GC_GRACE if grace is None else grace
+    cutoff = timezone.now() - timedelta(seconds=grace)
+    storage = get_media_storage()
+
+    files = freed = 0
+    expired = list(MediaBlob.objects.filter(ref_count__lte=0, released_at__lte=cutoff).values_list("pk", flat=True))
+    for pk in expired:
+        try:
+            with transaction.atomic():
+                # Re-checked under the row lock: add_reference() may have taken a
+                # reference meanwhile, and one that starts now waits for this
+                blob = MediaBlob.objects.select_for_update().filter(pk=pk, ref_count__lte=0).first()
+                if blob is None:
+                    continue
+                MediaBlob.objects.filter(pk=pk).delete()
+                FileSystemStorage.delete(storage, blob.name)
+        except OSError:
+            # The row is restored with the rollback; the next run retries
+            logger.exception("Could not remove media blob %s", blob.name)
+            continue
+        files += 1
+        freed += blob.size
+    return files, freed
+
+
+def recount_references():
+    """
+    Reset every blob's count from the messages (live or archived) that point
+    at it, repairing drift from uploads whose message was never saved.
+    Returns the blobs changed.
+    """
+    MediaBlob = _blob_model()
+    counts = {}
+    # Archived messages hold their references on ArchivedAttachment rows
+    for model in (apps.get_model("chat", "Message"), apps.get_model("chat", "ArchivedAttachment")):
+        for field in ("media", "media_thumbnail", "media_compressed"):
+            rows = (
+                model.objects.filter(**{f"{field}__startswith": f"{BLOB_PREFIX}/"})
+                .values_list(field).annotate(refs=Count("id"))
+            )
+            for name, refs in rows:
+                counts[name] = counts.get(name, 0) + refs
+
+    changed = 0
+    now = timezone.now()
+    for blob in MediaBlob.objects.iterator():
+        refs = counts.get(blob.name, 0)
+        if refs != blob.ref_count:
+            MediaBlob.objects.filter(pk=blob.pk).update(
+                ref_count=refs, released_at=(blob.released_at or now) if refs == 0 else None,
+            )
+            changed += 1
+    return changed
+
+
+def dedup_stats():
+    """``(logical_bytes, stored_bytes)`` over all live blobs."""
+    MediaBlob = _blob_model()
+    live = MediaBlob.objects.filter(ref_count__gt=0)
+    totals = live.aggregate(stored=Sum("size"), logical=Sum(F("size") * F("ref_count")))
+    return totals["logical"] or 0, totals["stored"] or 0
+
+
+async def collect_garbage_periodically():
+    """Background loop started from the ASGI lifespan (see chat/lifespan.py)."""
+    while True:
+        await asyncio.sleep(settings.CHAT_MEDIA_GC_INTERVAL)
+        try:
+            files, freed = await database_sync_to_async(collect_garbage)()
+        except Exception:
+            logger.exception("Media garbage collection failed")
+            continue
+        if files:
+            logger.info("Media GC removed %d unreferenced blobs (%d bytes)", files, freed)
@@ -0,0 +1,70 @@
+# chat/tests/test_archive.py
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from chat.archive import archive_messages, archive_room, read_archive
+from chat.models import ArchivedSegment, Message
+from chat.views import get_history_page
+
+from .utils import make_group, make_user
+
+
+@override_settings(CHAT_ARCHIVE_SEGMENT_SIZE=40)
+class ArchiveTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = make_user("alice")
+        cls.bob = make_user("bob")
+        cls.room = make_group(cls.alice, cls.bob)
+        cls.room.archive_after_days = 90
+        cls.room.save(update_fields=["archive_after_days"])
+        start = timezone.now() - timedelta(days=365)
+        Message.objects.bulk_create([
+            Message(
+                room=cls.room, sender=(cls.alice, cls.bob)[i % 2], content=f"message {i}",
+                timestamp=start + timedelta(days=i * 365 / 300), is_deleted=i % 100 == 0,
+            )
+            for i in range(300)
+        ])
+
+    def walk_history(self):
+        ids, before, has_more = [], None, True
+        while has_more:
+            self.room.refresh_from_db(fields=["archived_up_to"])
+            page, has_more = async_to_sync(get_history_page)(self.room, before=before, limit=25)
+            ids[:0] = [msg.id for msg in page]
+            before = page[0].id if page else None
+        return ids
+
+    def test_history_is_unchanged_by_archival(self):
+        before = self.walk_history()
+        moved = archive_room(self.room)
+        self.assertGreater(moved, 0)
+        self.assertEqual(Message.objects.filter(room=self.room).count(), 300 - moved)
+        self.assertEqual(self.walk_history(), before)
+
+    def test_only_messages_past_the_horizon_move(self):
+        archive_room(self.room)
+        horizon = timezone.now() - timedelta(days=90)
+        self.assertFalse(Message.objects.filter(room=self.room, timestamp__lt=horizon).exists())
+        oldest_hot = Message.objects.filter(room=self.room).order_by("id").first()
+        self.assertGreaterEqual(oldest_hot.timestamp, horizon)
+        self.assertTrue(all(s.message_count <= 40 for s in ArchivedSegment.objects.filter(room=self.room)))
+
+    def test_archived_messages_keep_their_content(self):
+        archive_room(self.room)
+        page = read_archive(self.room.id, count=5)
+        self.assertEqual(len(page), 5)
+        self.assertTrue(all(msg.content.startswith("message ") and msg.sender_id for msg in page))
+        self.assertEqual([msg.id for msg in page], sorted((msg.id for msg in page), reverse=True))
+
+    def test_archival_is_opt_in(self):
+        self.room.archive_after_days = None
+        self.room.save(update_fields=["archive_after_days"])
+        purged, archived, finished = archive_messages()
+        self.assertEqual((archived, finished), (0, True))
+        self.assertEqual(Message.objects.filter(room=self.room).count(), 300 - purged)
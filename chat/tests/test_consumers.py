@@ -0,0 +1,121 @@
+# chat/tests/test_consumers.py
+import asyncio
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.test import TestCase, override_settings
+
+from chat.consumers import GroupChatConsumer, PrivateChatConsumer
+from chat.search import get_search_backend
+
+from .utils import IN_MEMORY_SERVICES, connect, make_group, make_user
+
+
+@override_settings(CHAT_PERSISTENCE_MODE="sync", **IN_MEMORY_SERVICES)
+class SendPathQueryTests(TestCase):
+    """Once connected, a text message costs its INSERT and nothing else."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = make_user("alice")
+        cls.bob = make_user("bob")
+        cls.room = make_group(cls.alice, cls.bob)
+
+    def expected_queries(self):
+        # The inverted search index adds its postings INSERT; native full-text indexes add nothing
+        return 2 if get_search_backend().indexes_on_save else 1
+
+    def test_group_message_is_one_insert(self):
+        consumer = GroupChatConsumer()
+        consumer.user = self.alice
+        consumer.room, consumer.is_member = async_to_sync(consumer.get_room)(self.room.id, self.alice)
+        expected = self.expected_queries()
+        for i in range(5):
+            with self.assertNumQueries(expected):
+                async_to_sync(consumer.save_message)(f"hello {i}")
+
+    def test_private_message_is_one_insert(self):
+        consumer = PrivateChatConsumer()
+        consumer.user = self.alice
+        consumer.peer = self.bob
+        consumer.room = async_to_sync(consumer.get_room)(self.alice, self.bob)
+        expected = self.expected_queries()
+        for i in range(5):
+            with self.assertNumQueries(expected):
+                async_to_sync(consumer.save_message)(f"hello {i}")
+
+
+@override_settings(**IN_MEMORY_SERVICES)
+class GroupMembershipTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = make_user("alice")
+        cls.bob = make_user("bob")
+        cls.mallory = make_user("mallory")
+        cls.room = make_group(cls.alice, cls.bob)
+
+    async def test_member_can_connect(self):
+        communicator = connect(self.bob, f"/ws/chat/group/{self.room.id}/")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.disconnect()
+
+    async def test_non_member_is_rejected(self):
+        communicator = connect(self.mallory, f"/ws/chat/group/{self.room.id}/")
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+
+
+@override_settings(**IN_MEMORY_SERVICES)
+class MemberRemovedBroadcastTests(TestCase):
+    """Every way of removing a member tells the room's sockets, after commit."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = make_user("alice")
+        cls.bob = make_user("bob")
+        cls.carol = make_user("carol")
+        cls.room = make_group(cls.alice, cls.bob, cls.carol)
+
+    def setUp(self):
+        layer = get_channel_layer()
+        self.channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(f"group_chat_{self.room.id}", self.channel)
+
+    def removed_user_ids(self):
+        layer = get_channel_layer()
+        user_ids = set()
+        while True:
+            try:
+                event = layer.channels[self.channel].get_nowait()[1]
+            except (KeyError, asyncio.QueueEmpty):
+                return user_ids
+            if event["type"] == "room_member_removed":
+                user_ids.add(event["user_id"])
+
+    def test_remove(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.room.members.remove(self.bob)
+        self.assertEqual(self.removed_user_ids(), {self.bob.id})
+
+    def test_reverse_remove(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bob.rooms.remove(self.room)
+        self.assertEqual(self.removed_user_ids(), {self.bob.id})
+
+    def test_clear(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.room.members.clear()
+        self.assertEqual(self.removed_user_ids(), {self.alice.id, self.bob.id, self.carol.id})
+
+    def test_reverse_clear(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.carol.rooms.clear()
+        self.assertEqual(self.removed_user_ids(), {self.carol.id})
+
+    def test_nothing_is_sent_before_commit(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.room.members.remove(self.bob)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(self.removed_user_ids(), set())
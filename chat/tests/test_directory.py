@@ -0,0 +1,75 @@
+# chat/tests/test_directory.py
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from chat.directory import UserDirectory
+
+from .utils import make_user
+
+
+@override_settings(CHAT_DIRECTORY_REFRESH_INTERVAL=0)
+class UserDirectoryTests(TestCase):
+    """
+    Each test uses its own directory, which receives no model signals: it
+    stands in for another worker process that only sees the database.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = make_user("alice")
+        cls.alan = make_user("alan")
+        cls.bob = make_user("bob")
+
+    def setUp(self):
+        self.directory = UserDirectory()
+
+    def usernames(self, prefix=""):
+        users, _ = self.directory.search(prefix)
+        return [user["username"] for user in users]
+
+    def test_prefix_search_returns_ids_and_usernames_only(self):
+        users, next_cursor = self.directory.search("AL")
+        self.assertEqual(users, [{"id": self.alan.id, "username": "alan"}, {"id": self.alice.id, "username": "alice"}])
+        self.assertIsNone(next_cursor)
+
+    def test_emails_are_not_searchable(self):
+        self.assertEqual(self.usernames("alice@"), [])
+        self.assertEqual(self.usernames("example.com"), [])
+
+    def test_cursor_pages_through_a_prefix(self):
+        first, cursor = self.directory.search("a", limit=1)
+        second, cursor_after = self.directory.search("a", cursor=cursor, limit=1)
+        self.assertEqual([first[0]["username"], second[0]["username"]], ["alan", "alice"])
+        self.assertIsNone(cursor_after)
+
+    def test_picks_up_users_created_elsewhere(self):
+        self.usernames()
+        make_user("carol")
+        self.assertEqual(self.usernames("c"), ["carol"])
+
+    def test_picks_up_renames_made_elsewhere(self):
+        self.usernames()
+        self.bob.username = "robert"
+        self.bob.save()
+        self.assertEqual(self.usernames("b"), [])
+        self.assertEqual(self.usernames("r"), ["robert"])
+
+    def test_picks_up_deletes_made_elsewhere(self):
+        self.assertEqual(self.usernames(), ["alan", "alice", "bob"])
+        self.alan.delete()
+        self.assertEqual(self.usernames(), ["alice", "bob"])
+
+
+# The shared directory outlives each test's rolled-back rows; refresh it on every search
+@override_settings(CHAT_DIRECTORY_REFRESH_INTERVAL=0)
+class UserSearchViewTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = make_user("alice")
+        cls.bob = make_user("bob")
+
+    def test_response_carries_no_emails(self):
+        self.client.force_login(self.alice)
+        response = self.client.get(reverse("user_search"), {"q": "b"})
+        self.assertEqual(response.json()["users"], [{"id": self.bob.id, "username": "bob"}])
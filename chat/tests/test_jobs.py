@@ -0,0 +1,120 @@
+# chat/tests/test_jobs.py
+import re
+from datetime import timedelta
+from smtplib import SMTPException
+from unittest import mock
+
+from django.core import mail
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from chat.jobs import enqueue_email, run_pending
+from chat.models import Job
+
+from .utils import make_user
+
+
+def make_due(**filters):
+    Job.objects.filter(**filters).update(run_at=timezone.now())
+
+
+class EmailJobTests(TestCase):
+    """The worker is ``run_pending()`` in this process; mail goes to the locmem outbox."""
+
+    def test_queued_email_is_sent_once_by_the_worker(self):
+        for _ in range(2):
+            enqueue_email("Hello", "Body", ["alice@example.com"], key="hello:alice")
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(run_pending(), (1, 0))
+        self.assertEqual([(m.subject, m.to) for m in mail.outbox], [("Hello", ["alice@example.com"])])
+        self.assertEqual(Job.objects.get().status, Job.DONE)
+
+    def test_transient_failure_is_retried(self):
+        job = enqueue_email("Hello", "Body", ["alice@example.com"])
+        with mock.patch("chat.jobs.send_mail", side_effect=SMTPException("try later")), self.assertLogs("chat.jobs"):
+            self.assertEqual(run_pending(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+        self.assertEqual(run_pending(), (0, 0))  # backing off
+        make_due(id=job.id)
+        self.assertEqual(run_pending(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_expired_email_is_not_sent(self):
+        job = enqueue_email("Code", "1234", ["alice@example.com"], expires_in=30)
+        Job.objects.filter(id=job.id).update(expires_at=timezone.now() - timedelta(seconds=1))
+        with self.assertLogs("chat.jobs"):
+            self.assertEqual(run_pending(), (0, 1))
+        self.assertEqual(mail.outbox, [])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn("JobExpired", job.last_error)
+
+    @override_settings(CHAT_JOB_BACKOFF_BASE=60)
+    def test_no_retry_past_expiry(self):
+        job = enqueue_email("Code", "1234", ["alice@example.com"], expires_in=30)
+        with mock.patch("chat.jobs.send_mail", side_effect=SMTPException("try later")), self.assertLogs("chat.jobs"):
+            self.assertEqual(run_pending(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 1))
+
+    def test_retries_stay_inside_the_expiry(self):
+        job = enqueue_email("Code", "1234", ["alice@example.com"], expires_in=30)
+        with mock.patch("chat.jobs.send_mail", side_effect=SMTPException("try later")), self.assertLogs("chat.jobs"):
+            for _ in range(job.max_attempts):
+                run_pending()
+                job.refresh_from_db()
+                if job.status == Job.FAILED:
+                    break
+                self.assertLess(job.run_at, job.expires_at)
+                make_due(id=job.id)
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(mail.outbox, [])
+
+
+class OTPEmailTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = make_user("alice")
+
+    def test_password_reset_otp_reaches_the_user(self):
+        response = self.client.post(reverse("forgot_password"), {"email": self.alice.email})
+        self.assertRedirects(response, reverse("verify_reset_otp"), fetch_redirect_response=False)
+        self.assertEqual(mail.outbox, [])  # queued, not sent inline
+
+        self.assertEqual(run_pending(), (1, 0))
+        self.assertEqual(mail.outbox[0].to, [self.alice.email])
+        otp = re.search(r"\b(\d{6})\b", mail.outbox[0].body).group(1)
+        self.assertEqual(otp, self.client.session["reset_otp"])
+        job = Job.objects.get()
+        self.assertLessEqual(job.expires_at - job.created_at, timedelta(seconds=30))
+
+
+class LeaseExpiryTests(TestCase):
+
+    def abandon(self, job):
+        """What a worker that dies mid-job leaves behind."""
+        Job.objects.filter(id=job.id).update(
+            status=Job.RUNNING, attempts=F("attempts") + 1, locked_until=timezone.now() - timedelta(seconds=1),
+        )
+
+    def test_abandoned_job_runs_again(self):
+        job = enqueue_email("Hello", "Body", ["alice@example.com"])
+        self.abandon(job)
+        self.assertEqual(run_pending(), (1, 0))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.DONE, 2))
+
+    def test_job_that_keeps_killing_its_worker_fails(self):
+        job = enqueue_email("Hello", "Body", ["alice@example.com"])
+        for _ in range(job.max_attempts):
+            self.abandon(job)
+        with self.assertLogs("chat.jobs", "ERROR"):
+            self.assertEqual(run_pending(), (0, 0))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, job.max_attempts))
+        self.assertIn("LeaseExpired", job.last_error)
+        self.assertEqual(mail.outbox, [])
@@ -0,0 +1,62 @@
+# chat/tests/test_persistence.py
+from unittest import mock
+
+from django.db import OperationalError
+from django.test import TestCase, override_settings
+
+from chat.models import Message
+from chat.persistence import BufferFull, MessageBuffer, MessageIdAllocator
+
+from .utils import IN_MEMORY_SERVICES, connect, make_group, make_user
+
+
+class MessageBufferTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = make_user("alice")
+        cls.room = make_group(cls.alice)
+
+    def setUp(self):
+        self.allocator = MessageIdAllocator(node_id=0)
+        self.buffer = MessageBuffer(batch_size=2, flush_interval=3600, max_size=3)
+
+    def message(self, text):
+        return Message(id=self.allocator.next_id(), room=self.room, sender=self.alice, content=text)
+
+    async def test_database_outage_fills_the_buffer_then_refuses(self):
+        outage = mock.patch.object(MessageBuffer, "write", side_effect=OperationalError("database is down"))
+        with outage, self.assertLogs("chat.persistence"):
+            for i in range(3):
+                await self.buffer.add(self.message(f"kept {i}"))
+            self.assertEqual(len(self.buffer), 3)
+            with self.assertRaises(BufferFull):
+                await self.buffer.add(self.message("refused"))
+        self.buffer._timer.cancel()
+
+        # Back up: everything held is written, nothing that was refused
+        await self.buffer.flush()
+        self.assertEqual(len(self.buffer), 0)
+        contents = [m.content async for m in Message.objects.filter(room=self.room).order_by("id")]
+        self.assertEqual(contents, ["kept 0", "kept 1", "kept 2"])
+
+
+@override_settings(CHAT_PERSISTENCE_MODE="batched", CHAT_NODE_ID=0, **IN_MEMORY_SERVICES)
+class BufferFullFrameTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = make_user("alice")
+        cls.room = make_group(cls.alice)
+
+    async def test_sender_gets_an_error_frame_and_nothing_is_broadcast(self):
+        communicator = connect(self.alice, f"/ws/chat/group/{self.room.id}/")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_json_from()  # presence_state
+        with mock.patch.object(MessageBuffer, "add", side_effect=BufferFull(10000)):
+            await communicator.send_json_to({"message": "hello"})
+            frame = await communicator.receive_json_from()
+        self.assertEqual((frame["action"], frame["code"]), ("error", "not_stored"))
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
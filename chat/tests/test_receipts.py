@@ -0,0 +1,80 @@
+# chat/tests/test_receipts.py
+from unittest import mock
+
+from django.db import OperationalError
+from django.test import TestCase
+
+from chat.models import Message, ReadCursor
+from chat.receipts import ReadCursorBuffer
+
+from .utils import make_group, make_user
+
+
+class ReadCursorWriteTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = make_user("alice")
+        cls.bob = make_user("bob")
+        cls.room = make_group(cls.alice, cls.bob)
+        cls.other = make_group(cls.alice, name="other")
+        # Cursors are clamped to real message ids; ids[n] is the room's n-th message
+        cls.ids = [Message.objects.create(room=cls.room, sender=cls.bob, content=f"m{i}").id for i in range(13)]
+        cls.other_ids = [Message.objects.create(room=cls.other, sender=cls.alice, content=f"o{i}").id for i in range(5)]
+
+    def setUp(self):
+        self.buffer = ReadCursorBuffer(flush_interval=60)
+
+    def cursor(self, user, room=None):
+        return ReadCursor.objects.get(user=user, room=room or self.room).last_read_id
+
+    def test_new_cursors_are_inserted(self):
+        self.buffer.write({(self.room.id, self.alice.id): self.ids[7], (self.room.id, self.bob.id): self.ids[3]})
+        self.assertEqual((self.cursor(self.alice), self.cursor(self.bob)), (self.ids[7], self.ids[3]))
+
+    def test_cursor_moves_forward(self):
+        self.buffer.write({(self.room.id, self.alice.id): self.ids[7]})
+        self.buffer.write({(self.room.id, self.alice.id): self.ids[12]})
+        self.assertEqual(self.cursor(self.alice), self.ids[12])
+
+    def test_older_flush_never_moves_a_cursor_back(self):
+        # Another process flushed a newer report first
+        self.buffer.write({(self.room.id, self.alice.id): self.ids[12]})
+        self.buffer.write({(self.room.id, self.alice.id): self.ids[7], (self.other.id, self.alice.id): self.other_ids[4]})
+        self.assertEqual(self.cursor(self.alice), self.ids[12])
+        self.assertEqual(self.cursor(self.alice, self.other), self.other_ids[4])
+
+    def test_mixed_batch_is_one_insert_and_one_update(self):
+        self.buffer.write({(self.room.id, self.alice.id): self.ids[5]})
+        # Clamp, INSERT and UPDATE; write()'s atomic block adds a savepoint pair under TestCase
+        with self.assertNumQueries(5):
+            self.buffer.write({(self.room.id, self.alice.id): self.ids[9], (self.room.id, self.bob.id): self.ids[2]})
+        self.assertEqual((self.cursor(self.alice), self.cursor(self.bob)), (self.ids[9], self.ids[2]))
+
+    def test_cursor_past_the_newest_message_is_clamped(self):
+        for up_to in (10**15, 2**64):
+            with self.subTest(up_to=up_to):
+                self.buffer.write({(self.room.id, self.alice.id): up_to, (self.other.id, self.alice.id): self.other_ids[2]})
+                self.assertEqual(self.cursor(self.alice), self.ids[-1])
+                self.assertEqual(self.cursor(self.alice, self.other), self.other_ids[2])
+        later = Message.objects.create(room=self.room, sender=self.bob, content="after the bogus report")
+        self.assertLess(self.cursor(self.alice), later.id)  # still unread
+
+    async def test_failed_flush_keeps_its_cursors(self):
+        self.buffer.mark_read(self.room, self.alice.id, self.ids[4])
+        self.buffer.mark_read(self.other, self.alice.id, self.other_ids[1])
+        self.buffer._timer.cancel()
+        with mock.patch.object(ReadCursorBuffer, "advance", side_effect=OperationalError("database is down")), \
+                self.assertLogs("chat.receipts"):
+            await self.buffer.flush()
+        self.buffer._timer.cancel()
+        self.assertEqual(len(self.buffer), 2)
+        self.buffer.mark_read(self.room, self.alice.id, self.ids[6])  # a newer report meanwhile
+        self.buffer._timer.cancel()
+        with mock.patch.object(ReadCursorBuffer, "broadcast") as broadcast:
+            await self.buffer.flush()
+        self.assertEqual(
+            broadcast.call_args.args[0],
+            {(self.room.id, self.alice.id): self.ids[6], (self.other.id, self.alice.id): self.other_ids[1]},
+        )
+        self.assertEqual(await ReadCursor.objects.filter(user=self.alice).acount(), 2)
@@ -0,0 +1,36 @@
+# chat/tests/test_search.py
+from django.test import TestCase
+
+from chat.models import Message
+from chat.search import get_search_backend, search_messages, select_search_backend
+
+from .utils import make_group, make_user
+
+
+class SearchBackendTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = make_user("alice")
+        cls.bob = make_user("bob")
+        cls.room = make_group(cls.alice, cls.bob)
+        cls.elsewhere = make_group(cls.bob, name="elsewhere")
+
+    def test_selection_runs_no_queries(self):
+        with self.assertNumQueries(0):
+            backend = select_search_backend()
+        self.assertIs(get_search_backend(), backend)
+
+    def test_first_save_after_startup_only_indexes(self):
+        select_search_backend()
+        expected = 2 if get_search_backend().indexes_on_save else 1
+        with self.assertNumQueries(expected):
+            Message.objects.create(room=self.room, sender=self.alice, content="first message")
+
+    def test_finds_messages_in_the_users_rooms_only(self):
+        hit = Message.objects.create(room=self.room, sender=self.alice, content="meet at the harbour")
+        Message.objects.create(room=self.elsewhere, sender=self.bob, content="the harbour is closed")
+        Message.objects.create(room=self.room, sender=self.alice, content="harbour", is_deleted=True)
+        results, has_more = search_messages("harbour", self.alice)
+        self.assertEqual([result["message_id"] for result in results], [hit.id])
+        self.assertFalse(has_more)
@@ -0,0 +1,84 @@
+# chat/tests/test_storage.py
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from chat.models import MediaBlob, Message
+from chat.storage import collect_garbage, get_media_storage
+
+from .utils import make_group, make_user
+
+
+class MediaGarbageCollectionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = make_user("alice")
+        cls.room = make_group(cls.alice)
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.storage = get_media_storage()
+
+    def save(self, data=b"same bytes"):
+        return self.storage.save("clip.mp4", ContentFile(data))
+
+    def release(self, name, ago=timedelta(days=1)):
+        self.storage.delete(name)
+        MediaBlob.objects.filter(name=name).update(released_at=timezone.now() - ago)
+
+    def test_collects_expired_blobs(self):
+        name = self.save()
+        self.release(name)
+        self.assertEqual(collect_garbage(grace=60), (1, len(b"same bytes")))
+        self.assertFalse(MediaBlob.objects.filter(name=name).exists())
+        self.assertFalse(self.storage.exists(name))
+
+    def test_keeps_blobs_within_the_grace_period(self):
+        name = self.save()
+        self.release(name, ago=timedelta(seconds=1))
+        self.assertEqual(collect_garbage(grace=60), (0, 0))
+        self.assertTrue(self.storage.exists(name))
+
+    def test_keeps_a_blob_referenced_again_before_collection(self):
+        name = self.save()
+        self.release(name)
+        self.assertEqual(self.save(), name)
+        self.assertEqual(collect_garbage(grace=60), (0, 0))
+        self.assertEqual(MediaBlob.objects.get(name=name).ref_count, 1)
+        self.assertTrue(self.storage.exists(name))
+
+    def test_reupload_after_collection_stores_the_file_again(self):
+        name = self.save()
+        self.release(name)
+        collect_garbage(grace=60)
+        self.assertEqual(self.save(), name)
+        self.assertEqual(MediaBlob.objects.get(name=name).ref_count, 1)
+        self.assertTrue(self.storage.exists(name))
+
+    def test_failed_file_removal_keeps_the_row(self):
+        name = self.save()
+        self.release(name)
+        with mock.patch.object(FileSystemStorage, "delete", side_effect=OSError), self.assertLogs("chat.storage"):
+            self.assertEqual(collect_garbage(grace=60), (0, 0))
+        self.assertTrue(MediaBlob.objects.filter(name=name).exists())
+        self.assertEqual(collect_garbage(grace=60), (1, len(b"same bytes")))
+
+    def test_message_delete_releases_media_on_commit(self):
+        name = self.save()
+        msg = Message.objects.create(room=self.room, sender=self.alice, media=name)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            msg.delete()
+            self.assertEqual(MediaBlob.objects.get(name=name).ref_count, 1)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(MediaBlob.objects.get(name=name).ref_count, 0)
+        self.assertTrue(os.path.exists(self.storage.path(name)))
@@ -0,0 +1,221 @@
+# chat/tests/test_views.py
+import io
+import shutil
+import tempfile
+
+from PIL import ExifTags, Image
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from chat.models import ChatRoom, MediaBlob, Message
+from chat.rooms import get_private_room
+
+from .utils import IN_MEMORY_SERVICES, make_group, make_user
+
+
+@override_settings(**IN_MEMORY_SERVICES)
+class QueryBudgetTests(TestCase):
+    """
+    Each list view renders with a fixed number of queries, session and user
+    lookups included, and the number must not grow with the rows on the page.
+    """
+    QUERY_BUDGETS = {
+        "dashboard": 5,
+        "room_list": 3,
+        "chat_with": 6,
+        "chat_room": 5,
+        "manage_group": 4,
+        "message_history": 5,
+        "user_search": 3,
+        "message_search": 4,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [make_user(f"member{i}") for i in range(30)]
+        cls.me, cls.peer = cls.users[:2]
+        cls.room = make_group(cls.me, cls.peer)
+        cls.private, _ = get_private_room(cls.me, cls.peer)
+
+    def setUp(self):
+        self.client.force_login(self.me)
+        self.rows = 0
+
+    def urls(self):
+        return {
+            "dashboard": reverse("dashboard"),
+            "room_list": reverse("room_list"),
+            "chat_with": reverse("chat_with", args=[self.peer.username]),
+            "chat_room": reverse("chat_room", args=[self.room.id]),
+            "manage_group": reverse("manage_group", args=[self.room.id]),
+            "message_history": reverse("message_history", args=[self.private.id]),
+            "user_search": reverse("user_search") + "?q=member",
+            "message_search": reverse("message_search") + "?q=group",
+        }
+
+    def grow_to(self, rows):
+        """Bring the members, rooms and messages on every page up to ``rows``."""
+        new = range(self.rows, rows)
+        self.room.members.add(*self.users[2:rows])
+        for i in new:
+            extra = ChatRoom.objects.create(name=f"extra{i}", room_type="group", creator=self.users[i % 2])
+            extra.members.add(self.me)
+        Message.objects.bulk_create(
+            [Message(room=self.room, sender=self.users[i % 2], content=f"group {i}") for i in new]
+            + [Message(room=self.private, sender=self.users[i % 2], content=f"private {i}") for i in new]
+        )
+        self.rows = rows
+
+    def count_queries(self, url):
+        self.client.get(url)  # warm up (session, lazily created rows)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(ctx.captured_queries)
+
+    def test_list_views_stay_within_budget(self):
+        self.grow_to(3)
+        small = {name: self.count_queries(url) for name, url in self.urls().items()}
+        self.grow_to(30)
+        large = {name: self.count_queries(url) for name, url in self.urls().items()}
+        for name, budget in self.QUERY_BUDGETS.items():
+            with self.subTest(view=name):
+                self.assertEqual(small[name], large[name], f"{name} queries grow with rows")
+                self.assertLessEqual(large[name], budget)
+
+
+@override_settings(**IN_MEMORY_SERVICES)
+class MediaUploadTests(TestCase):
+    # Enough of an MP4 header for the type sniffing; videos skip image processing
+    TINY_MP4 = b"\x00\x00\x00\x18ftypmp42" + b"\x00" * 32
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = make_user("alice")
+        cls.mallory = make_user("mallory")
+        cls.room = make_group(cls.alice)
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.client.force_login(self.alice)
+
+    def test_upload_references_its_blob(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("upload_media_room", args=[self.room.id]),
+                {"media": SimpleUploadedFile("clip.mp4", self.TINY_MP4, "video/mp4")},
+            )
+        self.assertEqual(response.status_code, 302)
+        msg = Message.objects.get(room=self.room)
+        blob = MediaBlob.objects.get(name=msg.media.name)
+        self.assertEqual((blob.ref_count, blob.size), (1, len(self.TINY_MP4)))
+
+    def test_rejected_upload_stores_nothing(self):
+        response = self.client.post(
+            reverse("upload_media_room", args=[self.room.id]),
+            {"media": SimpleUploadedFile("notes.mp4", b"plain text, not a video", "video/mp4")},
+        )
+        self.assertEqual(response.status_code, 415)
+        self.assertFalse(Message.objects.filter(room=self.room).exists())
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_served_images_carry_no_exif(self):
+        exif = Image.Exif()
+        exif[ExifTags.Base.Make] = "Camera"
+        exif[ExifTags.IFD.GPSInfo] = {ExifTags.GPS.GPSLatitudeRef: "N", ExifTags.GPS.GPSLatitude: (51.0, 30.0, 0.0)}
+        photo = io.BytesIO()
+        Image.new("RGB", (64, 48), "red").save(photo, "JPEG", exif=exif)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("upload_media_room", args=[self.room.id]),
+                {"media": SimpleUploadedFile("photo.jpg", photo.getvalue(), "image/jpeg")},
+            )
+        msg = Message.objects.get(room=self.room)
+        for variant in ("original", "display", "thumbnail"):
+            with self.subTest(variant=variant):
+                response = self.client.get(reverse("serve_media", args=[msg.id, variant]))
+                self.assertEqual(response.status_code, 200)
+                with Image.open(io.BytesIO(b"".join(response.streaming_content))) as served:
+                    self.assertEqual(dict(served.getexif()), {})
+                    self.assertNotIn("exif", served.info)
+
+    def test_non_member_cannot_upload(self):
+        self.client.force_login(self.mallory)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("upload_media_room", args=[self.room.id]),
+                {"media": SimpleUploadedFile("clip.mp4", self.TINY_MP4, "video/mp4")},
+            )
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Message.objects.filter(room=self.room).exists())
+        self.assertFalse(MediaBlob.objects.exists())
+
+
+class GroupPageTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = make_user("alice")
+        cls.mallory = make_user("mallory")
+        cls.room = make_group(cls.alice)
+
+    def test_only_members_get_the_chat_page(self):
+        url = reverse("chat_room", args=[self.room.id])
+        self.client.force_login(self.alice)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.client.force_login(self.mallory)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class GroupRoomAccessTests(TestCase):
+    """History, media and search follow membership, including after removal."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = make_user("alice")
+        cls.mallory = make_user("mallory")
+        cls.room = make_group(cls.alice, cls.mallory)
+        cls.room.members.remove(cls.mallory)
+        cls.msg = Message.objects.create(room=cls.room, sender=cls.alice, content="secret plans", media="x.jpg")
+
+    def test_removed_member_is_refused(self):
+        self.client.force_login(self.mallory)
+        urls = [
+            reverse("message_history", args=[self.room.id]),
+            reverse("serve_media", args=[self.msg.id, "original"]),
+            reverse("message_search") + f"?q=secret&room={self.room.id}",
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 403)
+        response = self.client.get(reverse("message_search") + "?q=secret")
+        self.assertEqual(response.json()["results"], [])
+
+    def test_member_still_sees_the_room(self):
+        self.client.force_login(self.alice)
+        response = self.client.get(reverse("message_history", args=[self.room.id]))
+        self.assertEqual([m["message_id"] for m in response.json()["messages"]], [self.msg.id])
+
+
+class RoomListTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = make_user("alice")
+        cls.bob = make_user("bob")
+        cls.joined = make_group(cls.bob, cls.alice, name="joined")
+        cls.other = make_group(cls.bob, name="other")
+        for room in (cls.joined, cls.other):
+            Message.objects.bulk_create([Message(room=room, sender=cls.bob, content="hi") for _ in range(3)])
+
+    def test_only_joined_rooms_get_an_unread_badge(self):
+        self.client.force_login(self.alice)
+        rooms = {room.name: room for room in self.client.get(reverse("room_list")).context["rooms"]}
+        self.assertEqual((rooms["joined"].is_member, rooms["joined"].unread_count), (True, 3))
+        self.assertEqual((rooms["other"].is_member, rooms["other"].unread_count), (False, 0))
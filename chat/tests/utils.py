@@ -0,0 +1,37 @@
+# chat/tests/utils.py
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+
+from chat.models import ChatRoom, CustomUser
+from chat.routing import websocket_urlpatterns
+
+# Single-process stand-ins for the Redis-backed services
+IN_MEMORY_SERVICES = {
+    "CHANNEL_LAYERS": {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    "CHAT_PRESENCE_STORE": "local",
+    "CHAT_RATE_LIMIT_STORE": "local",
+}
+
+
+def make_user(name, **fields):
+    return CustomUser.objects.create(
+        email=f"{name}@example.com",
+        username=name,
+        age=30,
+        contact="0000000000",
+        gender="other",
+        **fields,
+    )
+
+
+def make_group(creator, *members, name="group"):
+    room = ChatRoom.objects.create(name=name, room_type="group", creator=creator)
+    room.members.set([creator, *members])
+    return room
+
+
+def connect(user, path):
+    """A communicator for the chat sockets, already authenticated as ``user``."""
+    communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+    communicator.scope["user"] = user
+    return communicator
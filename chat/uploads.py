@@ -0,0 +1,301 @@
+# chat/uploads.py
+"""
+Media uploads: chunked over the chat WebSocket, or as a multipart POST to the
+upload views (``MediaUploadHandler`` at the bottom of this module).
+
+Protocol (shown for the JSON codec, where chunks are raw binary frames; with
+msgpack they are ``upload_chunk`` frames, see chat/codecs.py):
+
+    client -> {"action": "upload_start", "upload_id", "content_type", "size", "message"}
+    server -> {"action": "upload_ready", "upload_id", "chunk_size", "window"}
+    client -> <binary chunk> ...            (at most ``window`` chunks un-acked)
+    server -> {"action": "upload_ack", "upload_id", "received"}   (one per chunk)
+    client -> {"action": "upload_commit", "upload_id"}
+    server -> regular chat message broadcast carrying ``media_url`` / ``thumbnail_url``
+
+Either side may end an upload early with ``upload_abort`` / ``upload_error``.
+Chunks go straight to a temporary file on disk, so a connection never holds
+more than ``chunk_size * window`` bytes of media in memory.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers, StopUpload
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+from django.utils import timezone
+
+from .media import process_message_media
+from .storage import get_media_storage
+
+ALLOWED_MEDIA_TYPES = ["image/jpeg", "image/png", "image/gif", "video/mp4"]
+MAX_MEDIA_SIZE_MB = 10
+# Per-type caps in bytes
+MEDIA_SIZE_LIMITS = {content_type: MAX_MEDIA_SIZE_MB * 1024 * 1024 for content_type in ALLOWED_MEDIA_TYPES}
+MEDIA_EXTENSIONS = {"image/jpeg": ".jpeg", "image/png": ".png", "image/gif": ".gif", "video/mp4": ".mp4"}
+# Room for the other form fields and multipart boundaries around an upload
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def sniff_media_type(head):
+    """The allowed media type ``head`` (the first bytes of a file) starts like, else ``None``."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head[4:8] == b"ftyp":
+        return "video/mp4"
+    return None
+
+
+def check_media(content_type, size):
+    if content_type not in ALLOWED_MEDIA_TYPES:
+        raise UploadError("Unsupported file type.", status=415)
+    if size <= 0:
+        raise UploadError("Empty file.")
+    if size > MEDIA_SIZE_LIMITS[content_type]:
+        raise UploadError(f"File too large. Max size is {MEDIA_SIZE_LIMITS[content_type] // (1024 * 1024)}MB.", status=413)
+
+
+class ChunkedUpload:
+    def __init__(self, upload_id, content_type, size, caption=""):
+        ext = content_type.split('/')[-1]
+        name = f"upload_{timezone.now().strftime('%Y%m%d%H%M%S')}.{ext}"
+        self.upload_id = upload_id
+        self.size = size
+        self.caption = caption
+        self.received = 0
+        self.file = TemporaryUploadedFile(name, content_type, size, None)
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.received += len(chunk)
+
+    def finish(self):
+        self.file.flush()
+        self.file.seek(0)
+        return self.file
+
+    def discard(self):
+        self.file.close()
+
+
+class ChunkedUploadMixin:
+    """
+    Adds the upload protocol to a chat consumer. The consumer must provide
+    ``send_frame(payload)``, ``save_message(message, media=None)`` and
+    ``broadcast_message(msg_obj)``.
+    """
+    upload = None
+
+    async def send_upload_frame(self, action, upload_id, **extra):
+        await self.send_frame({"action": action, "upload_id": upload_id, **extra})
+
+    async def upload_failed(self, upload_id, error):
+        await self.discard_upload()
+        await self.send_upload_frame("upload_error", upload_id, error=error)
+
+    async def discard_upload(self):
+        upload, self.upload = self.upload, None
+        if upload is not None:
+            await sync_to_async(upload.discard, thread_sensitive=False)()
+
+    async def handle_upload_action(self, data):
+        action = data.get("action")
+        upload_id = data.get("upload_id")
+
+        if action == "upload_start":
+            if self.upload is not None:
+                return await self.send_upload_frame("upload_error", upload_id, error="Another upload is in progress.")
+            try:
+                content_type = data.get("content_type", "")
+                size = int(data.get("size", 0))
+                check_media(content_type, size)
+            except (TypeError, ValueError, UploadError) as exc:
+                return await self.send_upload_frame("upload_error", upload_id, error=str(exc) or "Invalid upload.")
+            self.upload = await sync_to_async(ChunkedUpload, thread_sensitive=False)(
+                upload_id, content_type, size, data.get("message", "").strip()
+            )
+            await self.send_upload_frame(
+                "upload_ready", upload_id,
+                chunk_size=settings.CHAT_UPLOAD_CHUNK_SIZE,
+                window=settings.CHAT_UPLOAD_WINDOW,
+            )
+
+        elif action == "upload_commit":
+            upload = self.upload
+            if upload is None or upload.upload_id != upload_id:
+                return await self.send_upload_frame("upload_error", upload_id, error="No such upload.")
+            if upload.received != upload.size:
+                return await self.upload_failed(upload_id, "Upload incomplete.")
+            self.upload = None
+            media = await sync_to_async(upload.finish, thread_sensitive=False)()
+            try:
+                msg_obj = await self.save_message(upload.caption, media=media)
+            finally:
+                await sync_to_async(upload.discard, thread_sensitive=False)()
+            await process_message_media(msg_obj)
+            await self.broadcast_message(msg_obj)
+
+        elif action == "upload_abort":
+            if self.upload is not None and self.upload.upload_id == upload_id:
+                await self.discard_upload()
+
+    async def receive_upload_chunk(self, chunk):
+        upload = self.upload
+        if upload is None:
+            return await self.send_upload_frame("upload_error", None, error="No upload in progress.")
+        if len(chunk) > settings.CHAT_UPLOAD_CHUNK_SIZE:
+            return await self.upload_failed(upload.upload_id, "Chunk too large.")
+        if upload.received + len(chunk) > upload.size:
+            return await self.upload_failed(upload.upload_id, "More data than announced.")
+        if upload.received == 0 and sniff_media_type(chunk[:16]) != upload.file.content_type:
+            return await self.upload_failed(upload.upload_id, "File content does not match its type.")
+        await sync_to_async(upload.write, thread_sensitive=False)(chunk)
+        await self.send_upload_frame("upload_ack", upload.upload_id, received=upload.received)
+
+
+# -------------------------
+# HTTP uploads
+# -------------------------
+class StoredUpload(UploadedFile):
+    """
+    A file the upload handler has already written to media storage.
+    ``stored_name`` is the storage name to put on ``Message.media``.
+    """
+
+    def __init__(self, stored_name, content_type, size):
+        super().__init__(None, stored_name, content_type, size)
+        self.stored_name = stored_name
+
+
+class MediaUploadHandler(FileUploadHandler):
+    """
+    Streams the ``media`` form field straight into content-addressed storage.
+
+    The type is sniffed from the magic bytes of the first chunk (the declared
+    Content-Type is ignored) and the per-type size cap is enforced as chunks
+    arrive, so a rejected upload stops the request after at most one chunk
+    past the cap. The reason is left on ``request.upload_error``.
+    """
+    field_name = "media"
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.writer = None
+        self.media_type = None
+        request.upload_error = None
+
+    def fail(self, error):
+        self.request.upload_error = error
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
+        # Don't read the rest of the body
+        raise StopUpload(connection_reset=True)
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length > max(MEDIA_SIZE_LIMITS.values()) + MULTIPART_OVERHEAD:
+            self.request.upload_error = UploadError(f"File too large. Max size is {MAX_MEDIA_SIZE_MB}MB.", status=413)
+            # Skip parsing the body altogether
+            return QueryDict(encoding=encoding), MultiValueDict()
+        return None
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        if field_name != self.field_name:
+            return
+        self.writer = get_media_storage().open_writer()
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.writer is None:
+            return raw_data
+        if start == 0:
+            self.media_type = sniff_media_type(raw_data[:16])
+            if self.media_type is None:
+                self.fail(UploadError("Unsupported file type.", status=415))
+        if start + len(raw_data) > MEDIA_SIZE_LIMITS[self.media_type]:
+            self.fail(UploadError(
+                f"File too large. Max size is {MEDIA_SIZE_LIMITS[self.media_type] // (1024 * 1024)}MB.", status=413,
+            ))
+        self.writer.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.writer is None:
+            return None
+        writer, self.writer = self.writer, None
+        if file_size == 0:
+            writer.abort()
+            self.request.upload_error = UploadError("Empty file.")
+            return None
+        stored_name = writer.commit(MEDIA_EXTENSIONS[self.media_type])
+        return StoredUpload(stored_name, self.media_type, file_size)
+
+    def upload_interrupted(self):
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
+
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI middleware that refuses HTTP request bodies larger than the biggest
+    allowed upload with a 413, before Django reads (and spools) them: up
+    front from Content-Length, or as soon as a chunked body goes past it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.limit = max(MEDIA_SIZE_LIMITS.values()) + MULTIPART_OVERHEAD
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers") or [])
+        try:
+            declared = int(headers.get(b"content-length", b"0"))
+        except ValueError:
+            declared = 0
+        if declared > self.limit:
+            return await self.reject(send)
+
+        received = 0
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.limit and not rejected:
+                    rejected = True
+                    await self.reject(send)
+                    # Django treats this as the client going away and sends nothing
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            if not rejected:
+                await send(message)
+
+        await self.app(scope, limited_receive, guarded_send)
+
+    async def reject(self, send):
+        body = b'{"ok": false, "error": "Request body too large."}'
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
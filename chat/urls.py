@@ -49,6 +49,9 @@ urlpatterns = [
 
     # Dashboard
     path('dashboard/', views.dashboard, name='dashboard'),
+    path('users/search/', views.user_search, name='user_search'),
+    path('messages/search/', views.message_search, name='message_search'),
+    path('attachments/<int:message_id>/<str:variant>/', views.serve_media, name='serve_media'),
 
     # 📌 Private Chat
     path('chat/<str:username>/', views.chat_with, name='chat_with'),
@@ -76,5 +79,6 @@ urlpatterns = [
 
     path('resend-otp/', views.resend_otp, name='resend_otp'),
     path("delete-message/<int:message_id>/", views.delete_message, name="delete_message"),
+    path("history/<int:room_id>/", views.message_history, name="message_history"),
 
 ]
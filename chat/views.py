@@ -3,29 +3,36 @@ import random
 from datetime import timedelta
 
 from django.conf import settings
-from django.shortcuts import render, redirect, get_object_or_404
-from django.core.mail import send_mail
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout, get_user_model
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 
-from .models import CustomUser, ChatRoom, Message
+from .models import ArchivedAttachment, CustomUser, ChatRoom, Message, ReadCursor
 from .forms import RegisterForm, OTPForm, PasswordSetForm, LoginForm
-from django.core.exceptions import ValidationError
-
-from django.http import JsonResponse
+from .archive import read_archive
+from .conversations import conversation_summaries, with_member_unread_counts
+from .directory import directory
+from .frames import message_frame, message_payload, delete_frame
+from .jobs import enqueue_email, enqueue_media_release
+from .media import media_field, process_message_media
+from .persistence import persist_message
+from .rooms import acan_view_room, aget_private_room, ais_room_member, can_view_room, room_group_name
+from .search import search_messages
+from .serving import serve_file
+from .uploads import MediaUploadHandler
+
+from django.http import Http404, HttpResponseForbidden, JsonResponse
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
 
 
 User = get_user_model()
 
-# -------------------------
-# Helper: Consistent Private Room Naming
-# -------------------------
-def get_private_room_name(user1, user2):
-    return f"chat_{min(user1.username, user2.username)}_{max(user1.username, user2.username)}"
-
 # -------------------------
 # Helper: Timestamp Formatting
 # -------------------------
@@ -42,15 +49,74 @@ def format_timestamp(timestamp):
     return f"{time_str}, {day_str}"
 
 # -------------------------
-# Helper: File Validation
+# Helper: Streaming Media Upload
+# -------------------------
+async def read_media_upload(request):
+    """
+    Parse the upload with ``MediaUploadHandler``, which streams the file into
+    media storage and rejects bad types / sizes before reading the whole body.
+    Returns ``(upload, error_response)``; both are ``None`` when nothing was sent.
+    """
+    request.upload_handlers = [MediaUploadHandler(request)]
+    # The handler takes a MediaBlob reference when the file completes, so the
+    # parse runs where the ORM's connection handling expects it
+    files = await database_sync_to_async(lambda: request.FILES)()
+    if request.upload_error is not None:
+        error = request.upload_error
+        return None, JsonResponse({'ok': False, 'error': str(error)}, status=error.status)
+    return files.get('media'), None
+
+# -------------------------
+# Helper: Message Deletion
+# -------------------------
+def soft_delete_message(msg):
+    """
+    Blank out ``msg`` and hand its media to the job queue. The job is queued in
+    the same transaction, so the files are released if and only if the
+    deletion commits.
+    """
+    with transaction.atomic():
+        msg.is_deleted = True
+        msg.content = "[message deleted]"
+        if msg.media:
+            enqueue_media_release(msg)
+            msg.media = msg.media_thumbnail = msg.media_compressed = None
+        msg.save()
+
+# -------------------------
+# Helper: Message History (keyset pagination)
+# -------------------------
+async def get_history_page(room, before=None, limit=None):
+    """
+    Newest ``limit`` messages of ``room`` older than message ``before``,
+    returned oldest-first, plus whether anything older remains.
+
+    Pages are cut on ``(room_id, id)`` rather than with OFFSET, so every page
+    costs the same no matter how long the room's history is. Pages that reach
+    past the hot table continue into the archive (see chat/archive.py).
+    """
+    limit = limit or settings.CHAT_HISTORY_PAGE_SIZE
+    qs = Message.objects.filter(room=room).select_related("sender")
+    if before:
+        qs = qs.filter(id__lt=before)
+    page = [msg async for msg in qs.order_by("-id")[:limit + 1]]
+    if len(page) <= limit and room.archived_up_to:
+        # Ran out of hot rows; older history continues in the archive
+        oldest = page[-1].id if page else before
+        page += await database_sync_to_async(read_archive)(room.id, before=oldest, count=limit + 1 - len(page))
+    has_more = len(page) > limit
+    page = page[:limit][::-1]
+    for msg in page:
+        msg.formatted_time = format_timestamp(msg.timestamp)
+    return page, has_more
+
+# -------------------------
+# Helper: Async Views
 # -------------------------
-def validate_media(file):
-    allowed_types = ["image/jpeg", "image/png", "image/gif", "video/mp4"]
-    max_size_mb = 10
-    if file.content_type not in allowed_types:
-        raise ValidationError("Unsupported file type.")
-    if file.size > max_size_mb * 1024 * 1024:
-        raise ValidationError(f"File too large. Max size is {max_size_mb}MB.")
+async def resolve_user(request):
+    # Load the user once up front so templates never touch the DB from the event loop
+    request.user = await request.auser()
+    return request.user
 
 # -------------------------
 # Views
@@ -89,14 +155,8 @@ def register_view(request):
             otp = _generate_otp()
             _store_otp_in_session(request, "reg", email, otp)
 
-            # Email OTP (use console backend in dev if you want)
-            send_mail(
-                subject='Your Registration OTP',
-                message=f'Your OTP is: {otp}. It expires in 30 seconds.',
-                from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@example.com'),
-                recipient_list=[email],
-                fail_silently=False,
-            )
+            # Email OTP from the job worker (use console backend in dev if you want)
+            _send_otp_email(request, "reg", 'Your Registration OTP')
 
             return redirect('verify_otp')
     else:
@@ -122,7 +182,7 @@ def verify_otp_view(request):
         except Exception:
             otp_input = request.POST.get('otp', '').strip()
 
-        ok, err = _otp_is_valid(request, "reg", otp_input, max_age_seconds=30)
+        ok, err = _otp_is_valid(request, "reg", otp_input, max_age_seconds=OTP_MAX_AGE)
         if not ok:
             messages.error(request, err)
             _clear_reg_session(request)
@@ -198,54 +258,151 @@ def logout_view(request):
 
 @login_required
 def dashboard(request):
-    users = CustomUser.objects.exclude(id=request.user.id)
-    rooms = ChatRoom.objects.filter(room_type="group")
+    rooms = ChatRoom.objects.filter(room_type="group").only("id", "name", "creator_id")
     return render(request, "chat/dashboard.html", {
-        "users": users,
+        "conversations": conversation_summaries(request.user),
         "rooms": rooms
     })
 
 @login_required
-def chat_with(request, username):
-    other_user = get_object_or_404(CustomUser, username=username)
-    room_name = get_private_room_name(request.user, other_user)
-
-    # Only look for PRIVATE rooms
-    room, created = ChatRoom.objects.get_or_create(
-        name=room_name,
-        room_type="private",  # Ensures it's a private room
-        defaults={"creator": request.user}
-    )
+def user_search(request):
+    """
+    Typeahead for the dashboard and the group member picker:
+    ``?q=<prefix>&cursor=<next_cursor>&limit=<n>&exclude_room=<room_id>``.
+    """
+    try:
+        limit = min(int(request.GET.get("limit", settings.CHAT_DIRECTORY_PAGE_SIZE)), 100)
+        exclude_room = int(request.GET.get("exclude_room", 0))
+    except ValueError:
+        return JsonResponse({'ok': False, 'error': 'Invalid parameters'}, status=400)
+
+    exclude_ids = {request.user.id}
+    if exclude_room:
+        exclude_ids.update(ChatRoom.members.through.objects.filter(chatroom_id=exclude_room).values_list("customuser_id", flat=True))
+
+    try:
+        users, next_cursor = directory.search(
+            request.GET.get("q", ""), cursor=request.GET.get("cursor"), limit=max(limit, 1), exclude_ids=exclude_ids,
+        )
+    except ValueError:
+        return JsonResponse({'ok': False, 'error': 'Invalid cursor'}, status=400)
+    return JsonResponse({'ok': True, 'users': users, 'next_cursor': next_cursor})
 
-    if created:
-        room.members.set([request.user, other_user])
+@login_required
+async def chat_with(request, username):
+    user = await resolve_user(request)
+    other_user = await aget_object_or_404(CustomUser, username=username)
+    room, created = await aget_private_room(user, other_user)
 
-    messages_qs = Message.objects.filter(room=room).order_by("timestamp")
-    for msg in messages_qs:
-        msg.formatted_time = format_timestamp(msg.timestamp)
+    messages_qs, has_more = await get_history_page(room)
+    # How far the other participant has read, for the "Seen" marks
+    peer_last_read = await ReadCursor.objects.filter(user=other_user, room=room).values_list("last_read_id", flat=True).afirst()
 
     return render(request, "chat/chat.html", {
         "other_user": other_user,
-        "messages": messages_qs
+        "room": room,
+        "messages": messages_qs,
+        "has_more": has_more,
+        "peer_last_read": peer_last_read or 0
     })
 
 
 @login_required
-def chat_room(request, room_id):
-    room = get_object_or_404(ChatRoom, id=room_id, room_type="group")
-    messages_qs = Message.objects.filter(room=room).order_by("timestamp")
-    for msg in messages_qs:
-        msg.formatted_time = format_timestamp(msg.timestamp)
+async def chat_room(request, room_id):
+    user = await resolve_user(request)
+    room = await aget_object_or_404(ChatRoom.objects.select_related("creator"), id=room_id, room_type="group")
+    if not await ais_room_member(user, room):
+        # The socket would refuse them anyway; don't render a page that can't connect
+        return HttpResponseForbidden("You are not a member of this group.")
+    messages_qs, has_more = await get_history_page(room)
     group_created_time = format_timestamp(room.created_at)
 
     return render(request, "chat/chat_room.html", {
         "room": room,
         "messages": messages_qs,
+        "has_more": has_more,
         "group_created_time": group_created_time  # pass to template
 
     })
 
 
+@login_required
+async def message_history(request, room_id):
+    """
+    Older messages for the "load older" scroll handler:
+    ``?before=<message_id>&limit=<n>``.
+    """
+    user = await resolve_user(request)
+    room = await aget_object_or_404(ChatRoom, id=room_id)
+    if not await acan_view_room(user, room):
+        return JsonResponse({'ok': False, 'error': 'Not allowed'}, status=403)
+
+    try:
+        before = int(request.GET.get("before", 0)) or None
+        limit = min(int(request.GET.get("limit", settings.CHAT_HISTORY_PAGE_SIZE)), settings.CHAT_HISTORY_MAX_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'ok': False, 'error': 'Invalid paging parameters'}, status=400)
+    if limit < 1:
+        return JsonResponse({'ok': False, 'error': 'Invalid paging parameters'}, status=400)
+
+    page, has_more = await get_history_page(room, before=before, limit=limit)
+    return JsonResponse({
+        'ok': True,
+        'messages': [
+            {**message_payload(msg, msg.formatted_time), "is_deleted": msg.is_deleted}
+            for msg in page
+        ],
+        'has_more': has_more,
+    })
+
+
+@login_required
+def serve_media(request, message_id, variant):
+    """Media of a message, for people who can see its room (see chat/serving.py)."""
+    room_fields = ("room__id", "room__room_type", "room__user_low_id", "room__user_high_id")
+    msg = Message.objects.select_related("room").only(
+        "id", "media", "media_thumbnail", "media_compressed", *room_fields,
+    ).filter(id=message_id, is_deleted=False).first()
+    if msg is None:
+        # Archived messages keep their media on an ArchivedAttachment row
+        msg = get_object_or_404(
+            ArchivedAttachment.objects.select_related("room").only(
+                "message_id", "media", "media_thumbnail", "media_compressed", *room_fields,
+            ),
+            message_id=message_id,
+        )
+    if not can_view_room(request.user, msg.room):
+        return HttpResponseForbidden()
+    field = media_field(msg, variant)
+    if field is None:
+        raise Http404("No such media")
+    return serve_file(request, field)
+
+
+@login_required
+def message_search(request):
+    """
+    Full-text search: ``?q=<words>&room=<room_id>&page=<n>``. Without
+    ``room`` it searches every room the user is a member of.
+    """
+    query = request.GET.get("q", "").strip()
+    try:
+        room_id = int(request.GET["room"]) if request.GET.get("room") else None
+        page = int(request.GET.get("page", 1))
+    except ValueError:
+        return JsonResponse({'ok': False, 'error': 'Invalid parameters'}, status=400)
+    if page < 1:
+        return JsonResponse({'ok': False, 'error': 'Invalid parameters'}, status=400)
+
+    if room_id is not None:
+        room = get_object_or_404(ChatRoom.objects.only("id", "room_type", "user_low_id", "user_high_id"), id=room_id)
+        if not can_view_room(request.user, room):
+            return JsonResponse({'ok': False, 'error': 'Not allowed'}, status=403)
+
+    results, has_more = search_messages(query, request.user, room_id=room_id, page=page)
+    return JsonResponse({'ok': True, 'results': results, 'page': page, 'has_more': has_more})
+
+
 
 from django.shortcuts import get_object_or_404
 
@@ -280,28 +437,24 @@ def create_room(request):
 @login_required
 def manage_group(request, room_id):
     room = get_object_or_404(ChatRoom, id=room_id, room_type="group", creator=request.user)
-    members = room.members.all()
-    all_users = CustomUser.objects.exclude(id__in=members.values_list("id", flat=True))
+    members = room.members.only("id", "username")
 
     if request.method == "POST":
         user_ids = request.POST.getlist("members")
-        for user_id in user_ids:
-            user = CustomUser.objects.get(id=user_id)
-            room.members.add(user)
+        room.members.add(*CustomUser.objects.filter(id__in=user_ids).values_list("id", flat=True))
         messages.success(request, "Members added successfully.")
         return redirect("manage_group", room_id=room.id)
 
     return render(request, "chat/manage_group.html", {
         "room": room,
-        "members": members,
-        "all_users": all_users
+        "members": members
     })
 
 @login_required
 def remove_member(request, room_id, user_id):
     room = get_object_or_404(ChatRoom, id=room_id)
     user = get_object_or_404(CustomUser, id=user_id)
-    if request.user == room.creator and user in room.members.all():
+    if room.creator_id == request.user.id and room.members.filter(id=user.id).exists():
         room.members.remove(user)
         messages.success(request, f"{user.username} removed from group.")
     return redirect('manage_group', room_id=room.id)
@@ -317,14 +470,12 @@ def delete_group(request, room_id):
 @login_required
 def add_members(request, room_id):
     room = get_object_or_404(ChatRoom, id=room_id)
-    if request.user != room.creator:
+    if room.creator_id != request.user.id:
         return redirect('dashboard')
 
     if request.method == 'POST':
         user_ids = request.POST.getlist('users')
-        for uid in user_ids:
-            user = CustomUser.objects.get(id=uid)
-            room.members.add(user)
+        room.members.add(*CustomUser.objects.filter(id__in=user_ids).values_list("id", flat=True))
     return redirect('manage_group', room_id=room.id)
 
 # -------------------------
@@ -333,28 +484,28 @@ def add_members(request, room_id):
 
 @login_required
 @csrf_exempt
-def upload_media(request, username):
-    if request.method == 'POST' and request.FILES.get('media'):
-        receiver = get_object_or_404(CustomUser, username=username)
-        room_name = f"chat_{min(request.user.username, receiver.username)}_{max(request.user.username, receiver.username)}"
-        room = ChatRoom.objects.get(name=room_name)
-        file = request.FILES['media']
-        msg = Message.objects.create(sender=request.user, room=room, media=file)
+async def upload_media(request, username):
+    if request.method != 'POST':
+        return redirect('dashboard')
+    upload, error_response = await read_media_upload(request)
+    if error_response is not None:
+        return error_response
+    if upload is not None:
+        user = await resolve_user(request)
+        receiver = await aget_object_or_404(CustomUser, username=username)
+        room, created = await aget_private_room(user, receiver)
+        # Already in storage; assigning the name avoids saving it a second time
+        msg = await persist_message(Message(sender=user, room=room, media=upload.stored_name))
+        await process_message_media(msg)
 
         # Broadcast media via WebSocket
-        from channels.layers import get_channel_layer
-        import asyncio
-        channel_layer = get_channel_layer()
-        asyncio.run(channel_layer.group_send(
-            f"private_chat_{room_name}",
+        await get_channel_layer().group_send(
+            room_group_name(room),
             {
-                "type": "chat.message",
-                "message": "",
-                "media_url": msg.media.url,
-                "sender": request.user.username,
-                "timestamp": format_timestamp(msg.timestamp)
+                "type": "chat_message",
+                "frames": message_frame(msg, format_timestamp(msg.timestamp))
             }
-        ))
+        )
 
         return redirect('chat_with', username=receiver.username)
     return redirect('dashboard')
@@ -362,26 +513,29 @@ def upload_media(request, username):
 
 @login_required
 @csrf_exempt
-def upload_media_room(request, room_id):
-    if request.method == 'POST' and request.FILES.get('media'):
-        room = get_object_or_404(ChatRoom, id=room_id)
-        file = request.FILES['media']
-        msg = Message.objects.create(sender=request.user, room=room, media=file)
+async def upload_media_room(request, room_id):
+    if request.method != 'POST':
+        return redirect('dashboard')
+    user = await resolve_user(request)
+    room = await aget_object_or_404(ChatRoom, id=room_id, room_type="group")
+    # Checked before the body is parsed, so a refused upload stores nothing
+    if not await ais_room_member(user, room):
+        return JsonResponse({'ok': False, 'error': 'Not allowed'}, status=403)
+    upload, error_response = await read_media_upload(request)
+    if error_response is not None:
+        return error_response
+    if upload is not None:
+        msg = await persist_message(Message(sender=user, room=room, media=upload.stored_name))
+        await process_message_media(msg)
 
         # Broadcast
-        from channels.layers import get_channel_layer
-        import asyncio
-        channel_layer = get_channel_layer()
-        asyncio.run(channel_layer.group_send(
-            f"group_chat_{room.id}",
+        await get_channel_layer().group_send(
+            room_group_name(room),
             {
-                "type": "chat.message",
-                "message": "",
-                "media_url": msg.media.url,
-                "sender": request.user.username,
-                "timestamp": format_timestamp(msg.timestamp)
+                "type": "group_chat_message",
+                "frames": message_frame(msg, format_timestamp(msg.timestamp))
             }
-        ))
+        )
 
         return redirect('chat_room', room_id=room.id)
     return redirect('dashboard')
@@ -400,40 +554,25 @@ from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
 '''
 
-from channels.layers import get_channel_layer
-import asyncio
-
-# ... your existing imports and code remain here ...
-
 @login_required
 @csrf_exempt
-def delete_message(request, message_id):
-    msg = get_object_or_404(Message, id=message_id)
+async def delete_message(request, message_id):
+    user = await resolve_user(request)
+    msg = await aget_object_or_404(Message.objects.select_related("room"), id=message_id)
 
-    if msg.sender != request.user:
+    if msg.sender_id != user.id:
         return JsonResponse({'ok': False, 'error': 'Not allowed'}, status=403)
 
-    msg.is_deleted = True
-    msg.content = "[message deleted]"
-    if msg.media:
-        msg.media.delete(save=False)
-        msg.media = None
-    msg.save()
+    await database_sync_to_async(soft_delete_message)(msg)
 
     # Broadcast deletion
-    channel_layer = get_channel_layer()
-    if msg.room.room_type == "private":
-        room_group_name = f"private_chat_{msg.room.name}"
-    else:
-        room_group_name = f"group_chat_{msg.room.id}"
-
-    asyncio.run(channel_layer.group_send(
-        room_group_name,
+    await get_channel_layer().group_send(
+        room_group_name(msg.room),
         {
             "type": "delete_message_event",
-            "message_id": msg.id
+            "frames": delete_frame(msg.id)
         }
-    ))
+    )
 
     return JsonResponse({'ok': True, 'message_id': msg.id})
 
@@ -442,7 +581,9 @@ def delete_message(request, message_id):
 
 @login_required
 def room_list(request):
-    rooms = ChatRoom.objects.filter(room_type="group")
+    rooms = with_member_unread_counts(
+        ChatRoom.objects.filter(room_type="group").only("id", "name", "creator_id"), request.user
+    )
     return render(request, "chat/room_list.html", {"rooms": rooms})
 
 
@@ -450,6 +591,9 @@ def room_list(request):
 
 # ----- OTP helpers -----
 
+# Seconds an OTP stays valid; its email is not sent (or retried) after that
+OTP_MAX_AGE = 30
+
 def _generate_otp():
     return f"{random.randint(0, 999999):06d}"
 
@@ -459,7 +603,7 @@ def _store_otp_in_session(request, prefix, email, otp):
     request.session[f"{prefix}_otp_created"] = timezone.now().timestamp()
     request.session.modified = True
 
-def _otp_is_valid(request, prefix, otp_input, max_age_seconds=30):
+def _otp_is_valid(request, prefix, otp_input, max_age_seconds=OTP_MAX_AGE):
     otp = request.session.get(f"{prefix}_otp")
     created_ts = request.session.get(f"{prefix}_otp_created")
     if not otp or not created_ts:
@@ -487,13 +631,15 @@ def _clear_reset_session(request):
 
 from django.conf import settings
 
-def _send_otp_email(email, subject, otp):
-    send_mail(
+def _send_otp_email(request, prefix, subject):
+    """Queue the OTP just stored in the session; one email per issued OTP."""
+    email = request.session[f"{prefix}_email"]
+    enqueue_email(
         subject=subject,
-        message=f'Your OTP is: {otp}. It expires in 30 seconds.',
-        from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@example.com'),
+        message=f'Your OTP is: {request.session[f"{prefix}_otp"]}. It expires in {OTP_MAX_AGE} seconds.',
         recipient_list=[email],
-        fail_silently=False,
+        key=f'otp:{prefix}:{email}:{request.session[f"{prefix}_otp_created"]}',
+        expires_in=OTP_MAX_AGE,
     )
 
 def resend_otp(request):
@@ -512,8 +658,8 @@ def resend_otp(request):
 
         otp = _generate_otp()
         _store_otp_in_session(request, 'reg', email, otp)
-        _send_otp_email(email, 'Your Registration OTP (Resent)', otp)
-        return JsonResponse({'ok': True, 'seconds': 30})
+        _send_otp_email(request, 'reg', 'Your Registration OTP (Resent)')
+        return JsonResponse({'ok': True, 'seconds': OTP_MAX_AGE})
 
     # kind == 'reset'
     email = request.session.get('reset_email')
@@ -522,8 +668,8 @@ def resend_otp(request):
 
     otp = _generate_otp()
     _store_otp_in_session(request, 'reset', email, otp)
-    _send_otp_email(email, 'Your Password Reset OTP (Resent)', otp)
-    return JsonResponse({'ok': True, 'seconds': 30})
+    _send_otp_email(request, 'reset', 'Your Password Reset OTP (Resent)')
+    return JsonResponse({'ok': True, 'seconds': OTP_MAX_AGE})
 
 
 #------------------Forgot-Password with OTP------------------------------------
@@ -544,13 +690,7 @@ def forgot_password_view(request):
         otp = _generate_otp()
         _store_otp_in_session(request, "reset", email, otp)
 
-        send_mail(
-            subject='Your Password Reset OTP',
-            message=f'Your OTP is: {otp}. It expires in 30 seconds.',
-            from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@example.com'),
-            recipient_list=[email],
-            fail_silently=False,
-        )
+        _send_otp_email(request, "reset", 'Your Password Reset OTP')
 
         return redirect('verify_reset_otp')
 
@@ -569,7 +709,7 @@ def verify_reset_otp_view(request):
         except Exception:
             otp_input = request.POST.get('otp', '').strip()
 
-        ok, err = _otp_is_valid(request, "reset", otp_input, max_age_seconds=30)
+        ok, err = _otp_is_valid(request, "reset", otp_input, max_age_seconds=OTP_MAX_AGE)
         if not ok:
             messages.error(request, err)
             _clear_reset_session(request)
@@ -11,12 +11,15 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 from django.core.asgi import get_asgi_application
 from chat.routing import websocket_urlpatterns
+from chat.lifespan import lifespan_app
+from chat.uploads import UploadSizeLimitMiddleware
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": UploadSizeLimitMiddleware(get_asgi_application()),
     "websocket": AuthMiddlewareStack(
         URLRouter(websocket_urlpatterns)
     ),
+    "lifespan": lifespan_app,
 })
 
 
@@ -250,7 +250,7 @@ ASGI_APPLICATION = "chat_config.asgi.application"
 # =======================
 # Use DATABASE_URL if provided, else fallback to local MySQL
 import dj_database_url
-from decouple import config
+from decouple import Csv, config
 
 # Get database URL from environment
 DATABASE_URL = config(
@@ -311,12 +311,170 @@ MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 # =======================
 REDIS_URL = config("REDIS_URL", default="redis://red-d2j0kfali9vc73dq4p60:6379")
 
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
-        "CONFIG": {"hosts": [REDIS_URL]},
+# Redis nodes the channel layer is sharded over by consistent hashing (see
+# chat/layers.py); comma-separated, every ASGI process needs the same list.
+CHANNEL_REDIS_URLS = config("CHANNEL_REDIS_URLS", cast=Csv(), default=REDIS_URL)
+
+# "memory" keeps the layer inside the process: a single ASGI process and no
+# Redis (local development, manage.py chat_loadtest).
+CHANNEL_LAYER = config("CHANNEL_LAYER", default="redis")
+
+if CHANNEL_LAYER == "memory":
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+            "CONFIG": {"capacity": 1000},
+        }
     }
-}
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "chat.layers.ShardedRedisChannelLayer",
+            "CONFIG": {"hosts": CHANNEL_REDIS_URLS},
+        }
+    }
+
+# =======================
+# Message persistence
+# =======================
+# "sync" saves each message before broadcasting it; "batched" assigns IDs up
+# front and writes messages behind with bulk_create (see chat/persistence.py).
+CHAT_PERSISTENCE_MODE = config("CHAT_PERSISTENCE_MODE", default="sync")
+CHAT_PERSISTENCE_BATCH_SIZE = config("CHAT_PERSISTENCE_BATCH_SIZE", cast=int, default=100)
+CHAT_PERSISTENCE_FLUSH_INTERVAL = config("CHAT_PERSISTENCE_FLUSH_INTERVAL", cast=float, default=0.05)
+# Unwritten messages a process holds while the database is unavailable; past
+# this, new messages are refused with a "not_stored" error frame
+CHAT_MESSAGE_BUFFER_MAX = config("CHAT_MESSAGE_BUFFER_MAX", cast=int, default=10000)
+# Required in batched mode: 0-31 and unique per worker process, or two workers
+# can mint the same message ID
+CHAT_NODE_ID = config("CHAT_NODE_ID", cast=lambda v: int(v) if v != "" else None, default="")
+
+# =======================
+# Message history
+# =======================
+CHAT_HISTORY_PAGE_SIZE = config("CHAT_HISTORY_PAGE_SIZE", cast=int, default=50)
+CHAT_HISTORY_MAX_PAGE_SIZE = config("CHAT_HISTORY_MAX_PAGE_SIZE", cast=int, default=200)
+
+# =======================
+# Read receipts
+# =======================
+# Read cursors reported by clients are merged and flushed (one UPSERT plus one
+# receipt frame per room) at most this often, in seconds (see chat/receipts.py).
+CHAT_READ_RECEIPT_INTERVAL = config("CHAT_READ_RECEIPT_INTERVAL", cast=float, default=0.5)
+
+# =======================
+# Typing and presence
+# =======================
+# Ephemeral signals, never stored in the database (see chat/presence.py).
+# "redis" keeps presence in REDIS_URL; "local" keeps it in process memory and
+# only suits a single process (e.g. with the in-memory channel layer).
+CHAT_PRESENCE_STORE = config("CHAT_PRESENCE_STORE", default="redis")
+CHAT_PRESENCE_TTL = config("CHAT_PRESENCE_TTL", cast=float, default=60)
+CHAT_PRESENCE_HEARTBEAT_INTERVAL = config("CHAT_PRESENCE_HEARTBEAT_INTERVAL", cast=float, default=20)
+CHAT_TYPING_INTERVAL = config("CHAT_TYPING_INTERVAL", cast=float, default=2)
+
+# =======================
+# Inbound rate limits
+# =======================
+# Token buckets per connection, user and room: RATE tokens per second, up to
+# BURST saved up; one message or upload costs one token (see chat/ratelimit.py).
+# "local" buckets are per process; "redis" shares them through REDIS_URL.
+CHAT_RATE_LIMIT_STORE = config("CHAT_RATE_LIMIT_STORE", default="local")
+# Over the limit: "reject", "queue" (send later, in order) or "coalesce"
+# (send everything waiting later as one message)
+CHAT_RATE_LIMIT_POLICY = config("CHAT_RATE_LIMIT_POLICY", default="reject")
+CHAT_RATE_LIMIT_QUEUE = config("CHAT_RATE_LIMIT_QUEUE", cast=int, default=20)
+CHAT_RATE_LIMIT_CONNECTION_RATE = config("CHAT_RATE_LIMIT_CONNECTION_RATE", cast=float, default=2)
+CHAT_RATE_LIMIT_CONNECTION_BURST = config("CHAT_RATE_LIMIT_CONNECTION_BURST", cast=float, default=10)
+CHAT_RATE_LIMIT_USER_RATE = config("CHAT_RATE_LIMIT_USER_RATE", cast=float, default=5)
+CHAT_RATE_LIMIT_USER_BURST = config("CHAT_RATE_LIMIT_USER_BURST", cast=float, default=20)
+CHAT_RATE_LIMIT_ROOM_RATE = config("CHAT_RATE_LIMIT_ROOM_RATE", cast=float, default=50)
+CHAT_RATE_LIMIT_ROOM_BURST = config("CHAT_RATE_LIMIT_ROOM_BURST", cast=float, default=100)
+
+# =======================
+# Conversation list
+# =======================
+# Most recently active conversations shown on the dashboard
+CHAT_CONVERSATION_LIMIT = config("CHAT_CONVERSATION_LIMIT", cast=int, default=50)
+
+# =======================
+# Message search
+# =======================
+# "auto" uses MySQL FULLTEXT or SQLite FTS5 when available and the built-in
+# inverted index otherwise; "inverted" forces the latter (see chat/search.py).
+CHAT_SEARCH_BACKEND = config("CHAT_SEARCH_BACKEND", default="auto")
+CHAT_SEARCH_PAGE_SIZE = config("CHAT_SEARCH_PAGE_SIZE", cast=int, default=20)
+
+# =======================
+# User directory
+# =======================
+# How often each process picks up users registered through other workers
+CHAT_DIRECTORY_REFRESH_INTERVAL = config("CHAT_DIRECTORY_REFRESH_INTERVAL", cast=float, default=30)
+CHAT_DIRECTORY_PAGE_SIZE = config("CHAT_DIRECTORY_PAGE_SIZE", cast=int, default=20)
+
+# =======================
+# WebSocket media uploads
+# =======================
+# Media is streamed as binary chunks; a connection buffers at most
+# CHAT_UPLOAD_CHUNK_SIZE * CHAT_UPLOAD_WINDOW bytes (see chat/uploads.py).
+CHAT_UPLOAD_CHUNK_SIZE = config("CHAT_UPLOAD_CHUNK_SIZE", cast=int, default=64 * 1024)
+CHAT_UPLOAD_WINDOW = config("CHAT_UPLOAD_WINDOW", cast=int, default=4)
+
+# =======================
+# Media processing
+# =======================
+# Image thumbnails and recompressed variants are rendered in a process pool
+# (see chat/media.py); sizes are the longest edge in pixels.
+CHAT_MEDIA_WORKERS = config("CHAT_MEDIA_WORKERS", cast=int, default=2)
+CHAT_MEDIA_THUMBNAIL_SIZE = config("CHAT_MEDIA_THUMBNAIL_SIZE", cast=int, default=320)
+CHAT_MEDIA_MAX_DIMENSION = config("CHAT_MEDIA_MAX_DIMENSION", cast=int, default=1600)
+CHAT_MEDIA_WEBP_QUALITY = config("CHAT_MEDIA_WEBP_QUALITY", cast=int, default=75)
+CHAT_MEDIA_JPEG_QUALITY = config("CHAT_MEDIA_JPEG_QUALITY", cast=int, default=82)
+# Media is stored once per content hash (see chat/storage.py). Blobs no message
+# refers to are deleted after CHAT_MEDIA_GC_GRACE seconds by a background task
+# running every CHAT_MEDIA_GC_INTERVAL seconds (0 disables it; use chat_media_gc).
+CHAT_MEDIA_GC_GRACE = config("CHAT_MEDIA_GC_GRACE", cast=int, default=3600)
+CHAT_MEDIA_GC_INTERVAL = config("CHAT_MEDIA_GC_INTERVAL", cast=int, default=3600)
+# Media is served by an authenticated view (see chat/serving.py). Set to
+# "nginx" to hand files off with X-Accel-Redirect (map CHAT_MEDIA_ACCEL_PREFIX
+# to MEDIA_ROOT in an 'internal' location) or "x-sendfile" for Apache/lighttpd.
+# Never expose MEDIA_ROOT directly in production.
+CHAT_MEDIA_SENDFILE = config("CHAT_MEDIA_SENDFILE", default="")
+CHAT_MEDIA_ACCEL_PREFIX = config("CHAT_MEDIA_ACCEL_PREFIX", default="/protected-media/")
+
+# =======================
+# Background jobs
+# =======================
+# Slow side effects (OTP emails, releasing deleted media) are queued in the
+# database and run by a loop inside each ASGI process (see chat/jobs.py). With
+# a dedicated `manage.py chat_worker` (the Procfile's worker), it can be
+# turned off; leaving it on as well is safe, workers share the queue.
+CHAT_JOB_WORKER_IN_PROCESS = config("CHAT_JOB_WORKER_IN_PROCESS", cast=bool, default=True)
+CHAT_JOB_POLL_INTERVAL = config("CHAT_JOB_POLL_INTERVAL", cast=float, default=1.0)
+CHAT_JOB_BATCH_SIZE = config("CHAT_JOB_BATCH_SIZE", cast=int, default=20)
+CHAT_JOB_MAX_ATTEMPTS = config("CHAT_JOB_MAX_ATTEMPTS", cast=int, default=5)
+# Retry n waits about CHAT_JOB_BACKOFF_BASE * 2**(n-1) seconds, at most CHAT_JOB_BACKOFF_MAX
+CHAT_JOB_BACKOFF_BASE = config("CHAT_JOB_BACKOFF_BASE", cast=float, default=2.0)
+CHAT_JOB_BACKOFF_MAX = config("CHAT_JOB_BACKOFF_MAX", cast=float, default=600.0)
+# A job still running after this many seconds is assumed dead and run again
+CHAT_JOB_LEASE = config("CHAT_JOB_LEASE", cast=int, default=300)
+# Completed jobs are kept this long (seconds) so idempotency keys keep working
+CHAT_JOB_RETENTION = config("CHAT_JOB_RETENTION", cast=int, default=86400)
+
+# =======================
+# Message archival
+# =======================
+# Messages older than a room's horizon (ChatRoom.archive_after_days, else
+# CHAT_ARCHIVE_AFTER_DAYS; 0 disables) move from chat_message into compressed
+# segments (see chat/archive.py). The job worker runs this every
+# CHAT_ARCHIVE_INTERVAL seconds (0 disables; use `manage.py chat_archive`).
+# Opt-in: archived messages stay readable in history and their media is still
+# served, but they can no longer be deleted or found by message search.
+CHAT_ARCHIVE_AFTER_DAYS = config("CHAT_ARCHIVE_AFTER_DAYS", cast=int, default=0)
+CHAT_ARCHIVE_SEGMENT_SIZE = config("CHAT_ARCHIVE_SEGMENT_SIZE", cast=int, default=500)
+CHAT_ARCHIVE_INTERVAL = config("CHAT_ARCHIVE_INTERVAL", cast=int, default=86400)
+# Soft-deleted messages are removed for good once this many days old
+CHAT_ARCHIVE_TOMBSTONE_GRACE_DAYS = config("CHAT_ARCHIVE_TOMBSTONE_GRACE_DAYS", cast=int, default=30)
 
 # =======================
 # Email
@@ -342,3 +500,6 @@ USE_X_FORWARDED_HOST = True
 # Default Auto Field
 # =======================
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# Partial indexes on chat.Message are skipped on MySQL by migration 0002
+SILENCED_SYSTEM_CHECKS = ["models.W037"]